@@ -4,8 +4,11 @@ import rich
 import typer
 from dotenv import load_dotenv
 
+from clippinator.minions.routing import router
 from clippinator.minions.taskmaster import Taskmaster
 from clippinator.project import Project
+from clippinator.project.vfs import format_vfs_stats
+from clippinator.tools.sandbox import format_usage_stats
 from clippinator.tools.utils import text_prompt
 
 load_dotenv()
@@ -19,16 +22,15 @@ def taskmaster(project_path: str, objective: str = ""):
     Create a new project using clippinator.
     """
     try:
-        if not objective and not os.path.exists(
-                os.path.join(project_path, ".clippinator.pkl")
-        ):
+        session_exists = Taskmaster.session_exists(os.path.join(project_path, ".clippinator.pkl"))
+        if not objective and not session_exists:
             objective = text_prompt("What project do I need to create?\n")
-        if not objective and os.path.exists(os.path.join(project_path, ".clippinator.pkl")):
+        if not objective and session_exists:
             print(os.path.join(project_path, ".clippinator.pkl"))
             tm = Taskmaster.load_from_file(os.path.join(project_path, ".clippinator.pkl"))
             tm.run(**tm.project.prompt_fields())
             return
-        elif os.path.exists(os.path.join(project_path, ".clippinator.pkl")):
+        elif session_exists:
             tm = Taskmaster.load_from_file(os.path.join(project_path, ".clippinator.pkl"))
             project = tm.project
             project.objective = objective
@@ -41,6 +43,13 @@ def taskmaster(project_path: str, objective: str = ""):
         tm.run(**project.prompt_fields())
     except KeyboardInterrupt:
         print("Interrupted. Agent is stopped.")
+    finally:
+        if router.stats:
+            rich.print("[bold]Model usage by role:[/bold]\n" + router.format_stats())
+        if format_vfs_stats():
+            rich.print("[bold]File cache:[/bold]\n" + format_vfs_stats())
+        if format_usage_stats():
+            rich.print("[bold]Commands:[/bold]\n" + format_usage_stats())
 
 
 if __name__ == "__main__":
@@ -20,7 +20,8 @@ from langchain.schema import AgentAction, AgentFinish
 
 from clippinator.tools.tool import WarningTool
 from .prompts import format_description
-from ..tools.utils import trim_extra, ask_for_feedback
+from .routing import router
+from ..tools.utils import trim_extra, ask_for_feedback, is_interactive
 
 long_warning = (
     "WARNING: You have been working for a very long time. Please, finish ASAP. "
@@ -111,19 +112,6 @@ class CustomOutputParser(AgentOutputParser):
         )
 
 
-def remove_project_summaries(text: str) -> str:
-    """
-    Remove all the project summaries from the text EXCEPT for the last occurrence
-    The project summary is between "Current project state:" and "---"
-    """
-    # Find all the project summaries
-    project_summaries = re.findall(r"Current project state:.*?-----", text, re.DOTALL)
-    # Remove all the project summaries except for the last one
-    for project_summary in project_summaries[:-1]:
-        text = text.replace(project_summary, "", 1)
-    return text
-
-
 def extract_variable_names(prompt: str, interaction_enabled: bool = False):
     variable_pattern = r"\{(\w+)\}"
     variable_names = re.findall(variable_pattern, prompt)
@@ -148,19 +136,29 @@ class BasicLLM:
     prompt: PromptTemplate
     llm: LLMChain
 
-    def __init__(self, base_prompt: str, model: str = "gpt-4-1106-preview") -> None:
-        llm = get_model(model)
-        self.llm = LLMChain(
-            llm=llm,
-            prompt=PromptTemplate(
-                template=base_prompt,
-                input_variables=extract_variable_names(base_prompt),
-            ),
+    def __init__(self, base_prompt: str, model: str = "gpt-4-1106-preview", role: str | None = None) -> None:
+        """
+        If `role` is given, the model is chosen by the router (with escalation on failure)
+        """
+        self.role = role
+        self.prompt = PromptTemplate(
+            template=base_prompt,
+            input_variables=extract_variable_names(base_prompt),
         )
+        self.chains: dict[str, LLMChain] = {}
+        self.llm = self.get_chain(router.model_for(role, model) if role else model)
+
+    def get_chain(self, model: str) -> LLMChain:
+        if model not in self.chains:
+            self.chains[model] = LLMChain(llm=get_model(model), prompt=self.prompt)
+        return self.chains[model]
 
     def run(self, **kwargs):
         kwargs["feedback"] = kwargs.get("feedback", "")
-        return self.llm.predict(**kwargs)
+        if not self.role:
+            return self.llm.predict(**kwargs)
+        return router.call(self.role, lambda model: self.get_chain(model).predict(**kwargs),
+                           accept=lambda result: bool(result.strip()))
 
 
 class CustomPromptTemplate(StringPromptTemplate):
@@ -247,11 +245,13 @@ class CustomPromptTemplate(StringPromptTemplate):
         )
         kwargs["tool_names"] = self.agent_toolnames
         if self.project:
-            for key, value in self.project.prompt_fields().items():
+            # The memories are picked by relevance to the current task and the latest thoughts
+            query = (kwargs.get("task") or kwargs.get("objective", "")) + "\n" + \
+                kwargs.get("agent_scratchpad", "")[-2000:]
+            for key, value in self.project.prompt_fields(query).items():
                 kwargs[key] = value
         # print("Prompt:\n\n" + self.template.format(**kwargs) + "\n\n\n")
-        result = remove_surrogates(
-            remove_project_summaries(self.template.format(**kwargs).replace('{tools}', kwargs['tools'])))
+        result = remove_surrogates(self.template.format(**kwargs).replace('{tools}', kwargs['tools']))
         result = trim_extra(result, 25000)
         if self.hook:
             self.hook(self)
@@ -272,6 +272,31 @@ def extract_variable_names(prompt: str, interaction_enabled: bool = False):
     return variable_names
 
 
+def run_with_escalation(role: str | None, llm_owner, attribute: str, run: Callable[[], str]) -> str:
+    """
+    Run the agent. If its output can't be parsed and the role has an escalation model, retry once with it:
+    `llm_owner.<attribute>` is swapped for that attempt only. The error of the escalated attempt is raised.
+    """
+    if not role:
+        return run()
+    escalation = router.escalation_for(role)
+    # The minion's own model if the role isn't configured in the router
+    model = getattr(getattr(llm_owner, attribute), "model_name", None) or router.model_for(role)
+    try:
+        return router.timed_call(role, model, lambda _: run(), escalated=False)
+    except langchain.schema.OutputParserException as e:
+        if not escalation:
+            raise
+        print(e)
+    print(f"Escalating {role} to {escalation}")
+    previous = getattr(llm_owner, attribute)
+    setattr(llm_owner, attribute, get_model(escalation))
+    try:
+        return router.timed_call(role, escalation, lambda _: run(), escalated=True)
+    finally:
+        setattr(llm_owner, attribute, previous)
+
+
 @dataclass
 class BaseMinion:
     def __init__(
@@ -281,8 +306,10 @@ class BaseMinion:
             model: str = "gpt-4-1106-preview",
             max_iterations: int = 50,
             allow_feedback: bool = False,
+            role: str | None = None,
     ) -> None:
-        llm = get_model(model)
+        self.role = role
+        llm = get_model(router.model_for(role, model) if role else model)
 
         agent_toolnames = [tool.name for tool in available_tools]
         available_tools.append(WarningTool().get_tool())
@@ -315,19 +342,19 @@ class BaseMinion:
         )
         self.allow_feedback = allow_feedback
 
+    def _run(self, **kwargs):
+        return run_with_escalation(
+            self.role, self.agent_executor.agent.llm_chain, "llm",
+            lambda: self.agent_executor.run(**kwargs) or "No result. The execution was probably unsuccessful.",
+        )
+
     def run(self, **kwargs):
         kwargs["feedback"] = kwargs.get("feedback", "")
         kwargs["format_description"] = format_description
-        if not self.allow_feedback:
-            return (
-                    self.agent_executor.run(**kwargs)
-                    or "No result. The execution was probably unsuccessful."
-            )
+        if not self.allow_feedback or not is_interactive():
+            return self._run(**kwargs)
         try:
-            return (
-                    self.agent_executor.run(**kwargs)
-                    or "No result. The execution was probably unsuccessful."
-            )
+            return self._run(**kwargs)
         except KeyboardInterrupt:
             feedback = ask_for_feedback()
             if feedback:
@@ -337,7 +364,10 @@ class BaseMinion:
 
 @dataclass
 class BaseMinionOpenAI:
-    def __init__(self, base_prompt, available_tools, model: str = "gpt-4-1106-preview") -> None:
+    def __init__(self, base_prompt, available_tools, model: str = "gpt-4-1106-preview",
+                 role: str | None = None) -> None:
+        self.role = role
+        model = router.model_for(role, model) if role else model
         if not model.endswith('-0613'):
             model += '-0613'
         llm = get_model(model)
@@ -364,30 +394,29 @@ class BaseMinionOpenAI:
         kwargs["feedback"] = kwargs.get("feedback", "")
         kwargs["format_description"] = ''
         kwargs['input'] = ''
-        initial_temperature = 0
-        if 'temperature' in kwargs:
-            try:
-                initial_temperature = self.agent_executor.agent.llm.temperature
-                self.agent_executor.agent.llm.temperature = kwargs['temperature']
-            except AttributeError:
-                pass
+        llm = self.agent_executor.agent.llm
+        initial_temperature = llm.temperature
+        llm.temperature = kwargs.pop('temperature', initial_temperature)
         try:
-            result = (
-                    self.agent_executor.run(**kwargs)
-                    or "No result. The execution was probably unsuccessful."
+            return run_with_escalation(
+                self.role, self.agent_executor.agent, "llm",
+                lambda: self.agent_executor.run(**kwargs) or "No result. The execution was probably unsuccessful.",
             )
-            self.agent_executor.agent.llm.temperature = initial_temperature
-            return result
         except langchain.schema.OutputParserException as e:
+            if self.role and router.escalation_for(self.role):
+                raise
+            # Without an escalation model, resample once with a higher temperature
             print(e)
-            kwargs['temperature'] = 0.7
-            return self.run(**kwargs)
+            llm.temperature = 0.7
+            return self.agent_executor.run(**kwargs) or "No result. The execution was probably unsuccessful."
+        finally:
+            llm.temperature = initial_temperature
 
 
 @dataclass
 class FeedbackMinion:
     underlying_minion: BaseMinion | BasicLLM
-    eval_llm: LLMChain
+    eval_llm: BasicLLM
     feedback_prompt: str
     check_function: Callable[[str], Any]
 
@@ -397,21 +426,27 @@ class FeedbackMinion:
             eval_prompt: str,
             feedback_prompt: str,
             check_function: Callable[[str], Any] = lambda x: None,
-            model: str = "gpt-4-1106-preview",
+            model: str | None = None,
     ) -> None:
-        llm = get_model(model)
-        self.eval_llm = LLMChain(
-            llm=llm,
-            prompt=PromptTemplate(
-                template=eval_prompt,
-                input_variables=extract_variable_names(eval_prompt),
-            ),
-        )
+        """
+        The evaluation model is chosen by the router ("evaluate" role) unless `model` is given.
+        A rejection by the cheap evaluator is confirmed by the escalation model.
+        """
+        self.eval_llm = BasicLLM(eval_prompt, model=model) if model else BasicLLM(eval_prompt, role="evaluate")
         self.underlying_minion = minion
         self.feedback_prompt = feedback_prompt
 
         self.check_function = check_function
 
+    def evaluate(self, res: str, **kwargs) -> str:
+        if not self.eval_llm.role:
+            return self.eval_llm.llm.predict(result=res, **kwargs)
+        return router.call(
+            "evaluate",
+            lambda model: self.eval_llm.get_chain(model).predict(result=res, **kwargs),
+            accept=lambda evaluation: "ACCEPT" in evaluation,
+        )
+
     def run(self, **kwargs):
         if "feedback" in kwargs:
             print("Rerunning a prompt with feedback:", kwargs["feedback"])
@@ -430,7 +465,7 @@ class FeedbackMinion:
             kwargs["feedback"] = check_result
             kwargs["previous_result"] = res
             return self.run(**kwargs)
-        evaluation = self.eval_llm.predict(result=res, **kwargs)
+        evaluation = self.evaluate(res, **kwargs)
         if "ACCEPT" in evaluation:
             return res
         kwargs["feedback"] = evaluation.split("Feedback: ", 1)[-1].strip()
@@ -1,7 +1,11 @@
+from functools import lru_cache
+from typing import Callable
+
 import yaml
 
 from clippinator import tools
 from clippinator.project import Project
+from clippinator.project.lint_pool import get_lint_pool
 from .base_minion import BaseMinion, BaseMinionOpenAI
 from .prompts import execution_prompt, get_specialized_prompt
 from ..tools.architectural import DeclareArchitecture
@@ -13,15 +17,23 @@ class Executioner:
     Can be specialized for different types of tasks (research, operations, code writing).
     """
     execution_agent: BaseMinion | BaseMinionOpenAI
+    lint_owner: object  # the lints of the files written by the agent go to its tool results
 
     def __init__(self, project: Project, use_openai: bool = True, allow_feedback: bool = False):
+        self.lint_owner = object()
         if use_openai:
-            self.execution_agent = BaseMinionOpenAI(execution_prompt, tools.get_tools(project, True))
+            self.execution_agent = BaseMinionOpenAI(execution_prompt, tools.get_tools(project, True, self.lint_owner),
+                                                    role="execute")
         else:
-            self.execution_agent = BaseMinion(execution_prompt, tools.get_tools(project), allow_feedback=allow_feedback)
+            self.execution_agent = BaseMinion(execution_prompt, tools.get_tools(project, lint_owner=self.lint_owner),
+                                              allow_feedback=allow_feedback, role="execute")
 
     def execute(self, task: str, project: Project, milestone: str = '', **kwargs) -> str:
-        return self.execution_agent.run(task=task, milestone=milestone, **project.prompt_fields(), **kwargs)
+        try:
+            return self.execution_agent.run(task=task, milestone=milestone, **project.prompt_fields(), **kwargs)
+        finally:
+            # The lints the agent didn't get before finishing would go to nobody
+            get_lint_pool(project.path).release(self.lint_owner)
 
 
 class SpecializedExecutioner(Executioner):
@@ -35,30 +47,65 @@ class SpecializedExecutioner(Executioner):
 
 def specialized_executioner(name: str, description: str, prompt: str,
                             tool_names: list[str], model: str = 'gpt-4-1106-preview',
-                            use_openai_functions: bool = True, allow_feedback: bool = False):
+                            use_openai_functions: bool = True, allow_feedback: bool = False,
+                            escalation_model: str | None = None):
     class SpecializedExecutionerN(SpecializedExecutioner):
         def __init__(self, project: Project):
-            super().__init__(project)
-            all_tools = tools.get_tools(project, use_openai_functions) + [DeclareArchitecture(project).get_tool()]
+            # Executioner.__init__ isn't called: it would build a general agent (and the tools) only to discard it
+            self.lint_owner = object()
+            all_tools = tools.get_tools(project, use_openai_functions, self.lint_owner) + \
+                [DeclareArchitecture(project).get_tool()]
             spe_tools = [tool for tool in all_tools if tool.name in tool_names]
             if use_openai_functions:
-                self.execution_agent = BaseMinionOpenAI(get_specialized_prompt(prompt), spe_tools)
+                self.execution_agent = BaseMinionOpenAI(get_specialized_prompt(prompt), spe_tools, role=name)
             else:
                 self.execution_agent = BaseMinion(get_specialized_prompt(prompt), spe_tools,
-                                                  allow_feedback=allow_feedback, model=model)
-            self.name = name
-            self.description = description
-
-        @classmethod
-        def expl(cls) -> str:
-            return f'    @{name} - {description}\n'
+                                                  allow_feedback=allow_feedback, model=model, role=name)
 
     SpecializedExecutionerN.__name__ = name
+    SpecializedExecutionerN.name = name
+    SpecializedExecutionerN.description = description
     return SpecializedExecutionerN
 
 
-def get_specialized_executioners(project) -> dict[str, SpecializedExecutioner]:
+class LazyExecutioner:
+    """
+    Builds the executioner (its model client and tools) on the first task.
+    The description for the prompt is available without building it.
+    """
+
+    def __init__(self, factory: Callable[[Project], Executioner], project: Project):
+        self.factory = factory
+        self.project = project
+        self.name = getattr(factory, 'name', 'default')
+        self._executioner: Executioner | None = None
+
+    def expl(self) -> str:
+        return self.factory.expl()
+
+    def build(self) -> Executioner:
+        """
+        Create a new instance (for running several tasks at the same time)
+        """
+        return self.factory(self.project)
+
+    @property
+    def executioner(self) -> Executioner:
+        if self._executioner is None:
+            self._executioner = self.build()
+        return self._executioner
+
+    def execute(self, task: str, project: Project, milestone: str = '', **kwargs) -> str:
+        return self.executioner.execute(task, project, milestone, **kwargs)
+
+
+@lru_cache
+def specialized_executioner_classes() -> dict[str, type[SpecializedExecutioner]]:
     with open('clippinator/minions/specialized_minions.yaml') as f:
         data = yaml.load(f, Loader=yaml.FullLoader)
-        return {line['name']: specialized_executioner(**{k.replace('-', '_'): v for k, v in line.items()})(project)
-                for line in data}
+    return {line['name']: specialized_executioner(**{k.replace('-', '_'): v for k, v in line.items()})
+            for line in data if 'name' in line}
+
+
+def get_specialized_executioners(project) -> dict[str, LazyExecutioner]:
+    return {name: LazyExecutioner(cls, project) for name, cls in specialized_executioner_classes().items()}
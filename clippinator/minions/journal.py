@@ -0,0 +1,395 @@
+from __future__ import annotations
+
+import atexit
+import dataclasses
+import json
+import os
+import pickle
+import struct
+import time
+import uuid
+import weakref
+import zlib
+from collections.abc import MutableSequence
+from typing import Any
+
+from langchain.schema import AgentAction
+
+from clippinator.project import Project
+
+SESSION_VERSION = 2
+_index_entry = struct.Struct("<cQI")  # record kind, offset, length
+_index_magic = b"CLPX"
+_generation_len = 12
+_legacy_header = struct.Struct("<II")  # payload length, crc32 (pickled journal records)
+
+STEP, STATE, PROJECT, TRUNCATE = b"s", b"t", b"p", b"x"
+
+
+def step_to_json(step: tuple[AgentAction, str]) -> dict:
+    action, result = step
+    return {"tool": action.tool, "tool_input": action.tool_input, "log": action.log, "result": result}
+
+
+def step_from_json(data: dict) -> tuple[AgentAction, str]:
+    return AgentAction(tool=data["tool"], tool_input=data["tool_input"], log=data["log"]), data["result"]
+
+
+def project_to_json(project: Project) -> dict:
+    # The summary cache is recomputed for every prompt, there's no need to store it
+    data = dataclasses.asdict(project)
+    data.pop("summary_cache", None)
+    return data
+
+
+def project_from_json(data: dict) -> Project:
+    known = {field.name for field in dataclasses.fields(Project)}
+    return Project(**{k: v for k, v in data.items() if k in known})
+
+
+class _StepRef:
+    __slots__ = ("offset", "length")
+
+    def __init__(self, offset: int, length: int):
+        self.offset = offset
+        self.length = length
+
+
+class LazySteps(MutableSequence):
+    """
+    A list of (AgentAction, result) steps where the steps stored in the session file
+    are read only when they are accessed
+    """
+
+    def __init__(self, journal: StepJournal, refs: list[_StepRef | tuple]):
+        self.journal = journal
+        self.items = refs
+
+    def _resolve(self, i: int):
+        item = self.items[i]
+        if isinstance(item, _StepRef):
+            return step_from_json(self.journal.read_record(item.offset, item.length)["step"])
+        return item
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._resolve(j) for j in range(len(self.items))[i]]
+        return self._resolve(range(len(self.items))[i])
+
+    def __setitem__(self, i, value):
+        if isinstance(i, slice):
+            self.items[i] = list(value)
+        else:
+            self.items[i] = value
+
+    def __delitem__(self, i):
+        del self.items[i]
+
+    def __len__(self) -> int:
+        return len(self.items)
+
+    def insert(self, i: int, value) -> None:
+        self.items.insert(i, value)
+
+
+# The journals to flush at exit. Weak references: a journal which is no longer used isn't kept alive until exit
+open_journals: weakref.WeakSet[StepJournal] = weakref.WeakSet()
+
+
+@atexit.register
+def close_journals():
+    for journal in list(open_journals):
+        journal.close()
+
+
+class StepJournal:
+    """
+    Versioned, append-only session storage for the Taskmaster.
+    `.clippinator.session` is JSONL: a header line with the format version, then one record per line
+    (a step, the prompt counters, the project, or a truncation of the step list).
+    `.clippinator.session.idx` holds a fixed-size (kind, offset, length) entry per record,
+    so resuming reads only the index, the last state and project records; old steps are read on demand.
+    Steps are stored as plain fields, so the format doesn't depend on langchain's classes.
+    """
+
+    def __init__(self, snapshot_path: str, snapshot_every: int = 200, fsync_every: int = 5,
+                 fsync_interval: float = 2.0):
+        base = os.path.splitext(snapshot_path)[0]
+        self.legacy_path = base + ".pkl"
+        self.legacy_journal_path = base + ".journal"
+        self.data_path = base + ".session"
+        self.index_path = base + ".session.idx"
+        self.snapshot_every = snapshot_every
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+        self.records_since_snapshot = 0
+        self.unsynced = 0
+        self.last_fsync = time.time()
+        self.steps_saved = 0
+        self.last_state: dict[str, Any] = {}
+        self.last_project: dict | None = None
+        self.data_file = None
+        self.index_file = None
+        self.read_fd: int | None = None
+        self.loaded = False
+        open_journals.add(self)
+
+    # Reading
+
+    def read_fd_or_open(self) -> int:
+        if self.read_fd is None:
+            self.read_fd = os.open(self.data_path, os.O_RDONLY)
+        return self.read_fd
+
+    def read_record(self, offset: int, length: int) -> dict:
+        if self.data_file is not None:
+            self.data_file.flush()
+        return json.loads(os.pread(self.read_fd_or_open(), length, offset))
+
+    def _read_index(self, generation: str, data_size: int) -> list[tuple[bytes, int, int]] | None:
+        if not os.path.exists(self.index_path):
+            return None
+        with open(self.index_path, "rb") as f:
+            raw = f.read()
+        if raw[:len(_index_magic)] != _index_magic or \
+                raw[len(_index_magic):len(_index_magic) + _generation_len].decode(errors="ignore") != generation:
+            return None
+        entries = []
+        start = len(_index_magic) + _generation_len
+        for pos in range(start, len(raw) - _index_entry.size + 1, _index_entry.size):
+            kind, offset, length = _index_entry.unpack_from(raw, pos)
+            if offset + length > data_size:
+                break
+            entries.append((kind, offset, length))
+        return entries
+
+    def _scan(self, offset: int) -> list[tuple[bytes, int, int]]:
+        """
+        Index the records starting at `offset` by reading the data file (for recovery after a crash)
+        """
+        entries = []
+        with open(self.data_path, "rb") as f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    kind = json.loads(line)["k"].encode()
+                except (ValueError, KeyError):
+                    break
+                entries.append((kind, offset, len(line) - 1))
+                offset += len(line)
+        return entries
+
+    def load(self) -> tuple[dict[str, Any], Project]:
+        """
+        Read the index and the latest state and project. Steps are loaded lazily.
+        A session in the legacy pickle format is converted.
+        """
+        if not os.path.exists(self.data_path):
+            prompt, project = self._load_legacy()
+            self.write_snapshot({k: v for k, v in prompt.items() if k != "intermediate_steps"},
+                                prompt["intermediate_steps"], project)
+            return prompt, project
+        with open(self.data_path, "rb") as f:
+            header_line = f.readline()
+        header = json.loads(header_line)
+        if header.get("version", 0) > SESSION_VERSION:
+            raise ValueError(f"Session format version {header.get('version')} is newer than supported "
+                             f"({SESSION_VERSION}), please update clippinator")
+        data_size = os.path.getsize(self.data_path)
+        entries = self._read_index(header["generation"], data_size)
+        if entries is None:
+            entries = self._scan(len(header_line))
+            self._write_index(header["generation"], entries)
+        else:
+            with open(self.index_path, "r+b") as f:
+                f.truncate(len(_index_magic) + _generation_len + len(entries) * _index_entry.size)
+            tail = entries[-1][1] + entries[-1][2] + 1 if entries else len(header_line)
+            missing = self._scan(tail)
+            if missing:
+                with open(self.index_path, "ab") as f:
+                    f.write(b"".join(_index_entry.pack(*entry) for entry in missing))
+            entries += missing
+        valid_end = entries[-1][1] + entries[-1][2] + 1 if entries else len(header_line)
+        if valid_end < data_size:
+            # Drop the torn tail so that new records are appended after valid ones
+            with open(self.data_path, "r+b") as f:
+                f.truncate(valid_end)
+
+        refs: list = []
+        state_entry = project_entry = None
+        for kind, offset, length in entries:
+            if kind == STEP:
+                refs.append(_StepRef(offset, length))
+            elif kind == TRUNCATE:
+                del refs[self.read_record(offset, length)["n"]:]
+            elif kind == STATE:
+                state_entry = (offset, length)
+            elif kind == PROJECT:
+                project_entry = (offset, length)
+        if project_entry is None:
+            # Every session starts with a snapshot, so its project record was torn or lost
+            raise ValueError(f"The session {self.data_path} is corrupt: it has no project record")
+        prompt = self.read_record(*state_entry)["state"] if state_entry else {}
+        self.last_project = self.read_record(*project_entry)["project"]
+        project = project_from_json(self.last_project)
+        self.steps_saved = len(refs)
+        self.last_state = dict(prompt)
+        self.records_since_snapshot = sum(kind != STEP for kind, _, _ in entries)
+        self.loaded = True
+        prompt["intermediate_steps"] = LazySteps(self, refs)
+        return prompt, project
+
+    def _load_legacy(self) -> tuple[dict[str, Any], Project]:
+        """
+        Load the pickled snapshot and the pickled journal records of older versions
+        """
+        prompt, project = {"intermediate_steps": []}, None
+        if os.path.exists(self.legacy_path):
+            with open(self.legacy_path, "rb") as f:
+                prompt, project = pickle.load(f)
+        steps = list(prompt.pop("intermediate_steps", []))
+        if os.path.exists(self.legacy_journal_path):
+            with open(self.legacy_journal_path, "rb") as f:
+                data = f.read()
+            pos = 0
+            while pos + _legacy_header.size <= len(data):
+                length, crc = _legacy_header.unpack_from(data, pos)
+                payload = data[pos + _legacy_header.size: pos + _legacy_header.size + length]
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    break
+                record = pickle.loads(payload)
+                del steps[record["start"]:]
+                steps.extend(record["steps"])
+                prompt.update(record["state"])
+                if "project" in record:
+                    project = pickle.loads(record["project"])
+                pos += _legacy_header.size + length
+        prompt["intermediate_steps"] = steps
+        return prompt, project
+
+    # Writing
+
+    def _write_index(self, generation: str, entries: list[tuple[bytes, int, int]], path: str = ""):
+        with open(path or self.index_path, "wb") as f:
+            f.write(_index_magic + generation.encode())
+            f.write(b"".join(_index_entry.pack(*entry) for entry in entries))
+            f.flush()
+            os.fsync(f.fileno())
+
+    def _open(self):
+        if self.data_file is None:
+            self.data_file = open(self.data_path, "ab")
+            self.index_file = open(self.index_path, "ab")
+        return self.data_file
+
+    def _append_record(self, kind: bytes, record: dict):
+        f = self._open()
+        line = json.dumps({"k": kind.decode(), **record}).encode()
+        offset = f.tell()
+        f.write(line + b"\n")
+        self.index_file.write(_index_entry.pack(kind, offset, len(line)))
+
+    def append(self, prompt_state: dict[str, Any], steps: list, project: Project) -> None:
+        """
+        Write the steps which were not saved yet, the prompt counters (if changed) and the project (if changed)
+        """
+        if not self.loaded or not os.path.exists(self.data_path):
+            # A new session (or a new Taskmaster over an old one) starts from a fresh snapshot
+            self.write_snapshot(prompt_state, steps, project)
+            return
+        written = False
+        if len(steps) < self.steps_saved:
+            self._append_record(TRUNCATE, {"n": len(steps)})
+            self.steps_saved = len(steps)
+            self.records_since_snapshot += 1
+            written = True
+        for step in steps[self.steps_saved:]:
+            self._append_record(STEP, {"step": step_to_json(step)})
+            written = True
+        self.steps_saved = len(steps)
+        if prompt_state != self.last_state:
+            self._append_record(STATE, {"state": prompt_state})
+            self.last_state = dict(prompt_state)
+            self.records_since_snapshot += 1
+            written = True
+        project_data = project_to_json(project)
+        if project_data != self.last_project:
+            self._append_record(PROJECT, {"project": project_data})
+            self.last_project = project_data
+            self.records_since_snapshot += 1
+            written = True
+        if not written:
+            return
+        self.data_file.flush()
+        self.index_file.flush()
+        self.unsynced += 1
+        if self.unsynced >= self.fsync_every or time.time() - self.last_fsync >= self.fsync_interval:
+            self.sync()
+
+    def sync(self):
+        if self.data_file is not None and self.unsynced:
+            os.fsync(self.data_file.fileno())
+            os.fsync(self.index_file.fileno())
+        self.unsynced = 0
+        self.last_fsync = time.time()
+
+    def needs_snapshot(self) -> bool:
+        return self.records_since_snapshot >= self.snapshot_every
+
+    def write_snapshot(self, prompt_state: dict[str, Any], steps: list, project: Project) -> None:
+        """
+        Rewrite the session compactly (all steps, then the latest state and project) and atomically replace it.
+        Stored steps are copied as raw lines without being parsed.
+        """
+        generation = uuid.uuid4().hex[:_generation_len]
+        tmp_path = self.data_path + ".tmp"
+        entries = []
+        new_refs = []
+        items = steps.items if isinstance(steps, LazySteps) else list(steps)
+        with open(tmp_path, "wb") as f:
+            f.write(json.dumps({"format": "clippinator-session", "version": SESSION_VERSION,
+                                "generation": generation}).encode() + b"\n")
+
+            def write(kind: bytes, line: bytes):
+                entries.append((kind, f.tell(), len(line)))
+                f.write(line + b"\n")
+
+            for item in items:
+                if isinstance(item, _StepRef):
+                    write(STEP, os.pread(self.read_fd_or_open(), item.length, item.offset))
+                else:
+                    write(STEP, json.dumps({"k": "s", "step": step_to_json(item)}).encode())
+                new_refs.append(_StepRef(entries[-1][1], entries[-1][2]))
+            write(STATE, json.dumps({"k": "t", "state": prompt_state}).encode())
+            write(PROJECT, json.dumps({"k": "p", "project": project_to_json(project)}).encode())
+            f.flush()
+            os.fsync(f.fileno())
+        self._write_index(generation, entries, self.index_path + ".tmp")
+        self.close()
+        os.replace(tmp_path, self.data_path)
+        os.replace(self.index_path + ".tmp", self.index_path)
+        if isinstance(steps, LazySteps):
+            steps.items[:] = new_refs
+        self.loaded = True
+        self.steps_saved = len(items)
+        self.last_state = dict(prompt_state)
+        self.last_project = project_to_json(project)
+        self.records_since_snapshot = 0
+
+    def close(self):
+        if self.data_file is not None:
+            self.sync()
+            self.data_file.close()
+            self.index_file.close()
+            self.data_file = self.index_file = None
+        if self.read_fd is not None:
+            os.close(self.read_fd)
+            self.read_fd = None
+        open_journals.discard(self)
+
+    @staticmethod
+    def exists(snapshot_path: str) -> bool:
+        base = os.path.splitext(snapshot_path)[0]
+        return any(os.path.exists(base + ext) for ext in (".session", ".pkl", ".journal"))
@@ -1,29 +1,300 @@
-from .base_minion import BaseMinion
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
 from dataclasses import dataclass, field
-from langchain.vectorstores import FAISS
+from functools import lru_cache
+from typing import Any
+
+import numpy as np
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+
+class HashingEmbedder:
+    """
+    A local embedder: words and character trigrams are hashed into a fixed number of buckets.
+    It doesn't need the network, so the memory works (and can be benchmarked) offline.
+    """
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def _features(self, text: str) -> list[str]:
+        words = re.findall(r"\w+", text.lower())
+        trigrams = [word[i:i + 3] for word in words if len(word) > 3 for i in range(len(word) - 2)]
+        return words + trigrams
+
+    def embed_documents(self, texts: list[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature in self._features(text):
+                digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+                bucket = int.from_bytes(digest[:4], "little") % self.dim
+                vectors[row, bucket] += 1.0 if digest[4] & 1 else -1.0
+        return normalize(vectors)
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return self.embed_documents([text])[0]
+
+
+class OpenAIEmbedder:
+    """
+    OpenAI embeddings through langchain (which sends the texts in batches)
+    """
+
+    def __init__(self, model: str = "text-embedding-ada-002", dim: int = 1536):
+        from langchain.embeddings import OpenAIEmbeddings
+
+        self.embeddings = OpenAIEmbeddings(model=model)
+        self.dim = dim
+        self.name = model
+
+    def embed_documents(self, texts: list[str]) -> np.ndarray:
+        return normalize(np.array(self.embeddings.embed_documents(texts), dtype=np.float32).reshape(-1, self.dim))
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return self.embed_documents([text])[0]
+
+
+class CachedEmbedder:
+    """
+    Caches the embeddings of another embedder by text hash, only the missing texts are embedded.
+    The document embeddings are appended to a file of fixed-size records (the hex SHA-1 of the text and the vector),
+    the query embeddings are kept only in memory (the last `query_cache_size` of them).
+    """
+
+    query_cache_size = 256
+
+    def __init__(self, embedder, path: str):
+        self.embedder = embedder
+        self.dim = embedder.dim
+        self.name = embedder.name
+        self.path = path
+        self.record = np.dtype([("key", "S40"), ("vector", np.float32, (self.dim,))])
+        self.cache: dict[str, np.ndarray] = {}
+        self.queries: OrderedDict[str, np.ndarray] = OrderedDict()
+        self.lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        legacy_path = os.path.splitext(self.path)[0] + ".npz"
+        if os.path.exists(legacy_path) and not os.path.exists(self.path):
+            # The older versions rewrote the whole cache as .npz
+            data = np.load(legacy_path)
+            self._append(data["keys"].tolist(), data["vectors"])
+            os.remove(legacy_path)
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, "rb") as f:
+            data = f.read()
+        valid = len(data) - len(data) % self.record.itemsize
+        if valid < len(data):
+            # A torn record at the end
+            with open(self.path, "r+b") as f:
+                f.truncate(valid)
+        records = np.frombuffer(data[:valid], dtype=self.record)
+        self.cache = dict(zip((key.decode() for key in records["key"]), records["vector"]))
+
+    def _append(self, keys: list[str], vectors: np.ndarray):
+        records = np.zeros(len(keys), dtype=self.record)
+        records["key"] = keys
+        records["vector"] = vectors
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "ab") as f:
+            f.write(records.tobytes())
+
+    def embed_documents(self, texts: list[str]) -> np.ndarray:
+        keys = [hashlib.sha1(text.encode()).hexdigest() for text in texts]
+        missing = {key: text for key, text in zip(keys, texts) if key not in self.cache}
+        if missing:
+            vectors = self.embedder.embed_documents(list(missing.values()))
+            with self.lock:
+                new = [key for key in missing if key not in self.cache]
+                self.cache.update(zip(missing.keys(), vectors))
+                if new:
+                    self._append(new, np.stack([self.cache[key] for key in new]))
+        return np.stack([self.cache[key] for key in keys]) if keys else np.zeros((0, self.dim), np.float32)
+
+    def embed_query(self, text: str) -> np.ndarray:
+        key = hashlib.sha1(text.encode()).hexdigest()
+        with self.lock:
+            if key in self.cache:
+                return self.cache[key]
+            if key in self.queries:
+                self.queries.move_to_end(key)
+                return self.queries[key]
+        vector = self.embedder.embed_query(text)
+        with self.lock:
+            self.queries[key] = vector
+            while len(self.queries) > self.query_cache_size:
+                self.queries.popitem(last=False)
+        return vector
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+def get_embedder(cache_dir: str):
+    """
+    The embedder is chosen with CLIPPINATOR_EMBEDDINGS: "hashing" (default, offline) or "openai"
+    """
+    if os.environ.get("CLIPPINATOR_EMBEDDINGS", "hashing") == "openai":
+        embedder = OpenAIEmbedder()
+        return CachedEmbedder(embedder, os.path.join(cache_dir, f"embeddings-{embedder.name}.bin"))
+    return HashingEmbedder()
+
+
+_minhash_prime = (1 << 31) - 1
+_minhash_rng = np.random.default_rng(42)
+_minhash_a = _minhash_rng.integers(1, _minhash_prime, 64, dtype=np.int64)
+_minhash_b = _minhash_rng.integers(0, _minhash_prime, 64, dtype=np.int64)
+
+
+@lru_cache(maxsize=4096)
+def minhash(text: str) -> np.ndarray:
+    """
+    MinHash signature (64 permutations) of the character 4-grams of the normalized text
+    """
+    text = " ".join(re.findall(r"\w+", text.lower()))
+    shingles = {text[i:i + 4] for i in range(max(len(text) - 3, 1))}
+    hashes = np.array([int.from_bytes(hashlib.blake2b(shingle.encode(), digest_size=4).digest(), "little")
+                       % _minhash_prime for shingle in shingles], dtype=np.int64)
+    return ((np.outer(hashes, _minhash_a) + _minhash_b) % _minhash_prime).min(axis=0)
+
+
+def similarity(text_1: str, text_2: str) -> float:
+    """
+    Estimated Jaccard similarity of two texts
+    """
+    return float(np.mean(minhash(text_1) == minhash(text_2)))
+
+
+def find_near_duplicate(text: str, texts: list[str], threshold: float = 0.9) -> str | None:
+    for other in texts:
+        if similarity(text, other) >= threshold:
+            return other
+    return None
 
 
 @dataclass
-class Memory(BaseMinion):
+class Memory:
     """
     The minion responsible for:
     - Saving stuff to the memory
     - Retrieving stuff from the memory
 
-    storage: the vector storage of the memory snippets
+    path: the directory with the index (vectors.f32 - the raw vectors, meta.jsonl - one line per snippet)
     available_sources: a dictionary of the available sources for the snippets, for instance, different documentations
     """
 
-    storage: FAISS = field(default_factory=FAISS)
+    path: str
+    embedder: Any = None
     available_sources: dict[str, str] = field(default_factory=dict)
+    snippets: list[dict] = field(default_factory=list)
+    vectors: np.ndarray | None = None
+
+    def __post_init__(self):
+        self.embedder = self.embedder or get_embedder(self.path)
+        self.index_path = os.path.join(self.path, self.embedder.name)
+        self.lock = threading.Lock()
+        self._faiss_index = None
+        self.vectors = np.zeros((0, self.embedder.dim), dtype=np.float32)
+        self.load()
+
+    @property
+    def _vectors_path(self) -> str:
+        return os.path.join(self.index_path, "vectors.f32")
+
+    @property
+    def _meta_path(self) -> str:
+        return os.path.join(self.index_path, "meta.jsonl")
+
+    def load(self):
+        if not os.path.exists(self._meta_path):
+            return
+        with open(self._meta_path) as f:
+            snippets = [json.loads(line) for line in f if line.endswith("\n")]
+        vectors = np.fromfile(self._vectors_path, dtype=np.float32).reshape(-1, self.embedder.dim)
+        # After a crash, one of the files can be longer than the other
+        count = min(len(snippets), len(vectors))
+        self.snippets = snippets[:count]
+        self.vectors = vectors[:count].copy()
+        for snippet in self.snippets:
+            if snippet.get("src"):
+                self.available_sources[snippet["src"]] = snippet["src"]
+
+    def save_snippets(self, snippets: list[str], src: str = "", **metadata) -> list[int]:
+        """
+        Embed the snippets in one batch and append them to the index (on disk, too)
+        """
+        if not snippets:
+            return []
+        vectors = self.embedder.embed_documents(snippets).astype(np.float32)
+        with self.lock:
+            if src and src not in self.available_sources:
+                self.available_sources[src] = src
+            records = [{"text": snippet, "src": src, **metadata} for snippet in snippets]
+            os.makedirs(self.index_path, exist_ok=True)
+            with open(self._vectors_path, "ab") as f:
+                f.write(vectors.tobytes())
+            with open(self._meta_path, "a") as f:
+                f.write("".join(json.dumps(record) + "\n" for record in records))
+            start = len(self.snippets)
+            self.snippets += records
+            self.vectors = np.concatenate([self.vectors, vectors])
+            self._faiss_index = None
+        return list(range(start, start + len(snippets)))
 
-    def save_snippet(self, snippet: str, src: str = ""):
-        if src and src not in self.available_sources:
-            self.available_sources[src] = src
-        self.storage.add_texts([snippet], [{"src": src}])
+    def save_snippet(self, snippet: str, src: str = "", **metadata) -> int:
+        return self.save_snippets([snippet], src, **metadata)[0]
 
-    def retrieve(self, query: str, n: int = 5) -> list[(str, str)]:  # (snippet, src)
-        return [
-            (doc.page_content, doc.metadata.get("src", ""))
-            for doc in self.storage.similarity_search(query, n)
-        ]
+    def search(self, query: str, n: int = 5, **filters) -> list[tuple[float, dict]]:
+        """
+        Get (similarity, snippet record) for the closest snippets which match the metadata filters
+        """
+        if not self.snippets:
+            return []
+        query_vector = self.embedder.embed_query(query).astype(np.float32)
+        if filters:
+            rows = [i for i, snippet in enumerate(self.snippets)
+                    if all(snippet.get(key) == value for key, value in filters.items())]
+            if not rows:
+                return []
+            scores = self.vectors[rows] @ query_vector
+            best = np.argsort(-scores)[:n]
+            return [(float(scores[i]), self.snippets[rows[i]]) for i in best]
+        if faiss is not None:
+            if self._faiss_index is None:
+                self._faiss_index = faiss.IndexFlatIP(self.embedder.dim)
+                self._faiss_index.add(self.vectors)
+            scores, ids = self._faiss_index.search(query_vector.reshape(1, -1), min(n, len(self.snippets)))
+            return [(float(score), self.snippets[i]) for score, i in zip(scores[0], ids[0]) if i >= 0]
+        scores = self.vectors @ query_vector
+        best = np.argsort(-scores)[:n]
+        return [(float(scores[i]), self.snippets[i]) for i in best]
+
+    def retrieve(self, query: str, n: int = 5, **filters) -> list[(str, str)]:  # (snippet, src)
+        return [(snippet["text"], snippet.get("src", "")) for _, snippet in self.search(query, n, **filters)]
+
+
+memory_cache: dict[str, Memory] = {}
+
+
+def get_memory(project_path: str) -> Memory:
+    """
+    The memory of the project, stored in .clippinator/memory
+    """
+    if project_path not in memory_cache:
+        memory_cache[project_path] = Memory(os.path.join(project_path, ".clippinator", "memory"))
+    return memory_cache[project_path]
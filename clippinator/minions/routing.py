@@ -0,0 +1,144 @@
+from __future__ import annotations
+
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Callable, TypeVar
+
+import langchain.schema
+import yaml
+from langchain.callbacks import get_openai_callback
+
+DEFAULT_MODEL = "gpt-4-1106-preview"
+CHEAP_MODEL = "gpt-3.5-turbo"
+
+T = TypeVar("T")
+
+
+@dataclass
+class RolePolicy:
+    """
+    model: the model used for the role by default
+    escalation_model: the stronger model to retry with when the output can't be parsed or is rejected
+    """
+    model: str = DEFAULT_MODEL
+    escalation_model: str | None = None
+
+
+@dataclass
+class RoleStats:
+    calls: int = 0
+    escalations: int = 0
+    failures: int = 0
+    latency: float = 0.0
+    tokens: int = 0
+    cost: float = 0.0
+
+    def __str__(self) -> str:
+        avg = self.latency / self.calls if self.calls else 0.0
+        return f"{self.calls} calls, {self.escalations} escalations, {self.failures} failures, " \
+               f"avg {avg:.1f}s, {self.tokens} tokens, ${self.cost:.3f}"
+
+
+default_policies = {
+    "summarize": RolePolicy(CHEAP_MODEL, DEFAULT_MODEL),
+    "evaluate": RolePolicy(CHEAP_MODEL, DEFAULT_MODEL),
+}
+
+
+def load_routing_config(path: str = 'clippinator/minions/specialized_minions.yaml') -> dict[str, RolePolicy]:
+    """
+    Read the routing policies from specialized_minions.yaml.
+    Entries with `role` configure the generic roles (summarize, evaluate),
+    entries with `name` (the minions) can set `model` and `escalation-model`.
+    """
+    policies = dict(default_policies)
+    try:
+        with open(path) as f:
+            data = yaml.load(f, Loader=yaml.FullLoader) or []
+    except FileNotFoundError:
+        return policies
+    for line in data:
+        role = line.get('role') or line.get('name')
+        if not role or ('role' not in line and 'model' not in line and 'escalation-model' not in line):
+            continue
+        policies[role] = RolePolicy(
+            model=line.get('model', DEFAULT_MODEL),
+            escalation_model=line.get('escalation-model'),
+        )
+    return policies
+
+
+class ModelRouter:
+    """
+    Picks the model for each role and escalates to a stronger model when the cheap one fails.
+    Collects latency/token/cost stats per role and the model which handled the calls
+    (the minions call it from several threads at once).
+    """
+
+    def __init__(self, policies: dict[str, RolePolicy] | None = None):
+        self.policies = policies if policies is not None else load_routing_config()
+        self.stats: dict[tuple[str, str], RoleStats] = {}  # (role, model) -> stats
+        self.lock = threading.Lock()
+
+    def policy(self, role: str) -> RolePolicy:
+        return self.policies.get(role, RolePolicy())
+
+    def model_for(self, role: str, default: str = DEFAULT_MODEL) -> str:
+        if role not in self.policies:
+            return default
+        return self.policies[role].model
+
+    def escalation_for(self, role: str) -> str | None:
+        escalation = self.policy(role).escalation_model
+        if escalation == self.model_for(role):
+            return None
+        return escalation
+
+    def record(self, role: str, model: str, latency: float, tokens: int = 0, cost: float = 0.0,
+               escalated: bool = False, failed: bool = False):
+        with self.lock:
+            stats = self.stats.setdefault((role, model), RoleStats())
+            stats.calls += 1
+            stats.latency += latency
+            stats.tokens += tokens
+            stats.cost += cost
+            stats.escalations += escalated
+            stats.failures += failed
+
+    def timed_call(self, role: str, model: str, func: Callable[[str], T], escalated: bool) -> T:
+        """
+        Run `func(model)`, the stats are recorded for the model (the one which actually handles the call)
+        """
+        start = time.time()
+        with get_openai_callback() as cb:
+            try:
+                result = func(model)
+            except Exception:
+                self.record(role, model, time.time() - start, cb.total_tokens, cb.total_cost, escalated, failed=True)
+                raise
+        self.record(role, model, time.time() - start, cb.total_tokens, cb.total_cost, escalated)
+        return result
+
+    def call(self, role: str, func: Callable[[str], T], accept: Callable[[T], bool] = lambda _: True) -> T:
+        """
+        Run `func(model)` with the model for the role. If parsing fails or `accept` rejects the output,
+        run it again with the escalation model (if there is one).
+        """
+        escalation = self.escalation_for(role)
+        try:
+            result = self.timed_call(role, self.model_for(role), func, escalated=False)
+            if accept(result) or not escalation:
+                return result
+        except (langchain.schema.OutputParserException, ValueError):
+            if not escalation:
+                raise
+        print(f"Escalating {role} to {escalation}")
+        return self.timed_call(role, escalation, func, escalated=True)
+
+    def format_stats(self) -> str:
+        with self.lock:
+            return "\n".join(f"{role} ({model}): {stats}" for (role, model), stats in self.stats.items())
+
+
+router = ModelRouter()
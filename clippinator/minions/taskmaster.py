@@ -1,12 +1,16 @@
 from __future__ import annotations
 
+import multiprocessing
 import os
-import pickle
+import signal
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout, redirect_stderr
 
 from langchain import LLMChain
 from langchain.agents import AgentExecutor, LLMSingleActionAgent
 
 from clippinator.project import Project
+from clippinator.project.lint_pool import get_lint_pool
 from clippinator.tools import get_tools, SimpleTool
 from clippinator.tools.subagents import Subagent
 from clippinator.tools.tool import WarningTool
@@ -17,9 +21,12 @@ from .base_minion import (
     get_model,
     BasicLLM,
 )
-from .executioner import Executioner, get_specialized_executioners
+from .executioner import Executioner, LazyExecutioner, get_specialized_executioners
+from .journal import StepJournal
 from .prompts import taskmaster_prompt, summarize_prompt, format_description, get_selfcall_objective
-from ..tools.utils import ask_for_feedback
+from ..tools.python_kernel import close_kernels
+from ..tools.terminal import close_shells, end_sessions
+from ..tools.utils import ask_for_feedback, is_interactive, set_interactive
 
 
 class Taskmaster:
@@ -32,19 +39,22 @@ class Taskmaster:
     ):
         self.project = project
         self.specialized_executioners = get_specialized_executioners(project)
-        self.default_executioner = Executioner(project)
+        self.default_executioner = LazyExecutioner(Executioner, project)
         self.inner_taskmaster = inner_taskmaster
         llm = get_model(model)
-        tools = get_tools(project)
+        self.lint_owner = object()
+        tools = get_tools(project, lint_owner=self.lint_owner)
         tools.append(SelfCall(project).get_tool(try_structured=False))
 
         agent_tool_names = [
             'DeclareArchitecture', 'ReadFile', 'WriteFile', 'Bash', 'BashBackground', 'Human',
-            'Remember', 'TemplateInfo', 'TemplateSetup', 'SetCI', 'Search'
+            'Remember', 'Recall', 'SearchCode', 'TemplateInfo', 'TemplateSetup', 'SetCI', 'Search'
         ]
 
         if not inner_taskmaster:
             agent_tool_names.append('SelfCall')
+        if not is_interactive():
+            agent_tool_names.remove('Human')
 
         tools.append(
             Subagent(
@@ -60,10 +70,11 @@ class Taskmaster:
                 taskmaster_prompt, interaction_enabled=True
             ),
             agent_toolnames=agent_tool_names,
-            my_summarize_agent=BasicLLM(base_prompt=summarize_prompt),
+            my_summarize_agent=BasicLLM(base_prompt=summarize_prompt, role="summarize"),
             project=project,
         )
-        self.prompt.hook = lambda _: self.save_to_file()
+        self.journal = StepJournal(os.path.join(project.path, ".clippinator.pkl"))
+        self.prompt.hook = lambda _: self.checkpoint()
 
         llm_chain = LLMChain(llm=llm, prompt=self.prompt)
 
@@ -93,38 +104,84 @@ class Taskmaster:
                     or "No result. The execution was probably unsuccessful."
             )
         except KeyboardInterrupt:
+            if not is_interactive():
+                raise
             feedback = ask_for_feedback(lambda: self.project.menu(self.prompt))
             if feedback:
                 self.prompt.intermediate_steps += [feedback]
             return self.run(**kwargs)
+        finally:
+            get_lint_pool(self.project.path).release(self.lint_owner)
+
+    def prompt_state(self) -> dict:
+        return {
+            "current_context_length": self.prompt.current_context_length,
+            "model_steps_processed": self.prompt.model_steps_processed,
+            "all_steps_processed": self.prompt.all_steps_processed,
+            "last_summary": self.prompt.last_summary,
+        }
+
+    def checkpoint(self):
+        """
+        Append the new steps to the journal, compacting it into a snapshot from time to time
+        """
+        if not os.path.exists(self.project.path):
+            return
+        if self.journal.needs_snapshot():
+            self.save_to_file()
+        else:
+            self.journal.append(self.prompt_state(), self.prompt.intermediate_steps, self.project)
 
     def save_to_file(self, path: str = ""):
         if not os.path.exists(self.project.path):
             return
-        path = path or os.path.join(self.project.path, f".clippinator.pkl")
-        with open(path, "wb") as f:
-            prompt = {
-                "current_context_length": self.prompt.current_context_length,
-                "model_steps_processed": self.prompt.model_steps_processed,
-                "all_steps_processed": self.prompt.all_steps_processed,
-                "intermediate_steps": self.prompt.intermediate_steps,
-                "last_summary": self.prompt.last_summary,
-            }
-            pickle.dump((prompt, self.project), f)
+        journal = StepJournal(path) if path else self.journal
+        journal.write_snapshot(self.prompt_state(), self.prompt.intermediate_steps, self.project)
+
+    @staticmethod
+    def session_exists(path: str = ".clippinator.pkl") -> bool:
+        return StepJournal.exists(path)
 
     @classmethod
     def load_from_file(cls, path: str = ".clippinator.pkl"):
-        with open(path, "rb") as f:
-            prompt, project = pickle.load(f)
+        journal = StepJournal(path)
+        prompt, project = journal.load()
         self = cls(project)
         self.prompt.current_context_length = prompt["current_context_length"]
         self.prompt.model_steps_processed = prompt["model_steps_processed"]
         self.prompt.all_steps_processed = prompt["all_steps_processed"]
         self.prompt.intermediate_steps = prompt["intermediate_steps"]
         self.prompt.last_summary = prompt["last_summary"]
+        self.journal = journal
         return self
 
 
+def run_sub_project(sub_project_path: str, objective: str, log_path: str) -> list[str]:
+    """
+    Build a sub-project with its own inner Taskmaster (in a worker process).
+    The output goes to the log file, the memories of the sub-project are returned.
+    """
+    # There is no terminal: no Human tool and no feedback prompts
+    set_interactive(False)
+    # SelfCall terminates the workers on Ctrl+C, the agent stops like on an interrupt
+    previous_handler = signal.signal(signal.SIGTERM, signal.default_int_handler)
+    os.makedirs(sub_project_path, exist_ok=True)
+    with open(log_path, "a") as log, redirect_stdout(log), redirect_stderr(log):
+        project = Project(sub_project_path, objective, architecture="")
+        try:
+            taskmaster = Taskmaster(project, inner_taskmaster=True)
+            taskmaster.run(**project.prompt_fields())
+        except KeyboardInterrupt:
+            print("Interrupted. Agent is stopped.")
+        finally:
+            # The worker exits without running the atexit hooks
+            end_sessions()
+            close_shells()
+            close_kernels()
+            signal.signal(signal.SIGTERM, previous_handler)
+    return project.memories
+
+
 class SelfCall(SimpleTool):
     name = "SelfCall"
     description = "Initializes the component of the project. " \
@@ -133,24 +190,70 @@ class SelfCall(SimpleTool):
                   "current state of project (all folders and files) (or the project structure is empty). " \
                   "It's A MUST to use this tool right after the Subagent @Architect for every subfolder " \
                   "from the \"planned project architecture\"." \
-                  "Input parameter - name of the subfolder, a relative path to subfolder from the current location."
+                  "Input parameter - name of the subfolder, a relative path to subfolder from the current location. " \
+                  "You can pass several independent subfolders separated by commas (like `frontend, backend`), " \
+                  "then they will be built at the same time."
 
-    def __init__(self, project: Project):
+    def __init__(self, project: Project, max_workers: int | None = None):
         self.initial_project = project
+        self.max_workers = max_workers or int(os.environ.get("CLIPPINATOR_SELFCALL_WORKERS", 3))
         super().__init__()
 
-    def structured_func(self, sub_folder: str):
-        sub_project_path = self.initial_project.path + (
+    def _sub_project_path(self, sub_folder: str) -> str:
+        return self.initial_project.path + (
             "/" if not self.initial_project.path.endswith("/") else "") + sub_folder
+
+    def structured_func(self, sub_folder: str):
+        sub_project_path = self._sub_project_path(sub_folder)
         cur_objective = self._get_resulting_objective(self.initial_project, sub_folder)
         cur_sub_project = Project(sub_project_path, cur_objective, architecture="")
         taskmaster = Taskmaster(cur_sub_project, inner_taskmaster=True)
         taskmaster.run(**cur_sub_project.prompt_fields())
         return f"{sub_folder} folder processed."
 
+    def run_concurrently(self, sub_folders: list[str]) -> str:
+        """
+        Build the sub-projects in worker processes (at most max_workers at a time, the rest are queued),
+        wait for all of them and merge their memories into the parent project
+        """
+        result = ""
+        context = multiprocessing.get_context("spawn")
+        pool = ProcessPoolExecutor(max_workers=min(self.max_workers, len(sub_folders)), mp_context=context)
+        try:
+            futures = {}
+            for sub_folder in sub_folders:
+                sub_project_path = self._sub_project_path(sub_folder)
+                log_path = os.path.join(sub_project_path, ".clippinator.log")
+                os.makedirs(sub_project_path, exist_ok=True)
+                print(f"Building {sub_folder} in the background, the log is in {log_path}")
+                futures[sub_folder] = pool.submit(
+                    run_sub_project, sub_project_path,
+                    self._get_resulting_objective(self.initial_project, sub_folder), log_path
+                )
+            for sub_folder, future in futures.items():
+                try:
+                    memories = future.result()
+                except Exception as e:
+                    result += f"{sub_folder}: error while processing: {e}\n"
+                    continue
+                for memory in memories:
+                    self.initial_project.add_memory(f"({sub_folder}) {memory}")
+                result += f"{sub_folder} folder processed.\n"
+        except KeyboardInterrupt:
+            # The queued sub-projects don't start, the running ones are stopped instead of waited for
+            processes = list((pool._processes or {}).values())
+            pool.shutdown(wait=False, cancel_futures=True)
+            for process in processes:
+                process.terminate()
+            raise
+        pool.shutdown()
+        return result.strip()
+
     def func(self, args: str):
-        sub_folder = args.strip()
-        return self.structured_func(sub_folder)
+        sub_folders = [sub_folder.strip() for sub_folder in args.split(",") if sub_folder.strip()]
+        if len(sub_folders) > 1:
+            return self.run_concurrently(sub_folders)
+        return self.structured_func(args.strip())
 
     @staticmethod
     def _get_resulting_objective(initial_project: Project, sub_folder: str) -> str:
@@ -0,0 +1,154 @@
+from __future__ import annotations
+
+import os
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from dataclasses import dataclass
+
+
+@dataclass
+class Piece:
+    added: bool  # the lines are in LineBuffer.added (or LineBuffer.original)
+    start: int
+    length: int
+
+
+class LineBuffer:
+    """
+    A piece table over lines: the original lines of the file, the lines added by the edits (append-only)
+    and the pieces which say which lines make up the current content.
+    An edit only splits the pieces around it, so it costs O(edit size + number of pieces), not O(file size).
+    The lines are stored without "\\n", the content is "\\n".join(lines), so the whitespace is kept as is.
+    """
+
+    compact_after = 500  # pieces
+
+    def __init__(self, text: str = ""):
+        self.set_text(text)
+
+    def set_text(self, text: str):
+        self.original = text.split("\n")
+        self.added: list[str] = []
+        self.owns_added = True  # `added` isn't shared with a copy, the edits can append to it
+        self.pieces = [Piece(False, 0, len(self.original))]
+        self._update_offsets(0)
+
+    def copy(self) -> LineBuffer:
+        """
+        A cheap copy for trying the edits: the line lists are shared until the copy is edited,
+        then it gets its own `added` (copy-on-write), so a discarded copy leaves no lines behind in this buffer
+        """
+        buffer = LineBuffer.__new__(LineBuffer)
+        buffer.original, buffer.added = self.original, self.added
+        buffer.owns_added = False
+        buffer.pieces = list(self.pieces)
+        buffer.offsets = list(self.offsets)
+        buffer.total = self.total
+        return buffer
+
+    def _update_offsets(self, first: int):
+        # offsets[i] is the first line of the i-th piece
+        if first == 0:
+            self.offsets = []
+        del self.offsets[first:]
+        line = self.offsets[-1] + self.pieces[first - 1].length if first else 0
+        for piece in self.pieces[first:]:
+            self.offsets.append(line)
+            line += piece.length
+        self.total = line
+
+    @property
+    def line_count(self) -> int:
+        """
+        The number of lines (the empty string after the final newline isn't a line)
+        """
+        if self.total and self.get_lines(self.total - 1, self.total) == [""]:
+            return self.total - 1
+        return self.total
+
+    def _split(self, line: int) -> int:
+        """
+        Make a piece start at the line, returns the index of that piece
+        """
+        if line >= self.total:
+            return len(self.pieces)
+        i = bisect_right(self.offsets, line) - 1
+        offset = line - self.offsets[i]
+        if offset == 0:
+            return i
+        piece = self.pieces[i]
+        self.pieces[i:i + 1] = [Piece(piece.added, piece.start, offset),
+                                Piece(piece.added, piece.start + offset, piece.length - offset)]
+        self.offsets.insert(i + 1, line)
+        return i + 1
+
+    def replace(self, start: int, end: int, lines: list[str]):
+        """
+        Replace the lines [start, end) (0-indexed) with the new lines
+        """
+        if not 0 <= start <= end <= self.total:
+            raise ValueError(f"Invalid line range {start + 1}-{end} for a buffer with {self.total} lines")
+        first = self._split(start)
+        last = self._split(end)
+        new_pieces = []
+        if lines:
+            if not self.owns_added:
+                self.added, self.owns_added = list(self.added), True
+            new_pieces.append(Piece(True, len(self.added), len(lines)))
+            self.added.extend(lines)
+        self.pieces[first:last] = new_pieces
+        self._update_offsets(first)
+        # Too many pieces make the lookups slow, too many replaced lines in `added` waste memory
+        if len(self.pieces) > self.compact_after or len(self.added) > 2 * self.total + self.compact_after:
+            self.set_text(self.text())
+
+    def get_lines(self, start: int, end: int) -> list[str]:
+        result = []
+        if start >= end:
+            return result
+        i = bisect_right(self.offsets, start) - 1
+        while i < len(self.pieces) and self.offsets[i] < end:
+            piece = self.pieces[i]
+            source = self.added if piece.added else self.original
+            lo = max(start - self.offsets[i], 0)
+            hi = min(end - self.offsets[i], piece.length)
+            result.extend(source[piece.start + lo:piece.start + hi])
+            i += 1
+        return result
+
+    def text(self) -> str:
+        return "\n".join(self.get_lines(0, self.total))
+
+
+class BufferCache:
+    """
+    The buffers of the files under edit, valid while the file on disk has the (mtime, size) it had after our write
+    """
+
+    def __init__(self, max_buffers: int = 16):
+        self.max_buffers = max_buffers
+        self.buffers: OrderedDict[str, tuple[int, int, LineBuffer]] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, path: str, read: callable) -> LineBuffer:
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with self.lock:
+            cached = self.buffers.get(path)
+            if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+                self.buffers.move_to_end(path)
+                return cached[2]
+        return LineBuffer(read(path))
+
+    def put(self, path: str, buffer: LineBuffer):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        with self.lock:
+            self.buffers[path] = (stat.st_mtime_ns, stat.st_size, buffer)
+            self.buffers.move_to_end(path)
+            while len(self.buffers) > self.max_buffers:
+                self.buffers.popitem(last=False)
+
+
+buffer_cache = BufferCache()
@@ -0,0 +1,187 @@
+from __future__ import annotations
+
+import os
+import threading
+import time
+from dataclasses import dataclass
+
+import numpy as np
+
+from clippinator.minions.memory import CachedEmbedder, HashingEmbedder, get_embedder
+from clippinator.project.vfs import get_vfs
+
+MAX_FILE_SIZE = 1_000_000
+RESCAN_INTERVAL = 60.0  # seconds, a full rescan catches the files edited outside of the file tools
+
+
+@dataclass
+class Chunk:
+    path: str  # relative to the project
+    start: int  # 1-indexed, inclusive
+    end: int
+    text: str
+
+    def format(self) -> str:
+        lines = self.text.splitlines()
+        return f"{self.path}:{self.start}-{self.end}\n```\n" + "\n".join(
+            f"{self.start + i}|{line}" for i, line in enumerate(lines)) + "\n```"
+
+
+def chunk_file(rel_path: str, content: str, chunk_lines: int = 40, overlap: int = 10) -> list[Chunk]:
+    """
+    Split the file into overlapping chunks of lines (the last chunk can be shorter)
+    """
+    lines = content.splitlines()
+    chunks = []
+    step = max(chunk_lines - overlap, 1)
+    for start in range(0, len(lines), step):
+        part = lines[start:start + chunk_lines]
+        if any(line.strip() for line in part):
+            chunks.append(Chunk(rel_path, start + 1, start + len(part), "\n".join(part)))
+        if start + chunk_lines >= len(lines):
+            break
+    return chunks
+
+
+class CodeIndex:
+    """
+    A semantic index of the project files, split into chunks of lines.
+    Files are re-chunked only when their (mtime, size) changes and the embeddings are cached by chunk hash,
+    so only the new or edited chunks are embedded.
+    A search doesn't walk the project: it updates the files written by the tools (notify_write), the whole project
+    is rescanned only when the project directory changed or RESCAN_INTERVAL has passed.
+    """
+
+    def __init__(self, project_path: str, embedder=None):
+        self.project_path = project_path
+        cache_dir = os.path.join(project_path, ".clippinator", "code_index")
+        embedder = embedder or get_embedder(cache_dir)
+        if not isinstance(embedder, (CachedEmbedder, HashingEmbedder)):
+            embedder = CachedEmbedder(embedder, os.path.join(cache_dir, f"embeddings-{embedder.name}.bin"))
+        self.embedder = embedder
+        self.files: dict[str, tuple[int, int, list[Chunk], np.ndarray]] = {}
+        self.lock = threading.Lock()
+        self.dirty_paths: set[str] = set()
+        self.dirty_lock = threading.Lock()
+        self.scanned_root: int | None = None  # the mtime of the project directory at the last full scan
+        self.scanned_at = 0.0
+
+    def _list_files(self) -> list[str]:
+        from clippinator.tools.utils import skip_file, skip_file_summary
+
+        result = []
+        for root, dirs, files in os.walk(self.project_path):
+            dirs[:] = [d for d in dirs if not skip_file(os.path.join(root, d))]
+            for file in files:
+                file_path = os.path.join(root, file)
+                if not skip_file(file_path) and not skip_file_summary(file_path):
+                    result.append(os.path.relpath(file_path, self.project_path))
+        return result
+
+    def _changed_chunks(self, rel_path: str) -> tuple[int, int, list[Chunk]] | None:
+        """
+        Re-chunk the file if it changed. Returns None if it's unchanged, (0, 0, []) if it can't be indexed.
+        """
+        try:
+            stat = os.stat(os.path.join(self.project_path, rel_path))
+        except OSError:
+            return 0, 0, []
+        if rel_path in self.files and self.files[rel_path][:2] == (stat.st_mtime_ns, stat.st_size):
+            return None
+        if stat.st_size > MAX_FILE_SIZE:
+            return stat.st_mtime_ns, stat.st_size, []
+        try:
+            content = get_vfs(self.project_path).read(os.path.join(self.project_path, rel_path))
+        except (OSError, UnicodeDecodeError):
+            return stat.st_mtime_ns, stat.st_size, []
+        return stat.st_mtime_ns, stat.st_size, chunk_file(rel_path, content)
+
+    def update(self, rel_paths: list[str] | None = None):
+        """
+        Update the given files (or the whole project, dropping the deleted files). The embeddings are done in one batch.
+        """
+        with self.lock:
+            if rel_paths is None:
+                with self.dirty_lock:
+                    self.dirty_paths.clear()
+                rel_paths = self._list_files()
+                for removed in set(self.files) - set(rel_paths):
+                    del self.files[removed]
+            changed = {}
+            for rel_path in rel_paths:
+                new = self._changed_chunks(rel_path)
+                if new is not None:
+                    changed[rel_path] = new
+            texts = [f"{chunk.path}\n{chunk.text}" for _, _, chunks in changed.values() for chunk in chunks]
+            vectors = self.embedder.embed_documents(texts) if texts else np.zeros((0, self.embedder.dim))
+            offset = 0
+            for rel_path, (mtime, size, chunks) in changed.items():
+                if not mtime and not chunks:
+                    self.files.pop(rel_path, None)
+                    continue
+                self.files[rel_path] = (mtime, size, chunks, vectors[offset:offset + len(chunks)])
+                offset += len(chunks)
+
+    def mark_dirty(self, path: str):
+        with self.dirty_lock:
+            self.dirty_paths.add(os.path.relpath(os.path.join(self.project_path, path), self.project_path))
+
+    def refresh(self):
+        """
+        Rescan the project if it was never scanned, its directory changed or the last scan is too old,
+        otherwise update only the files marked as dirty
+        """
+        try:
+            root = os.stat(self.project_path).st_mtime_ns
+        except OSError:
+            root = None
+        if root != self.scanned_root or time.monotonic() - self.scanned_at > RESCAN_INTERVAL:
+            self.update()
+            self.scanned_root, self.scanned_at = root, time.monotonic()
+            return
+        with self.dirty_lock:
+            dirty, self.dirty_paths = self.dirty_paths, set()
+        if dirty:
+            self.update(sorted(dirty))
+
+    def search(self, query: str, n: int = 5) -> list[tuple[float, Chunk]]:
+        self.refresh()
+        # A snapshot: a concurrent update replaces the entries, the chunks and the vectors stay in step
+        with self.lock:
+            files = list(self.files.values())
+        chunks = [chunk for _, _, file_chunks, _ in files for chunk in file_chunks]
+        if not chunks or not query.strip():
+            return []
+        vectors = np.concatenate([vectors for *_, vectors in files])
+        scores = vectors @ self.embedder.embed_query(query)
+        best = np.argsort(-scores)[:n]
+        return [(float(scores[i]), chunks[i]) for i in best]
+
+    def relevant_code(self, query: str, max_length: int = 3000, n: int = 8) -> str:
+        """
+        The most relevant chunks (in the order of relevance) which fit into max_length characters
+        """
+        result = ""
+        for _, chunk in self.search(query, n):
+            formatted = chunk.format() + "\n"
+            if len(result) + len(formatted) > max_length:
+                continue
+            result += formatted
+        return result
+
+
+code_index_cache: dict[str, CodeIndex] = {}
+
+
+def get_code_index(project_path: str) -> CodeIndex:
+    if project_path not in code_index_cache:
+        code_index_cache[project_path] = CodeIndex(project_path)
+    return code_index_cache[project_path]
+
+
+def notify_write(project_path: str, file_path: str):
+    """
+    Mark the written file for the next search (only if the index has already been built)
+    """
+    if project_path in code_index_cache:
+        code_index_cache[project_path].mark_dirty(file_path)
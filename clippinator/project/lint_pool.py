@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Hashable
+
+LINT_WORKERS = int(os.environ.get("CLIPPINATOR_LINT_WORKERS", 4))
+
+
+class LintPool:
+    """
+    Lints the written files in the background, the agent gets the results with its next tool result instead of waiting.
+    The results belong to the agent which wrote the file: the owner token its tools run with (see `owner`).
+    The results an agent hasn't collected when it finishes are dropped (`release`).
+    Every submission of a file gets a new version: the results of the older versions are dropped,
+    and so are the results for the files changed on disk after the lint started.
+    """
+
+    def __init__(self, project_path: str, max_workers: int = LINT_WORKERS):
+        self.project_path = project_path
+        self.executor = ThreadPoolExecutor(max_workers=max(max_workers, 1), thread_name_prefix="lint")
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.versions: dict[str, int] = {}
+        self.owners: dict[str, Hashable] = {}  # path -> the owner of the last version
+        self.results: dict[str, tuple[int, tuple[int, int] | None, str]] = {}  # path -> (version, stat, output)
+
+    @staticmethod
+    def _stat(path: str) -> tuple[int, int] | None:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    @contextmanager
+    def owner(self, token: Hashable):
+        """
+        The files submitted in this thread inside the block belong to the owner (a tool call of an agent)
+        """
+        previous = getattr(self.local, 'owner', None)
+        self.local.owner = token
+        try:
+            yield
+        finally:
+            self.local.owner = previous
+
+    def submit(self, path: str, lint: Callable[[str], str]):
+        """
+        Lint the file for the current owner. Outside of `owner` nobody would collect the result, so it isn't linted
+        """
+        owner = getattr(self.local, 'owner', None)
+        if owner is None:
+            return
+        path = os.path.abspath(path)
+        with self.lock:
+            version = self.versions.get(path, 0) + 1
+            self.versions[path] = version
+            self.owners[path] = owner
+            self.results.pop(path, None)
+        self.executor.submit(self._lint, path, version, lint)
+
+    def _lint(self, path: str, version: int, lint: Callable[[str], str]):
+        with self.lock:
+            if self.versions.get(path) != version:
+                return
+        stat = self._stat(path)
+        try:
+            output = lint(path)
+        except Exception as e:
+            output = f"Linter error: {e}"
+        with self.lock:
+            if self.versions.get(path) == version:
+                self.results[path] = (version, stat, output or "")
+
+    def collect(self, owner: Hashable) -> str:
+        """
+        Take the finished results of the files submitted by the owner (without waiting for the running lints),
+        formatted for the agent
+        """
+        with self.lock:
+            results = {path: result for path, result in self.results.items() if self.owners[path] == owner}
+            for path in results:
+                del self.results[path], self.versions[path], self.owners[path]
+        collected = []
+        for path, (_, stat, output) in sorted(results.items()):
+            if not output.strip() or stat != self._stat(path):
+                continue
+            collected.append(f"Linter output for {os.path.relpath(path, self.project_path)}:\n{output.strip()}")
+        return "\n\n".join(collected)
+
+    def release(self, owner: Hashable):
+        """
+        The owner has finished: drop its results and skip its pending lints
+        """
+        with self.lock:
+            for path in [path for path, path_owner in self.owners.items() if path_owner == owner]:
+                self.results.pop(path, None)
+                del self.owners[path]
+                # A new version, so the running lint of the file doesn't store its result
+                self.versions[path] += 1
+
+
+lint_pools: dict[str, LintPool] = {}
+
+
+def get_lint_pool(project_path: str) -> LintPool:
+    project_path = os.path.abspath(project_path)
+    if project_path not in lint_pools:
+        lint_pools[project_path] = LintPool(project_path)
+    return lint_pools[project_path]
@@ -1,10 +1,15 @@
 from __future__ import annotations
 
+import dataclasses
 import os
 import subprocess
 from dataclasses import dataclass, field
 
-from clippinator.project.project_summary import get_file_summary
+from clippinator.project.project_summary import get_file_summary, get_top_level_symbols
+
+MEMORY_TOKEN_BUDGET = int(os.environ.get("CLIPPINATOR_MEMORY_TOKENS", 600))
+# Set CLIPPINATOR_CODE_CONTEXT to the number of characters of relevant code to add to the project summary
+CODE_CONTEXT_LENGTH = int(os.environ.get("CLIPPINATOR_CODE_CONTEXT", 0))
 
 
 @dataclass
@@ -17,6 +22,8 @@ class Project:
     template: str = "General"
     ci_commands: dict[str, str] = field(default_factory=dict)  # keys: 'run', 'lint', 'lint_file', 'test'
     memories: list[str] = field(default_factory=list)
+    # Overrides of the rlimits of the commands: cpu_seconds, memory_mb, file_size_mb, processes (0 is no limit)
+    resource_limits: dict[str, int] = field(default_factory=dict)
 
     @property
     def name(self) -> str:
@@ -96,6 +103,98 @@ class Project:
             return trim_extra(process.stdout.strip(), 1000)
         return lint_file(path)
 
+    def snapshot_state(self) -> dict[str, tuple[int, int, frozenset[str]]]:
+        """
+        Get (mtime, size, top-level symbols) for every file in the project.
+        The symbols come from the ctags cache which is filled by the project summary, so this is cheap.
+        """
+        from clippinator.tools.utils import skip_file, skip_file_summary
+
+        state = {}
+        for root, dirs, files in os.walk(self.path):
+            dirs[:] = [d for d in dirs if not skip_file(os.path.join(root, d))]
+            for file in files:
+                file_path = os.path.join(root, file)
+                if skip_file(file_path):
+                    continue
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    continue
+                symbols = frozenset() if skip_file_summary(file_path) else frozenset(get_top_level_symbols(file_path))
+                state[os.path.relpath(file_path, self.path)] = (stat.st_mtime_ns, stat.st_size, symbols)
+        return state
+
+    def get_state_delta(self, before: dict[str, tuple[int, int, frozenset[str]]]) -> str:
+        """
+        Describe what changed in the project since the snapshot:
+        Project changes:
+          added: app.py (class App, function main)
+          modified: models.py (+class User, -function old_helper)
+          removed: old.py
+        """
+        after = self.snapshot_state()
+        added = sorted(set(after) - set(before))
+        removed = sorted(set(before) - set(after))
+        modified = sorted(path for path in set(after) & set(before) if after[path][:2] != before[path][:2])
+
+        def describe(path: str, symbols: list[str]) -> str:
+            return f"{path} ({', '.join(symbols)})" if symbols else path
+
+        lines = []
+        if added:
+            lines.append("  added: " + ", ".join(describe(path, sorted(after[path][2])) for path in added))
+        if modified:
+            lines.append("  modified: " + ", ".join(
+                describe(path, [f"+{sym}" for sym in sorted(after[path][2] - before[path][2])] +
+                         [f"-{sym}" for sym in sorted(before[path][2] - after[path][2])])
+                for path in modified))
+        if removed:
+            lines.append("  removed: " + ", ".join(removed))
+        if not lines:
+            return "Project changes: none\n"
+        return "Project changes:\n" + "\n".join(lines) + "\n"
+
+    def add_memory(self, memory: str) -> bool:
+        """
+        Remember a fact (in self.memories and in the memory index).
+        Near-duplicates of the existing memories (by MinHash) are skipped, then False is returned.
+        """
+        from clippinator.minions.memory import find_near_duplicate, get_memory
+
+        memory = memory.strip()
+        if not memory or find_near_duplicate(memory, self.memories):
+            return False
+        self.memories.append(memory)
+        get_memory(self.path).save_snippet(memory, src="remember")
+        return True
+
+    def select_memories(self, query: str, token_budget: int = MEMORY_TOKEN_BUDGET) -> list[str]:
+        """
+        Get the memories most relevant to the query which fit into the token budget (~4 chars per token).
+        The latest memory is always included, the result keeps the order in which the memories were added.
+        """
+        from clippinator.minions.memory import get_memory
+
+        memories = list(dict.fromkeys(memory for memory in self.memories if memory.strip()))
+        if sum(len(memory) // 4 + 1 for memory in memories) <= token_budget:
+            return memories
+        store = get_memory(self.path)
+        # Memories edited in the menu or loaded from an old session may not be indexed yet
+        indexed = {snippet["text"] for snippet in store.snippets if snippet.get("src") == "remember"}
+        store.save_snippets([memory for memory in memories if memory not in indexed], src="remember")
+        current = set(memories)
+        ranked = [snippet["text"] for _, snippet in store.search(query, len(store.snippets), src="remember")]
+        ranked = [memories[-1]] + [text for text in dict.fromkeys(ranked) if text in current]
+
+        selected = set()
+        for memory in ranked:
+            cost = len(memory) // 4 + 1
+            if memory not in selected and cost <= token_budget:
+                selected.add(memory)
+                token_budget -= cost
+        return [memory for memory in memories if memory in selected]
+
     def get_project_summary(self) -> str:
         self.summary_cache = self.get_folder_summary(self.path, top_level=True)
         return self.summary_cache
@@ -103,7 +202,8 @@ class Project:
     def menu(self, prompt=None):
         from clippinator.tools.utils import select, get_input_from_editor
         prompt_options = ["Edit action summary"] * (prompt is not None)
-        res = select(["Continue", "Architecture", "Objective", "Memories", "CI"] + prompt_options, "Project Menu")
+        res = select(["Continue", "Architecture", "Objective", "Memories", "CI", "Limits"] + prompt_options,
+                     "Project Menu")
         if res == 1:
             self.architecture = get_input_from_editor(self.architecture)
         elif res == 2:
@@ -116,19 +216,36 @@ class Project:
             self.ci_commands = {line.split(':')[0].strip(): line.split(':')[1].strip().strip('`')
                                 for line in ci_commands}
         elif res == 5:
+            from clippinator.tools.sandbox import ResourceLimits
+
+            current = dataclasses.asdict(ResourceLimits.for_project(self))
+            limits = get_input_from_editor("\n".join(f"{k}: {v or 0}" for k, v in current.items())).splitlines()
+            self.resource_limits = {line.split(':')[0].strip(): int(line.split(':')[1].strip() or 0)
+                                    for line in limits if ':' in line}
+        elif res == 6:
             prompt.last_summary = get_input_from_editor(prompt.last_summary)
 
-    def prompt_fields(self) -> dict:
+    def prompt_fields(self, query: str = "") -> dict:
+        """
+        query: the memories are ranked by relevance to it (the objective by default)
+        """
         from clippinator.tools.architectural import templates
 
         default_architecture = templates['General']['architecture']
+        project_summary = self.get_project_summary()
+        if CODE_CONTEXT_LENGTH:
+            from clippinator.project.code_index import get_code_index
+
+            relevant_code = get_code_index(self.path).relevant_code(query or self.objective, CODE_CONTEXT_LENGTH)
+            if relevant_code:
+                project_summary += "\nThe code most relevant to the current task:\n" + relevant_code
 
         return {
             "objective": self.objective,
             "state": self.state,
             "architecture": self.architecture,
             "project_name": self.name,
-            "project_summary": self.get_project_summary(),
-            "memories": '  - ' + "\n  - ".join(self.memories),
+            "project_summary": project_summary,
+            "memories": '  - ' + "\n  - ".join(self.select_memories(query or self.objective)),
             "architecture_example": templates.get(self.template, {}).get('architecture', default_architecture),
         }
@@ -1,9 +1,12 @@
 from __future__ import annotations
 
 import json
+import os
 import subprocess
 from collections import defaultdict
 
+from clippinator.project.vfs import vfs_for
+
 
 def get_tag_kinds() -> dict[str, list[str]]:
     """
@@ -23,30 +26,53 @@ def get_tag_kinds() -> dict[str, list[str]]:
 
 tag_kinds_by_language = get_tag_kinds()
 
+# path -> ((mtime, size), tags)
+tags_cache: dict[str, tuple[tuple[int, int], list[dict]]] = {}
 
-def get_file_summary(file_path: str, indent: str = "", length_1: int = 1000, length_2: int = 2000) -> str:
+
+def get_file_tags(file_path: str) -> list[dict]:
     """
-    | 72| class A:
-    | 80| def create(self, a: str) -> A:
-    |100| class B:
+    Run ctags on the file, the result is cached until the file changes
     """
+    stat = os.stat(file_path)
+    key = (stat.st_mtime_ns, stat.st_size)
+    if file_path in tags_cache and tags_cache[file_path][0] == key:
+        return tags_cache[file_path][1]
     cmd = ["ctags", "-x", "--output-format=json", "--fields=+n+l", file_path]
     result = subprocess.run(
         cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
     )
-    out = ""
-
     if result.returncode != 0:
         raise RuntimeError(f"Error executing ctags: {result.stderr}")
+    tags = [json.loads(line) for line in result.stdout.splitlines() if line.strip()]
+    tags_cache[file_path] = (key, tags)
+    return tags
+
 
+def get_top_level_symbols(file_path: str) -> set[str]:
+    """
+    The top-level symbols of a file (like "class A", "function create")
+    """
     try:
-        with open(file_path, "r") as f:
-            file_lines = f.readlines()
+        return {f"{tag['kind']} {tag['name']}" for tag in get_file_tags(file_path) if not tag.get('scope')}
+    except (OSError, RuntimeError, ValueError):
+        return set()
+
+
+def get_file_summary(file_path: str, indent: str = "", length_1: int = 1000, length_2: int = 2000) -> str:
+    """
+    | 72| class A:
+    | 80| def create(self, a: str) -> A:
+    |100| class B:
+    """
+    tags = [dict(tag) for tag in get_file_tags(file_path)]
+    out = ""
+
+    try:
+        file_lines = vfs_for(file_path).read_lines(file_path)
     except UnicodeDecodeError:
         return ""
 
-    lines = result.stdout.splitlines()
-    tags = [json.loads(line) for line in lines if line.strip()]
     # Each tag is a dict which has the keys "path", "line", "kind", "language"
     # We need to add kinds in the order of importance such that the total length does not exceed 600 chars
     lengths_by_tag = defaultdict(int)
@@ -69,3 +95,62 @@ def get_file_summary(file_path: str, indent: str = "", length_1: int = 1000, len
     if len(out) > length_2:
         out = out[:length_2 - 300] + f"\n{indent}...\n" + out[-300:]
     return out
+
+
+def get_file_outline(file_path: str, max_length: int = 5000) -> str:
+    """
+    The top-level blocks of the file with their line ranges and sizes (and their members if there's space):
+    1-11| (module code) [11 lines, 300 chars]
+    12-80| class A: [69 lines, 2300 chars]
+      15| def create(self, a: str) -> A:
+    81-120| def helper(x): [40 lines, 900 chars]
+    Returns "" if there are no tags
+    """
+    from clippinator.tools.line_index import LineIndex
+
+    try:
+        tags = get_file_tags(file_path)
+    except (OSError, RuntimeError, ValueError):
+        return ""
+    top_level = sorted({tag['line']: tag for tag in tags if not tag.get('scope')}.values(), key=lambda t: t['line'])
+    if not top_level:
+        return ""
+    index = LineIndex.get(file_path)
+    if index is not None:
+        line_count = index.count
+        char_offsets = index.chars
+        lines = index.read_lines([tag['line'] for tag in tags])
+    else:
+        file_lines = vfs_for(file_path).read_lines(file_path)
+        line_count = len(file_lines)
+        char_offsets = [0]
+        for line in file_lines:
+            char_offsets.append(char_offsets[-1] + len(line))
+        lines = {tag['line']: file_lines[tag['line'] - 1].rstrip()[:200] for tag in tags
+                 if 0 < tag['line'] <= line_count}
+
+    def block(start: int, end: int, text: str) -> str:
+        return f"{start}-{end}| {text} [{end - start + 1} lines, {char_offsets[end] - char_offsets[start - 1]} chars]\n"
+
+    members = defaultdict(list)
+    for tag in tags:
+        if tag.get('scope') and '.' not in tag['scope']:
+            members[tag['scope']].append(tag)
+    blocks = []
+    if top_level[0]['line'] > 1:
+        blocks.append((block(1, top_level[0]['line'] - 1, "(module code)"), []))
+    for i, tag in enumerate(top_level):
+        end = top_level[i + 1]['line'] - 1 if i + 1 < len(top_level) else line_count
+        end = max(end, tag['line'])
+        member_lines = [f"  {member['line']}| {lines.get(member['line'], '').strip()}\n"
+                        for member in sorted(members.get(tag['name'], []), key=lambda m: m['line'])
+                        if tag['line'] < member['line'] <= end]
+        blocks.append((block(tag['line'], end, lines.get(tag['line'], '').strip()), member_lines))
+
+    out = "".join(text for text, _ in blocks)
+    # Add the members of the classes while there is space
+    if len(out) + sum(len(line) for _, member_lines in blocks for line in member_lines) <= max_length:
+        out = "".join(text + "".join(member_lines) for text, member_lines in blocks)
+    if len(out) > max_length:
+        out = out[:max_length - 300] + "\n...\n" + out[-300:]
+    return out
@@ -0,0 +1,185 @@
+from __future__ import annotations
+
+import os
+import secrets
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable
+
+
+def split_lines(content: str) -> list[str]:
+    """
+    The same as f.readlines() for the content read in text mode (only '\n' ends a line)
+    """
+    lines = content.split("\n")
+    result = [line + "\n" for line in lines[:-1]]
+    if lines[-1]:
+        result.append(lines[-1])
+    return result
+
+
+# Called with the path after every change of a file through a VFS: the caches of the data derived from the files
+# (like the line offsets of ReadFile) drop it, even if the mtime and the size haven't changed
+write_hooks: list[Callable[[str], None]] = []
+
+
+@dataclass
+class VFSStats:
+    hits: int = 0
+    misses: int = 0
+    writes: int = 0
+    bytes_saved: int = 0  # the chars served from the cache instead of the disk
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / (self.hits + self.misses) if self.hits + self.misses else 0.0
+
+    def __str__(self) -> str:
+        return f"{self.hits} hits, {self.misses} misses ({self.hit_rate:.0%} hit rate), " \
+               f"{self.bytes_saved / 1e6:.1f}MB saved, {self.writes} writes"
+
+
+class VFS:
+    """
+    The file access layer of a project: an LRU cache of the file contents keyed by (path, mtime, size),
+    and atomic writes (a temp file + rename) which update the cache.
+    Text mode semantics (universal newlines), like open(path).read()
+    """
+
+    def __init__(self, root: str, max_size: int = 64_000_000):
+        self.root = root
+        self.max_size = max_size
+        self.size = 0
+        self.cache: OrderedDict[str, tuple[int, int, str]] = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = VFSStats()
+
+    def _path(self, path: str) -> str:
+        return os.path.abspath(os.path.join(self.root, path))
+
+    def _store(self, path: str, stat: os.stat_result, content: str):
+        with self.lock:
+            self._drop(path)
+            if len(content) > self.max_size // 4:
+                return
+            self.cache[path] = (stat.st_mtime_ns, stat.st_size, content)
+            self.size += len(content)
+            while self.size > self.max_size:
+                self._drop(next(iter(self.cache)))
+
+    def _drop(self, path: str):
+        if path in self.cache:
+            self.size -= len(self.cache.pop(path)[2])
+
+    def read(self, path: str) -> str:
+        path = self._path(path)
+        stat = os.stat(path)
+        with self.lock:
+            cached = self.cache.get(path)
+            if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+                self.cache.move_to_end(path)
+                self.stats.hits += 1
+                self.stats.bytes_saved += len(cached[2])
+                return cached[2]
+            self.stats.misses += 1
+        with open(path, "r") as f:
+            content = f.read()
+        self._store(path, stat, content)
+        return content
+
+    def read_lines(self, path: str) -> list[str]:
+        return split_lines(self.read(path))
+
+    def _atomic_write(self, path: str, data: str | bytes):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = os.path.join(directory, f".{os.path.basename(path)}.{secrets.token_hex(8)}.tmp")
+        # The kernel applies the umask to 0o666, like for open(path, "w")
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        try:
+            with os.fdopen(fd, "wb" if isinstance(data, bytes) else "w") as f:
+                f.write(data)
+            if os.path.exists(path):
+                os.chmod(tmp_path, os.stat(path).st_mode & 0o7777)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._changed(path)
+
+    @staticmethod
+    def _changed(path: str):
+        for hook in write_hooks:
+            hook(path)
+
+    def write(self, path: str, content: str):
+        """
+        Write atomically: readers see either the old or the new content, never a partially written file
+        """
+        path = self._path(path)
+        self._atomic_write(path, content)
+        self.stats.writes += 1
+        # A text-mode read translates the newlines
+        self._store(path, os.stat(path), content.replace("\r\n", "\n").replace("\r", "\n"))
+
+    def write_many(self, contents: dict[str, str]):
+        """
+        Write several files as a transaction: if one of the writes fails, the files written before it are restored
+        """
+        backups: dict[str, bytes | None] = {}
+        try:
+            for path, content in contents.items():
+                path = self._path(path)
+                if path not in backups:
+                    if os.path.exists(path):
+                        with open(path, "rb") as f:
+                            backups[path] = f.read()
+                    else:
+                        backups[path] = None
+                self.write(path, content)
+        except BaseException:
+            for path, backup in backups.items():
+                self.invalidate(path)
+                if backup is not None:
+                    self._atomic_write(path, backup)
+                elif os.path.exists(path):
+                    os.remove(path)
+                    self._changed(path)
+            raise
+
+    def invalidate(self, path: str):
+        """
+        Drop the cached content (the cache is checked by mtime and size, this is for the changes they can miss)
+        """
+        with self.lock:
+            self._drop(self._path(path))
+
+
+vfs_registry: dict[str, VFS] = {}
+default_vfs = VFS("/")
+
+
+def get_vfs(project_path: str) -> VFS:
+    """
+    The VFS of the project (created on the first use)
+    """
+    project_path = os.path.abspath(project_path)
+    if project_path not in vfs_registry:
+        vfs_registry[project_path] = VFS(project_path)
+    return vfs_registry[project_path]
+
+
+def vfs_for(path: str) -> VFS:
+    """
+    The VFS of the project containing the file (the default one if the file isn't in a known project)
+    """
+    path = os.path.abspath(path)
+    roots = [root for root in vfs_registry if path.startswith(root.rstrip("/") + "/")]
+    return vfs_registry[max(roots, key=len)] if roots else default_vfs
+
+
+def format_vfs_stats() -> str:
+    return "\n".join(f"{vfs.root}: {vfs.stats}" for vfs in [*vfs_registry.values(), default_vfs]
+                     if vfs.stats.hits or vfs.stats.misses or vfs.stats.writes)
@@ -1,16 +1,22 @@
 import os
+from functools import wraps
+from typing import Callable, Hashable
 
 from langchain.agents import Tool
 from langchain.tools import BaseTool
 from langchain.utilities import SerpAPIWrapper
 
 from clippinator.project import Project
-from .architectural import Remember, TemplateInfo, TemplateSetup, SetCI, DeclareArchitecture
+from clippinator.project.lint_pool import get_lint_pool
+from .architectural import Remember, Recall, TemplateInfo, TemplateSetup, SetCI, DeclareArchitecture
 from .browsing import SeleniumTool, GetPage
-from .code_tools import SearchInFiles, Pylint
+from .code_tools import SearchInFiles, SearchCode, Pylint
 from .file_tools import WriteFile, ReadFile, PatchFile, SummarizeFile
-from .terminal import RunBash, BashBackgroundSessions, RunPython
+from .python_kernel import RunPython
+from .sandbox import ResourceLimits
+from .terminal import RunBash, BashBackgroundSessions
 from .tool import HumanInputTool, HTTPGetTool, SimpleTool
+from .utils import is_interactive
 
 tool_cache = {}
 
@@ -20,10 +26,11 @@ def fixed_tools(project: Project) -> list[SimpleTool]:
         return tool_cache[project.path]
     result = [
         ReadFile(project.path),
-        PatchFile(project.path),
+        PatchFile(project.path, project.lint_file),
         SummarizeFile(project.path),
-        HumanInputTool(),
+        *([HumanInputTool()] if is_interactive() else []),
         Pylint(project.path),
+        SearchCode(project.path),
         SeleniumTool(),
         HTTPGetTool(),
         GetPage(),
@@ -34,21 +41,47 @@ def fixed_tools(project: Project) -> list[SimpleTool]:
     return result
 
 
-def get_tools(project: Project, try_structured: bool = False) -> list[BaseTool]:
+def with_diagnostics(project_path: str, func: Callable[..., str], owner: Hashable) -> Callable[..., str]:
+    """
+    Run the tool for the owner (the agent) and append the finished background lints of the files it wrote
+    """
+    if getattr(func, "with_diagnostics", False):
+        return func
+
+    @wraps(func)
+    def wrapper(*args, **kwargs) -> str:
+        lint_pool = get_lint_pool(project_path)
+        with lint_pool.owner(owner):
+            result = func(*args, **kwargs)
+        diagnostics = lint_pool.collect(owner)
+        return f"{result}\n\n{diagnostics}" if diagnostics else result
+
+    wrapper.with_diagnostics = True
+    return wrapper
+
+
+def get_tools(project: Project, try_structured: bool = False, lint_owner: Hashable | None = None) -> list[BaseTool]:
+    """
+    The tools of an agent. The lints of the files it writes are delivered with its tool results, `lint_owner`
+    identifies the agent (release it in the lint pool when the agent finishes)
+    """
+    lint_owner = lint_owner if lint_owner is not None else object()
     tools = [
 
                 Tool(
                     name="Bash",
-                    func=RunBash(workdir=project.path).run,
+                    func=RunBash(workdir=project.path, limits=ResourceLimits.for_project(project)).run,
                     description="allows you to run bash commands in the project directory. "
-                                "The input must be a valid bash command that will not ask for input and will terminate.",
+                                "The input must be a valid bash command that will not ask for input and will terminate. "
+                                "The commands run in a persistent shell, so `cd`, `export` and `source` stay in effect.",
                 ),
                 Tool(
                     name="Python",
-                    func=RunPython(workdir=project.path).run,
+                    func=RunPython(workdir=project.path, limits=ResourceLimits.for_project(project)).run,
                     description="allows you to run python code and get everything that's "
                                 "printed (e.g. print(2+2) will give you 4) in order to compute something. "
-                                "The input is correct python code.",
+                                "The input is correct python code. The variables and imports are kept between "
+                                "the runs, the value of the last expression is printed.",
                 ),
                 # Tool(
                 #     name="Wolfram Alpha",
@@ -66,9 +99,10 @@ def get_tools(project: Project, try_structured: bool = False) -> list[BaseTool]:
 
                 WriteFile(project).get_tool(try_structured),
                 Remember(project).get_tool(try_structured),
+                Recall(project).get_tool(try_structured),
                 SetCI(project).get_tool(try_structured),
                 # SearchInFiles(project.path).get_tool(),
-                BashBackgroundSessions(project.path).get_tool(try_structured),
+                BashBackgroundSessions(project.path, ResourceLimits.for_project(project)).get_tool(try_structured),
                 DeclareArchitecture(project).get_tool(try_structured),
             ] + [tool_.get_tool(try_structured) for tool_ in fixed_tools(project)]
     if os.environ.get('SERPAPI_API_KEY'):
@@ -78,4 +112,6 @@ def get_tools(project: Project, try_structured: bool = False) -> list[BaseTool]:
             description="useful for when you need to answer simple questions and get a simple answer. "
                         "You cannot read websites or click on any links or read any articles.",
         ))
+    for tool in tools:
+        tool.func = with_diagnostics(project.path, tool.func, lint_owner)
     return tools
@@ -0,0 +1,247 @@
+from __future__ import annotations
+
+import difflib
+import re
+
+from unidiff import PatchSet
+from unidiff.errors import UnidiffParseError
+
+SEARCH_MARKER = re.compile(r"^<{5,9} ?SEARCH\s*$")
+DIVIDER_MARKER = re.compile(r"^={5,9}\s*$")
+REPLACE_MARKER = re.compile(r"^>{5,9} ?REPLACE\s*$")
+FUZZY_THRESHOLD = 0.85
+MIN_FUZZY_LENGTH = 20
+
+
+class PatchError(ValueError):
+    pass
+
+
+def is_search_replace(patch: str) -> bool:
+    return any(SEARCH_MARKER.match(line) for line in patch.split("\n"))
+
+
+def is_unified_diff(patch: str) -> bool:
+    lines = patch.lstrip("\n").split("\n")
+    return lines[0].startswith(("--- ", "diff ")) or any(line.startswith("@@ ") for line in lines)
+
+
+def parse_search_replace(patch: str) -> list[tuple[list[str], list[str]]]:
+    """
+    Parse the blocks:
+    <<<<<<< SEARCH
+    the lines to find
+    =======
+    the lines to put instead
+    >>>>>>> REPLACE
+    """
+    blocks = []
+    state, search, replace = None, [], []
+    for line in patch.split("\n"):
+        if SEARCH_MARKER.match(line):
+            state, search, replace = "search", [], []
+        elif state == "search" and DIVIDER_MARKER.match(line):
+            state = "replace"
+        elif state == "replace" and REPLACE_MARKER.match(line):
+            blocks.append((search, replace))
+            state = None
+        elif state == "search":
+            search.append(line)
+        elif state == "replace":
+            replace.append(line)
+    if state is not None:
+        raise PatchError("unfinished block, each block needs <<<<<<< SEARCH, ======= and >>>>>>> REPLACE lines")
+    return blocks
+
+
+def numbered(lines: list[str], start: int) -> str:
+    return "\n".join(f"{start + i + 1}|{line}" for i, line in enumerate(lines))
+
+
+def find_lines(lines: list[str], needle: list[str], near: int | None = None, start: int = 0) -> tuple[int, str]:
+    """
+    Find where the needle lines are in the lines (from `start`): exactly, then ignoring the whitespace,
+    then fuzzily. Several exact matches are an error, unless `near` is given (then the closest one is chosen).
+    Returns (the index, "exact"/"whitespace"/"fuzzy")
+    """
+    size = len(needle)
+    windows = range(start, len(lines) - size + 1)
+    exact = [i for i in windows if lines[i:i + size] == needle]
+    if len(exact) == 1 or exact and near is not None:
+        return min(exact, key=lambda i: abs(i - (near or 0))), "exact"
+    if exact:
+        raise PatchError(f"the text matches {len(exact)} places (lines {', '.join(str(i + 1) for i in exact)}), "
+                         f"add more lines to make it unique")
+
+    def normalize(block: list[str]) -> list[str]:
+        return [" ".join(line.split()) for line in block]
+
+    stripped_needle = normalize(needle)
+    loose = [i for i in windows if normalize(lines[i:i + size]) == stripped_needle]
+    if len(loose) == 1:
+        return loose[0], "whitespace"
+    if len(loose) > 1:
+        raise PatchError(f"the text matches {len(loose)} places (lines {', '.join(str(i + 1) for i in loose)}), "
+                         f"add more lines to make it unique")
+
+    # The two best fuzzy matches, the windows which can't beat the second one are skipped cheaply
+    needle_text = "\n".join(stripped_needle)
+    best, second = (0.0, -1), (0.0, -1)
+    for i in windows:
+        matcher = difflib.SequenceMatcher(None, needle_text, "\n".join(normalize(lines[i:i + size])), autojunk=False)
+        if matcher.real_quick_ratio() <= second[0] or matcher.quick_ratio() <= second[0]:
+            continue
+        score = (matcher.ratio(), i)
+        if score > best:
+            best, second = score, best
+        elif score > second:
+            second = score
+    if best[1] < 0:
+        raise PatchError(f"the text to find has {size} lines, but the file has only {len(lines) - start}")
+    best_score, best = best
+    # Short texts are too easy to match by mistake (`return 1` and `return 2`)
+    if best_score >= FUZZY_THRESHOLD and len(needle_text) >= MIN_FUZZY_LENGTH:
+        # Overlapping windows around the same place don't make the match ambiguous
+        if second[0] < best_score - 0.03 or abs(second[1] - best) < size:
+            return best, "fuzzy"
+        raise PatchError(f"the text wasn't found exactly, and it is similar to several places "
+                         f"(lines {best + 1}, {second[1] + 1}), copy the lines exactly")
+    raise PatchError(f"the text wasn't found. The closest match (similarity {best_score:.2f}) "
+                     f"is at lines {best + 1}-{best + size}:\n{numbered(lines[best:best + size], best)}")
+
+
+def reindent(replacement: list[str], found: list[str], needle: list[str]) -> list[str]:
+    """
+    If the text was found with a different indentation, indent the replacement the same way
+    """
+    def indent(line: str) -> str:
+        return line[:len(line) - len(line.lstrip())]
+
+    pairs = [(indent(a), indent(b)) for a, b in zip(found, needle) if a.strip() and b.strip()]
+    if not pairs or pairs[0][0] == pairs[0][1]:
+        return replacement
+    found_indent, needle_indent = pairs[0]
+    result = []
+    for line in replacement:
+        if not line.strip():
+            result.append(line)
+        elif found_indent.startswith(needle_indent):
+            result.append(found_indent[len(needle_indent):] + line)
+        elif needle_indent.startswith(found_indent) and line.startswith(needle_indent[len(found_indent):]):
+            result.append(line[len(needle_indent) - len(found_indent):])
+        else:
+            result.append(line)
+    return result
+
+
+def search_replace_edits(lines: list[str], patch: str) -> list[tuple[int, int, list[str]]]:
+    """
+    Find the blocks in the lines. Returns the edits (start, end, new lines): each one replaces the lines [start, end)
+    of the content after the previous edits. The edits are also applied to `lines`.
+    """
+    blocks = parse_search_replace(patch)
+    if not blocks:
+        raise PatchError("no search/replace blocks found")
+    edits = []
+    for n, (search, replace) in enumerate(blocks):
+        prefix = f"block {n + 1} of {len(blocks)}: " if len(blocks) > 1 else ""
+        if not any(line.strip() for line in search):
+            # An empty search block appends to the file
+            index = len(lines) - 1 if lines and lines[-1] == "" else len(lines)
+            edits.append((index, index, replace))
+            lines[index:index] = replace
+            continue
+        try:
+            index, _ = find_lines(lines, search)
+        except PatchError as e:
+            raise PatchError(prefix + str(e)) from None
+        found = lines[index:index + len(search)]
+        edits.append((index, index + len(search), reindent(replace, found, search)))
+        lines[index:index + len(search)] = edits[-1][2]
+    return edits
+
+
+def parse_hunks(patch: str) -> list[tuple[int, list[str], list[str]]]:
+    """
+    Get (the source start line, the source lines, the target lines) of each hunk of a unified diff.
+    Uses unidiff and falls back to a lenient parser if the line counts in the hunk headers are wrong.
+    """
+    try:
+        patch_set = PatchSet(patch if patch.lstrip().startswith(("---", "diff")) else "--- a\n+++ b\n" + patch)
+        hunks = [hunk for patched_file in patch_set for hunk in patched_file]
+        if hunks:
+            return [(hunk.source_start, [line.value.removesuffix("\n") for line in hunk.source_lines()],
+                     [line.value.removesuffix("\n") for line in hunk.target_lines()]) for hunk in hunks]
+    except UnidiffParseError:
+        pass
+    hunks = []
+    for line in patch.split("\n"):
+        if line.startswith("@@"):
+            match = re.match(r"@@ -(\d+)", line)
+            hunks.append((int(match.group(1)) if match else 0, [], []))
+        elif not hunks or line.startswith(("--- ", "+++ ", "diff ", "\\")):
+            continue
+        elif line.startswith("-"):
+            hunks[-1][1].append(line[1:])
+        elif line.startswith("+"):
+            hunks[-1][2].append(line[1:])
+        else:
+            context = line[1:] if line.startswith(" ") else line
+            hunks[-1][1].append(context)
+            hunks[-1][2].append(context)
+    # The trailing empty lines are usually not a part of the diff
+    for _, source, target in hunks:
+        while source and target and source[-1] == target[-1] == "":
+            source.pop()
+            target.pop()
+    return hunks
+
+
+def unified_diff_edits(lines: list[str], patch: str) -> list[tuple[int, int, list[str]]]:
+    """
+    Find the hunks by their content: the line numbers in the headers are only used to choose
+    between several matches, so a diff made for an older version of the file still applies.
+    Returns the edits like search_replace_edits (and applies them to `lines`)
+    """
+    hunks = parse_hunks(patch)
+    if not hunks:
+        raise PatchError("no hunks found in the diff")
+    edits = []
+    position, offset = 0, 0
+    for n, (source_start, source, target) in enumerate(hunks):
+        header = f"hunk {n + 1} of {len(hunks)} (@@ -{source_start} @@)"
+        if not any(line.strip() for line in source):
+            index = min(max(source_start + offset, 0), len(lines))
+            edits.append((index, index, target))
+            lines[index:index] = target
+            position, offset = index + len(target), offset + len(target)
+            continue
+        try:
+            index, _ = find_lines(lines, source, near=source_start - 1 + offset, start=position)
+        except PatchError as e:
+            raise PatchError(f"{header} failed: {e}") from None
+        found = lines[index:index + len(source)]
+        edits.append((index, index + len(source), reindent(target, found, source)))
+        lines[index:index + len(source)] = edits[-1][2]
+        position = index + len(target)
+        offset = index + len(target) - (source_start - 1 + len(source))
+    return edits
+
+
+def split_unified_diff(patch: str) -> list[tuple[str, str]]:
+    """
+    Split a multi-file unified diff into (path, diff) pairs, the paths are taken from the +++ lines
+    """
+    lines = patch.split("\n")
+    files = []
+    for i, line in enumerate(lines):
+        file_header = line.startswith("--- ") and i + 1 < len(lines) and lines[i + 1].startswith("+++ ")
+        if line.startswith("diff ") or file_header and (not files or any(l.startswith("@@") for l in files[-1][1])):
+            files.append(["", []])
+        if not files:
+            continue
+        if line.startswith("+++ ") and not files[-1][0]:
+            path = line[4:].split("\t")[0].strip()
+            files[-1][0] = path[2:] if path.startswith(("a/", "b/")) else path
+        files[-1][1].append(line)
+    return [(path, "\n".join(file_lines)) for path, file_lines in files if path]
@@ -5,7 +5,9 @@ import subprocess
 
 import yaml
 
+from clippinator.minions.memory import get_memory
 from clippinator.project import Project
+from .sandbox import CommandUsage, ResourceLimits, limit_note, record_usage, run_limited
 from .tool import SimpleTool
 
 with open('clippinator/tools/templates.yaml') as f:
@@ -36,11 +38,27 @@ class Remember(SimpleTool):
         super().__init__()
 
     def func(self, args: str) -> str:
-        self.project.memories.append(args)
-        self.project.memories = self.project.memories[-10:]
+        if not self.project.add_memory(args):
+            return "A similar fact is already remembered."
         return f"Remembered {args}."
 
 
+class Recall(SimpleTool):
+    name = "Recall"
+    description = "search the memory of the project (everything remembered with Remember) " \
+                  "for the facts related to the input query"
+
+    def __init__(self, project: Project):
+        self.project = project
+        super().__init__()
+
+    def func(self, args: str) -> str:
+        results = get_memory(self.project.path).retrieve(args.strip(), 5)
+        if not results:
+            return "Nothing found in the memory."
+        return "Found in the memory:\n" + "\n".join(f"  - {snippet}" for snippet, _ in results)
+
+
 class TemplateInfo(SimpleTool):
     name = "TemplateInfo"
     description = "get information about templates. Templates available:\n" + \
@@ -56,21 +74,23 @@ class TemplateInfo(SimpleTool):
         return self.structured_func(template_names)
 
 
-def setup_template(template_name: str, path: str, project_name: str):
+def setup_template(template_name: str, path: str, project_name: str, limits: ResourceLimits | None = None) -> str:
+    """
+    Run the setup command of the template, returns a note if it hit a resource limit or timed out
+    """
     template = templates[template_name]
     cmd = template['setup'].format(br='{}', project_name=project_name)
     cwd = os.path.realpath(os.path.join(path, '..'))
+    limits = limits or ResourceLimits()
     print(cmd)
-    completed_process = subprocess.run(
-        cmd,
-        shell=True,
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT,
-        cwd=cwd,
-        timeout=180,
-    )
-    stdout_output = completed_process.stdout.decode()
-    print('Deployed template:', stdout_output)
+    result = run_limited(cmd, cwd, limits, timeout=180, shell=True, merge_stderr=True)
+    print('Deployed template:', result.stdout)
+    note = limit_note(limits, result.exit_code, result.stdout)
+    record_usage(CommandUsage("TemplateSetup", cmd[:200], result.wall_seconds, result.cpu_seconds,
+                              result.max_rss, result.exit_code, note))
+    if result.exit_code is None:
+        return " (the setup command timed out after 180 seconds)"
+    return f" {note}" if note else ""
 
 
 class TemplateSetup(SimpleTool):
@@ -95,21 +115,22 @@ class TemplateSetup(SimpleTool):
             if os.path.exists(path_old):
                 os.system(f"rm -rf '{path_old}'")
             subprocess.run(['mv', self.project.path, path_old]).check_returncode()
-            setup_template(template_name, self.project.path, project_name)
+            note = setup_template(template_name, self.project.path, project_name,
+                                  ResourceLimits.for_project(self.project))
             template = templates[template_name]
             self.project.template = template_name
             if template.get('ci'):
                 ci = template['ci']
                 if ci.get('run'):
-                    self.project.memories.append(f"The command to run the project: `{ci.get('run')}`")
+                    self.project.add_memory(f"The command to run the project: `{ci.get('run')}`")
                 self.project.ci_commands = ci
-            if template.get('memories'):
-                self.project.memories.extend(template['memories'])
-            return f"Set up {template_name} template, overwrote old content."
+            for memory in template.get('memories') or []:
+                self.project.add_memory(memory)
+            return f"Set up {template_name} template, overwrote old content.{note}"
         path = os.path.join(self.project.path, path or '.')
         project_name = path.split('/')[-1]
-        setup_template(template_name, path, project_name)
-        return f"Set up {template_name} template in {path}."
+        note = setup_template(template_name, path, project_name, ResourceLimits.for_project(self.project))
+        return f"Set up {template_name} template in {path}.{note}"
 
     def func(self, args: str):
         args = args.split(';')
@@ -138,9 +159,9 @@ class SetCI(SimpleTool):
             **kwargs,
         }
         if run:
-            self.project.memories.append(f"The command to run the project: `{run}`")
+            self.project.add_memory(f"The command to run the project: `{run}`")
         if test:
-            self.project.memories.append(f"The command to test the project: `{test}`")
+            self.project.add_memory(f"The command to test the project: `{test}`")
         return f"CI set up."
 
     def func(self, args: str):
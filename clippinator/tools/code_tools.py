@@ -2,8 +2,9 @@ import os
 import subprocess
 from dataclasses import dataclass
 
+from clippinator.project.vfs import get_vfs
 from .tool import SimpleTool
-from .utils import skip_file
+from .utils import skip_file, trim_extra
 
 
 @dataclass
@@ -114,8 +115,7 @@ class SearchInFiles(SimpleTool):
                 file_path = os.path.join(root, file)
 
                 try:
-                    with open(file_path, 'r') as f:
-                        lines = f.readlines()
+                    lines = get_vfs(self.workdir).read_lines(file_path)
 
                     for line_number, line in enumerate(lines, start=1):
                         if search_query.lower() in line.lower():
@@ -143,3 +143,24 @@ class SearchInFiles(SimpleTool):
             return "\n".join(results)[:1500]
         else:
             return "No matches found."
+
+
+class SearchCode(SimpleTool):
+    """
+    Semantic search over the project code (see clippinator.project.code_index)
+    """
+    name = "SearchCode"
+    description = "finds the pieces of the project code most related to the input (a description of what you're " \
+                  "looking for, e.g. 'where the users are authenticated'). " \
+                  "Returns the file paths, line ranges and the code."
+
+    def __init__(self, wd: str = "."):
+        self.workdir = wd
+
+    def func(self, args: str) -> str:
+        from clippinator.project.code_index import get_code_index
+
+        results = get_code_index(self.workdir).search(args.strip(), 5)
+        if not results:
+            return "No code found."
+        return trim_extra("\n".join(chunk.format() for _, chunk in results), 5000)
@@ -1,18 +1,27 @@
+import json
 import os
+import re
+from contextlib import ExitStack
 from dataclasses import dataclass
-from typing import Any
+from typing import Any, Callable
 
-from langchain import PromptTemplate
-from langchain.chains.combine_documents.base import BaseCombineDocumentsChain
-from langchain.chains.summarize import load_summarize_chain
+import yaml
+
+from langchain import LLMChain, PromptTemplate
 from langchain.chat_models import ChatOpenAI
-from langchain.docstore.document import Document
-from langchain.text_splitter import (
-    RecursiveCharacterTextSplitter,
-)
 
+from clippinator.project.buffer import LineBuffer, buffer_cache
+from clippinator.project.code_index import notify_write
+from clippinator.project.lint_pool import get_lint_pool
+from clippinator.project.project_summary import get_file_outline
+from clippinator.project.vfs import get_vfs
 from clippinator.tools.tool import SimpleTool
-from .utils import trim_extra, unjson
+from .anchored_patch import (
+    is_search_replace, is_unified_diff, search_replace_edits, unified_diff_edits, split_unified_diff,
+)
+from .line_index import read_numbered
+from .summaries import summarize_content, get_summary_cache
+from .utils import trim_extra, unjson, write_tracker
 
 
 def strip_quotes(inp: str) -> str:
@@ -33,22 +42,16 @@ def strip_filename(inp: str) -> str:
     return inp.strip().strip("'").strip().split(": ")[-1].split(", ")[0].strip().removeprefix('/')
 
 
-patch_example = """Action: ReadFile
-Action Input: filename[10:60]
-AResult:
-<lines will be here. Now you can patch the file>
-Action: PatchFile
+patch_example = """Action: PatchFile
 Action Input: filename
-[2-4]
-def greet(name):  
+<<<<<<< SEARCH
+def greet(name):
+    print("Hi " + name)
+=======
+def greet(name):
     print("Hello, " + name + "!")
-[5]
-    a = 123
-    c = 789
-AResult: Patched successfully
-Action: ReadFile
-Action Input: filename[10:60]
-AResult: <check that it's okay>"""
+>>>>>>> REPLACE
+AResult: Successfully patched filename."""
 
 
 @dataclass
@@ -85,17 +88,12 @@ class WriteFile(SimpleTool):
             filename = strip_filename(filename)
             file_path = os.path.join(self.workdir, filename)
             try:
-                directory = os.path.dirname(file_path)
-                if not os.path.exists(directory):
-                    os.makedirs(directory)
-
                 # Write the content to the file
-                with open(file_path, "w") as f:
-                    f.write(content)
-
-                linter_output = self.project.lint_file(file_path)
-                if linter_output:
-                    result += f"Successfully written to {filename}. Linter output:\n{linter_output}\n\n"
+                with write_tracker.writing(file_path):
+                    get_vfs(self.workdir).write(file_path, content)
+                notify_write(self.workdir, file_path)
+                # The linter output comes with the next tool result of the agent
+                get_lint_pool(self.workdir).submit(file_path, self.project.lint_file)
 
                 result += f"Successfully written to {filename}.\n\n"
             except Exception as e:
@@ -107,19 +105,17 @@ class WriteFile(SimpleTool):
 
         print(args)
 
-        first_line, other_lines = args.split("\n", 1)
+        first_line, newline, other_lines = args.partition("\n")
         first_line = (
             first_line.replace("path=", "")
             .replace("filename=", "")
             .replace("content=", "")
         )
-        args = first_line + "\n" + other_lines
+        args = first_line + newline + other_lines
         if "\n" not in args:
-            file_path = strip_filename(args)
-            content = ""
-            with open(os.path.join(self.workdir, file_path), "w") as f:
-                f.write(content)
-                return "Created an empty file."
+            # The same write path as the content: the conflict detection, the code index and the linter
+            result = self.structured_func({strip_filename(args): ""})
+            return "Created an empty file." if result.startswith("Successfully") else result
         file_path, content = args.split("\n", 1)
         file_path = strip_filename(file_path)
         content = strip_quotes(content)
@@ -140,13 +136,15 @@ class ReadFile(SimpleTool):
     name = "ReadFile"
     description = (
         "a tool that can be used to read files. The input is just the file path. "
-        "Optionally, you can add [l1:l2] to the end of the file path to specify a range of lines to read."
+        "Optionally, you can add [l1:l2] to the end of the file path to specify a range of lines to read. "
+        "For long files you get an outline with line ranges, then read the ranges you need."
     )
     structured_desc = (
         "a tool that can be used to read files. "
         "It accepts a list as input, where each element is either a filename string or an object of the form "
         "{'filename': filename, 'start': int, 'end': int}. Start and end are line numbers from which to read. "
         "If only a filename is provided, the entire file will be read. "
+        "For long files you get an outline with line ranges, then read the ranges you need. "
         "Example input: ['file1.py', {'filename': 'file2.py', 'start': 10, 'end': 20}]"
     )
 
@@ -158,46 +156,51 @@ class ReadFile(SimpleTool):
             to_read = unjson(to_read)
         if isinstance(to_read, str):
             to_read = [to_read]
-        result = ''
+        # (path, (start, end) or None for the entire file, max length) or the error
+        requests = []
         for item in to_read:
             if isinstance(item, str):
-                # same behavior as before, but without using func
-                item = strip_filename(item)
-                try:
-                    with open(os.path.join(self.workdir, item), "r") as f:
-                        lines = f.readlines()
-                        lines = [f"{i + 1}|{line}" for i, line in enumerate(lines)]
-                        out = "```\n" + "".join(lines) + "\n```"
-                        if len(out) > 7000:
-                            result += (
-                                    trim_extra(out, 7000)
-                                    + "\n```\nFile too long, use the summarizer or "
-                                      "(preferably) request specific line ranges.\n\n"
-                            )
-                        else:
-                            result += out + '\n\n'
-                except Exception as e:
-                    result += f"Error reading file: {str(e)}\n\n"
+                requests.append((os.path.join(self.workdir, strip_filename(item)), None, 7000))
             elif isinstance(item, dict):
-                # read a specific range
                 try:
                     filename = strip_filename(item['filename'])
                     start = item.get('start', 1)
                     end = item.get('end', None)
-                    with open(os.path.join(self.workdir, filename), "r") as f:
-                        lines = f.readlines()
-                        lines = [f"{i + 1}|{line}" for i, line in enumerate(lines)]
-                        out = "```\n" + "".join(lines[start - 1:end]) + "\n```"
-                        if len(out) > 6000:
-                            result += (
-                                    trim_extra(out, 6000)
-                                    + "\n...\nFile too long, use the summarizer or "
-                                      "(preferably) request specific line ranges.\n\n"
-                            )
-                        else:
-                            result += out + '\n\n'
+                    requests.append((os.path.join(self.workdir, filename), (start, end), 6000))
                 except Exception as e:
-                    result += f"Error reading file: {str(e)}\n\n"
+                    requests.append(e)
+
+        # All the ranges of a file are read in one pass
+        by_path = {}
+        for i, request in enumerate(requests):
+            if not isinstance(request, Exception):
+                by_path.setdefault(request[0], []).append(i)
+        outputs = {}
+        for path, indices in by_path.items():
+            try:
+                texts = read_numbered(path, [requests[i][1:] for i in indices])
+            except Exception as e:
+                texts = [e] * len(indices)
+            outputs.update(zip(indices, texts))
+
+        result = ''
+        for i, request in enumerate(requests):
+            output = request if isinstance(request, Exception) else outputs[i]
+            if isinstance(output, Exception):
+                result += f"Error reading file: {str(output)}\n\n"
+                continue
+            text, length = output
+            outline = get_file_outline(request[0]) if length > request[2] and request[1] is None else ""
+            if outline:
+                filename = os.path.relpath(request[0], self.workdir)
+                result += f"{filename} is too long to read at once ({length} chars). Here is its outline " \
+                          f"(the line ranges of the top-level blocks), read the parts you need, " \
+                          f"e.g. `{filename}[10:60]`:\n```\n{outline}```\n\n"
+            elif length > request[2]:
+                result += text + ("\n```" if request[1] is None else "\n...") + \
+                          "\nFile too long, use the summarizer or (preferably) request specific line ranges.\n\n"
+            else:
+                result += text + '\n\n'
         return result.strip()
 
     def func(self, args: str) -> str:
@@ -217,53 +220,62 @@ class ReadFile(SimpleTool):
         return self.structured_func([{'filename': filename, 'start': start, 'end': end} for start, end in line_ranges])
 
 
+def validate_content(path: str, content: str) -> str | None:
+    """
+    Check that a Python, JSON or YAML file parses (in-process, without a linter). Returns the error
+    """
+    try:
+        if path.endswith(".py"):
+            compile(content, path, "exec", dont_inherit=True)
+        elif path.endswith(".json"):
+            json.loads(content)
+        elif path.endswith((".yaml", ".yml")):
+            list(yaml.safe_load_all(content))
+    except (SyntaxError, json.JSONDecodeError) as e:
+        lines = content.split("\n")
+        line = lines[e.lineno - 1] if e.lineno and 0 < e.lineno <= len(lines) else ""
+        return f"line {e.lineno}: {e.msg}" + (f"\n{e.lineno}|{line}" if line.strip() else "")
+    except (yaml.YAMLError, ValueError) as e:
+        return str(e)
+    return None
+
+
+RANGE_LINE = re.compile(r"^\[\s*(\d+)\s*(?:-\s*(\d+)\s*)?]$")
+
+
 def parse_patch(patch):
-    # Split the patch into lines
-    patch_lines = patch.strip().split("\n")
+    """
+    Parse the line range patch. The ranges are 1-indexed and inclusive in the text ([2-3] replaces lines 2 and 3),
+    the result is the structured patches: 0-indexed inclusive 'start' and 'end', 1-indexed 'after_line'
+    """
+    patch_lines = patch.split("\n")
+    while patch_lines and not patch_lines[0].strip():
+        patch_lines.pop(0)
+    while patch_lines and not patch_lines[-1].strip():
+        patch_lines.pop()
+    if patch_lines and not RANGE_LINE.match(patch_lines[0].strip()):
+        raise ValueError("Invalid line range format. Expected '[start-end]' or '[line]'.")
 
-    patch_index = 0
     patches = []
-
-    while patch_index < len(patch_lines):
-        if (
-                patch_index < len(patch_lines)
-                and patch_lines[patch_index].startswith("[")
-                and patch_lines[patch_index].endswith("]")
-        ):
-            # Parse the range from the patch
-            range_str = patch_lines[patch_index][1:-1]
-            try:
-                if "-" in range_str:
-                    range_start, range_end = map(int, range_str.split("-"))
-                    type = 'remove' if range_start == range_end else 'replace'
-                else:
-                    range_start = range_end = int(range_str)
-                    type = 'insert'
-                    range_end -= 1
-            except ValueError:
-                raise ValueError(
-                    "Invalid line range format. Expected '[start-end]' or '[line]'."
-                )
-
-            # Convert to 0-indexed
-            range_start -= 1
-            range_end -= 1
-
-            # Gather the replacement lines
-            patch_index += 1
-            replacements = []
-            while patch_index < len(patch_lines) and not (
-                    patch_lines[patch_index].startswith("[")
-                    and patch_lines[patch_index].endswith("]")
-            ):
-                replacements.append(patch_lines[patch_index])
-                patch_index += 1
-
-            patch_dict = {'type': type, 'start': range_start, 'end': range_end}
-            if replacements:
-                patch_dict['content'] = "\n".join(replacements)
-
-            patches.append(patch_dict)
+    for line in patch_lines:
+        match = RANGE_LINE.match(line.strip())
+        if not match:
+            patches[-1].setdefault('lines', []).append(line)
+            continue
+        if match.group(2) is None:
+            patches.append({'type': 'insert', 'after_line': int(match.group(1))})
+            continue
+        range_start, range_end = int(match.group(1)), int(match.group(2))
+        if range_start < 1 or range_end < range_start:
+            raise ValueError(f"Invalid line range [{range_start}-{range_end}], the lines are 1-indexed "
+                             f"and the end can't be before the start.")
+        patches.append({'type': 'remove', 'start': range_start - 1, 'end': range_end - 1})
+
+    for patch_dict in patches:
+        if 'lines' in patch_dict:
+            patch_dict['content'] = "\n".join(patch_dict.pop('lines'))
+            if patch_dict['type'] == 'remove':
+                patch_dict['type'] = 'replace'
     return patches
 
 
@@ -272,44 +284,63 @@ def apply_patch_str(file_content: str, patch: str):
     return apply_patch(file_content, patches)
 
 
-def apply_patch(file_content: str, patches: list[dict[str, Any]]):
-    # Split the content into lines
-    content_lines = file_content.strip().split("\n")
-
-    new_content = []
-    last_end_line = -1
-
+def patch_range(patch: dict[str, Any], line_count: int) -> tuple[int, int]:
+    """
+    The lines [start, end) (0-indexed) which the structured patch replaces
+    """
+    if patch.get('type') == 'insert':
+        after_line = patch.get('after_line', patch.get('start'))
+        if after_line is None:
+            raise ValueError("An insert needs 'after_line'.")
+        start = end = int(after_line)
+    elif patch.get('type') in ('replace', 'remove'):
+        start, end = int(patch['start']), int(patch.get('end', patch['start'])) + 1
+        if end <= start:
+            raise ValueError(f"Invalid line range, the end ({end - 1}) is before the start ({start}).")
+    else:
+        raise ValueError(f"Unknown patch type {patch.get('type')!r}, expected 'replace', 'remove' or 'insert'.")
+    if start < 0 or start > line_count or start == line_count and end > start:
+        line = start if patch['type'] == 'insert' else start + 1
+        raise ValueError(f"Line {line} is out of range, the file has {line_count} lines.")
+    return start, min(end, line_count)
+
+
+def apply_patch_to_buffer(buffer: LineBuffer, patches: list[dict[str, Any]]):
+    """
+    Apply the structured patches in place. The line numbers refer to the content before the patches,
+    the ranges must go in order and not overlap.
+    """
+    last_end, shift = 0, 0
     for patch in patches:
-        # Check if the ranges overlap
-        if patch['start'] <= last_end_line:
+        start, end = patch_range(patch, buffer.line_count)
+        if start < last_end:
             raise ValueError(
-                f"Line ranges overlap. Previous range ends at line {last_end_line + 1}, but next range starts at line {patch['start'] + 1}."
+                f"Line ranges overlap. Previous range ends at line {last_end}, but next range starts at line {start + 1}."
             )
+        content = patch.get('content') if patch.get('type') != 'remove' else None
+        lines = content.split("\n") if content is not None else []
+        buffer.replace(start + shift, end + shift, lines)
+        shift += len(lines) - (end - start)
+        last_end = end
 
-        last_end_line = patch['end']
-
-        # Append lines from content that are before the range
-        while last_end_line < patch['start']:
-            new_content.append(content_lines[last_end_line])
-            last_end_line += 1
 
-        # Handle replace and remove
-        if patch['type'] in ('replace', 'remove'):
-            # Skip lines from content that are within the range
-            last_end_line = patch['end'] + 1
-
-            # Append the replacement lines
-            if patch['type'] == 'replace':
-                new_content.extend(patch['content'].split("\n"))
-
-        # Handle insert
-        elif patch['type'] == 'insert':
-            new_content.extend(patch['content'].split("\n"))
+def apply_patch(file_content: str, patches: list[dict[str, Any]]):
+    buffer = LineBuffer(file_content)
+    apply_patch_to_buffer(buffer, patches)
+    return buffer.text()
 
-    # Append any remaining lines from content
-    new_content.extend(content_lines[last_end_line:])
 
-    return "\n".join(new_content)
+def apply_text_patch(buffer: LineBuffer, patch: str):
+    """
+    Apply a patch in any of the formats to the buffer: search/replace blocks, a unified diff or line ranges
+    """
+    if is_search_replace(patch) or is_unified_diff(patch):
+        # The positions are found in a list of the lines, the buffer only gets the replaced ranges
+        find_edits = search_replace_edits if is_search_replace(patch) else unified_diff_edits
+        for start, end, lines in find_edits(buffer.get_lines(0, buffer.total), patch):
+            buffer.replace(start, end, lines)
+    else:
+        apply_patch_to_buffer(buffer, parse_patch(patch))
 
 
 @dataclass
@@ -320,9 +351,17 @@ class PatchFile(SimpleTool):
 
     name = "PatchFile"
     description = """
-The patch format is a text-based representation designed to apply modifications to another text, typically source code. 
-Each modification is represented by a line range to be replaced, followed by the replacement content. 
-The line range is specified in brackets, such as [start-end] to replace from start to end (10-20 will erase lines 10, 11, ..., 19, 1-indexed, and replace them by the new content) or [line] to insert a line after the specified line, where the line numbers are 1-indexed. 
+The input is the filename on the first line and then the patch. The best patch format is search/replace blocks, they don't need line numbers, so you don't have to read the file first (just copy the lines you want to change exactly, with a few lines around them if they aren't unique):
+```
+<<<<<<< SEARCH
+the current lines
+=======
+the new lines
+>>>>>>> REPLACE
+```
+You can put several blocks one after another, an empty SEARCH part appends to the end of the file. A unified diff (`--- a/file`, `+++ b/file`, `@@ ... @@` hunks) works too, the hunks are applied by their content.
+The other format is line ranges: a line range to be replaced, followed by the replacement content. 
+The line range is specified in brackets, such as [start-end] to replace from start to end (10-20 will erase lines 10, 11, ..., 20 and replace them by the new content) or [line] to insert after the specified line ([0] inserts at the beginning), where the line numbers are 1-indexed. 
 The replacement content follows the line range and can span multiple lines. Here is a sample patch:
 ```
 [2-3]
@@ -332,29 +371,100 @@ insert after line 5 (btw, use [5-5] with nothing after it if you want to delete
 [20-20]
 replacement for line 20
 ```
-The patch lines are applied in order, and the ranges must not overlap or intersect. Any violation of this format will result in an error.
-Make sure to read the relevant part of the file before patching, especially if you're trying to fix something.
+The patch lines are applied in order, and the ranges must not overlap or intersect. Any violation of this format will result in an error. Read the relevant part of the file before patching with line ranges.
+To patch several files at once, start the input with `*** filename` and put `*** other_filename` before the patch of each next file. The files are patched together: if a patch fails or a Python/JSON/YAML file stops parsing, nothing is written.
 """
     structured_desc = """
 The patch tool is used to apply modifications to a file. It takes the filename and the changes. 
 The patches are a list of modifications, each of them can be one of the following:
-{'type': 'remove', 'start': line number from which to delete, 'end': ...}: to delete lines from the content. The 'start' and 'end' keys specify the range of lines to be deleted (0-indexed). 
+{'type': 'remove', 'start': line number from which to delete, 'end': ...}: to delete lines from the content. The 'start' and 'end' keys specify the range of lines to be deleted (0-indexed, inclusive). 
 {'type': 'replace', 'start' ..., 'end': ..., 'content': 'new content here'}: to replace lines in the content. The 'start' and 'end' keys specify the range of lines to be replaced, and the 'content' key provides the new content.
-{'type': 'insert', 'after_line': ..., 'content': '...}: to insert lines into the content. The 'after_line' key specifies the line after which new content will be inserted, and the 'content' key provides the new content.
+{'type': 'insert', 'after_line': ..., 'content': '...}: to insert lines into the content. The 'after_line' key specifies the line after which new content will be inserted (1-indexed, 0 inserts at the beginning), and the 'content' key provides the new content.
+Instead of the list, the patches can be a string with search/replace blocks (<<<<<<< SEARCH, the current lines, =======, the new lines, >>>>>>> REPLACE) or a unified diff, then you don't need the line numbers.
+To patch several files at once, pass `files`: {filename: patches} instead. The files are patched together: if a patch fails or a Python/JSON/YAML file stops parsing, nothing is written.
 """
 
-    def __init__(self, wd: str = "."):
+    def __init__(self, wd: str = ".", lint: Callable[[str], str] | None = None):
         self.workdir = wd
-
-    def structured_func(self, filename: str, patches: list[dict[str, Any]]) -> str:
-        filename = os.path.join(self.workdir, filename)
-        try:
-            new_content = apply_patch(open(filename).read(), patches)
-        except Exception as e:
-            return f"Error applying patch: {str(e)}."
-        with open(filename, "w") as file:
-            file.write(new_content)
-        return f"Successfully patched {filename}."
+        self.lint = lint
+
+    def patch_files(self, changes: dict[str, Callable[[LineBuffer], None]]) -> str:
+        """
+        Apply the patches (filename -> function which edits the buffer of the file) as one transaction:
+        the patches are applied to copies of the buffers and validated first, nothing is written if any of them fails.
+        A result which doesn't parse is rejected only if the original file parsed.
+        The buffers of the written files are kept, so the next patch of the file doesn't split it into lines again.
+        """
+        vfs = get_vfs(self.workdir)
+        paths = {os.path.join(self.workdir, strip_filename(filename)): patch for filename, patch in changes.items()}
+        new_buffers, new_contents, errors = {}, {}, []
+        with ExitStack() as stack:
+            for path in sorted(paths):
+                stack.enter_context(write_tracker.writing(path))
+            for path, patch in paths.items():
+                name = os.path.relpath(path, self.workdir)
+                try:
+                    buffer = buffer_cache.get(path, vfs.read)
+                    new_buffer = buffer.copy()
+                    patch(new_buffer)
+                except Exception as e:
+                    errors.append(f"{name}: {str(e)}")
+                    continue
+                new_content = new_buffer.text()
+                error = validate_content(path, new_content)
+                if error and not validate_content(path, buffer.text()):
+                    errors.append(f"{name}: the patched file doesn't parse, {error}")
+                new_buffers[path], new_contents[path] = new_buffer, new_content
+            if errors:
+                if len(paths) == 1:
+                    error = errors[0].split(': ', 1)[1]
+                    # The multi-line errors end with the code, the others may already end with a period
+                    ending = "." if "\n" not in error and not error.endswith((".", "!", "?", ":")) else ""
+                    return f"Error applying patch: {error}{ending}"
+                return "Error applying patch, no files were changed:\n" + "\n".join(errors)
+            try:
+                vfs.write_many(new_contents)
+            except Exception as e:
+                return f"Error writing the patched files, no files were changed: {str(e)}."
+            for path, new_buffer in new_buffers.items():
+                # A text-mode read would translate '\r', so such buffers would differ from the file
+                if "\r" not in new_contents[path]:
+                    buffer_cache.put(path, new_buffer)
+        for path in new_contents:
+            notify_write(self.workdir, path)
+            if self.lint:
+                # The linter output comes with the next tool result of the agent
+                get_lint_pool(self.workdir).submit(path, self.lint)
+        if len(paths) == 1:
+            return f"Successfully patched {next(iter(paths))}."
+        return f"Successfully patched {', '.join(os.path.relpath(path, self.workdir) for path in paths)}."
+
+    def structured_func(self, filename: str = "", patches: list[dict[str, Any]] | None = None,
+                        files: dict[str, list[dict[str, Any]]] | None = None) -> str:
+        files = dict(unjson(files) if files else {})
+        if filename:
+            files[filename] = patches or []
+        return self.patch_files({
+            name: lambda buffer, file_patches=file_patches: (
+                apply_text_patch(buffer, file_patches) if isinstance(file_patches, str)
+                else apply_patch_to_buffer(buffer, file_patches))
+            for name, file_patches in files.items()
+        })
+
+    @staticmethod
+    def split_files(args: str) -> list[tuple[str, str]] | None:
+        """
+        Split a multi-file patch (each file starts with a `*** filename` line) into (filename, patch) pairs
+        """
+        if not args.startswith("*** "):
+            return None
+        files = []
+        for line in args.split("\n"):
+            if line.startswith("*** "):
+                files.append([line[4:], ""])
+            else:
+                files[-1][1] += line + "\n"
+        return [(strip_filename(filename), strip_quotes(patch)) for filename, patch in files]
 
     def func(self, args: str) -> str:
         if "\n" not in strip_quotes(args):
@@ -363,17 +473,16 @@ The patches are a list of modifications, each of them can be one of the followin
                     "The first line should be the filename, the rest should be the patch."
                     " Here is an example of patching:\n" + patch_example
             )
-        filename, patch = strip_quotes(args).split("\n", 1)
-        filename = strip_filename(filename)
-        patch = strip_quotes(patch)
-        filename = os.path.join(self.workdir, filename.strip())
-        try:
-            new_content = apply_patch_str(open(filename).read(), patch)
-        except Exception as e:
-            return f"Error applying patch: {str(e)}. Here's a reminder on how to patch:\n{patch_example}"
-        with open(filename, "w") as file:
-            file.write(new_content)
-        return f"Successfully patched {filename}."
+        args = strip_quotes(args)
+        files = split_unified_diff(args) if args.startswith(("--- ", "diff ")) else self.split_files(args)
+        if not files:
+            filename, patch = strip_quotes(args).split("\n", 1)
+            files = [(strip_filename(filename).strip(), strip_quotes(patch))]
+        result = self.patch_files({filename: lambda buffer, patch=patch: apply_text_patch(buffer, patch)
+                                   for filename, patch in files})
+        if result.startswith("Error applying patch") and "doesn't parse" not in result:
+            result += ("\n" if "\n" in result else " ") + f"Here's a reminder on how to patch:\n{patch_example}"
+        return result
 
 
 mr_prompt_template = """You need to write a summary of the content of a file. You should provide an overview of what this file contains (classes, functions, content, etc.)
@@ -400,34 +509,30 @@ class SummarizeFile(SimpleTool):
     description = (
         "a tool that can be used to summarize files. The input is just the file path."
     )
-    summary_agent: BaseCombineDocumentsChain
-    text_splitter: RecursiveCharacterTextSplitter
 
-    def __init__(self, wd: str = ".", model_name: str = "gpt-3.5-turbo"):
+    def __init__(self, wd: str = ".", model_name: str = "gpt-3.5-turbo", max_workers: int | None = None):
         self.workdir = wd
-        mr_prompt = PromptTemplate(
-            template=mr_prompt_template, input_variables=["text"]
-        )
-        self.summary_agent = load_summarize_chain(
-            ChatOpenAI(model_name=model_name, request_timeout=140),
-            chain_type="map_reduce",
-            map_prompt=mr_prompt,
-            combine_prompt=mr_prompt,
-        )
-        self.text_splitter = RecursiveCharacterTextSplitter()
+        self.model_name = model_name
+        self.max_workers = max_workers or int(os.environ.get("CLIPPINATOR_SUMMARY_WORKERS", 4))
+        self._summary_chain: LLMChain | None = None
+
+    @property
+    def summary_chain(self) -> LLMChain:
+        # The chain (and its model client) is built on the first use, not with the tools
+        if self._summary_chain is None:
+            self._summary_chain = LLMChain(
+                llm=ChatOpenAI(model_name=self.model_name, request_timeout=140),
+                prompt=PromptTemplate(template=mr_prompt_template, input_variables=["text"]),
+            )
+        return self._summary_chain
 
     def func(self, args: str) -> str:
         try:
-            with open(os.path.join(self.workdir, strip_filename(args)), "r") as f:
-                inp = f.readlines()
-                inp = "".join([f"{i + 1}| {line}" for i, line in enumerate(inp)])
-                texts = self.text_splitter.split_text(inp)
-                docs = [Document(page_content=t) for t in texts]
-                result = self.summary_agent.run(docs)
-                if len(result) > 4000:
-                    texts_2 = self.text_splitter.split_text(result)
-                    docs_2 = [Document(page_content=t) for t in texts_2]
-                    result = self.summary_agent.run(docs_2)
-                return f"```\n{result}\n```"
+            content = get_vfs(self.workdir).read(os.path.join(self.workdir, strip_filename(args)))
+            result = summarize_content(
+                content, lambda text: self.summary_chain.predict(text=text), get_summary_cache(self.workdir),
+                model=self.model_name, max_workers=self.max_workers,
+            )
+            return f"```\n{result}\n```"
         except Exception as e:
             return f"Error reading file: {str(e)}"
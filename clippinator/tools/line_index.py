@@ -0,0 +1,208 @@
+from __future__ import annotations
+
+import codecs
+import locale
+import mmap
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from clippinator.project.vfs import vfs_for, write_hooks
+from .utils import trim_extra
+
+
+def count_digits(n: int) -> int:
+    """
+    The total number of digits in the numbers 1..n
+    """
+    total, width, low = 0, 1, 1
+    while low <= n:
+        high = min(n, low * 10 - 1)
+        total += (high - low + 1) * width
+        width, low = width + 1, low * 10
+    return total
+
+
+class LineIndex:
+    """
+    Byte and character offsets of the lines of a file, so that a range of lines can be read
+    (through mmap) without reading and splitting the whole file.
+    Only for UTF-8 files without '\\r' (otherwise, the universal newlines of text mode are needed),
+    `LineIndex.get` returns None for the other files.
+    """
+
+    cache: OrderedDict[str, LineIndex] = OrderedDict()
+    cache_size = 32
+    lock = threading.Lock()
+    generation = 0  # incremented by invalidate, an index built meanwhile isn't cached
+
+    def __init__(self, path: str, mtime_ns: int, size: int, data: bytes | mmap.mmap):
+        self.path = path
+        self.mtime_ns = mtime_ns
+        self.size = size
+        array = np.frombuffer(data, dtype=np.uint8)
+        newlines = np.flatnonzero(array == 10)
+        # starts[i] is the offset of the i-th line, starts[-1] is the end of the file
+        starts = np.concatenate([[0], newlines + 1])
+        if starts[-1] != size:
+            starts = np.concatenate([starts, [size]])
+        self.starts = starts.astype(np.int64)
+        self.count = len(self.starts) - 1
+        if not size or array.max() < 0x80:
+            self.chars = self.starts
+        else:
+            # Characters are the bytes which are not UTF-8 continuation bytes
+            char_starts = (array & 0xC0) != 0x80
+            per_line = np.add.reduceat(char_starts, self.starts[:-1], dtype=np.int64)
+            self.chars = np.concatenate([[0], np.cumsum(per_line)]).astype(np.int64)
+
+    @classmethod
+    def get(cls, path: str) -> LineIndex | None:
+        """
+        The cached index of the file (rebuilt when the mtime or the size changes)
+        """
+        if codecs.lookup(locale.getpreferredencoding(False)).name not in ("utf-8", "ascii"):
+            return None
+        path = os.path.abspath(path)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        with cls.lock:
+            generation = cls.generation
+            index = cls.cache.get(path)
+            if index and (index.mtime_ns, index.size) == (stat.st_mtime_ns, stat.st_size):
+                cls.cache.move_to_end(path)
+                return index
+        if not os.path.isfile(path) or not stat.st_size:
+            return None
+        try:
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if data.find(b"\r") != -1:
+                    return None
+                str(data, "utf-8")  # raises UnicodeDecodeError for invalid files
+                # The stat of the opened file: it could have been replaced after os.stat
+                stat = os.fstat(f.fileno())
+                index = cls(path, stat.st_mtime_ns, stat.st_size, data)
+        except (OSError, ValueError, UnicodeDecodeError):
+            return None
+        with cls.lock:
+            if cls.generation != generation:
+                return index
+            cls.cache[path] = index
+            if len(cls.cache) > cls.cache_size:
+                cls.cache.popitem(last=False)
+        return index
+
+    @classmethod
+    def invalidate(cls, path: str):
+        """
+        Drop the index of a file written through the VFS (a rewrite can keep the mtime and the size)
+        """
+        with cls.lock:
+            cls.generation += 1
+            cls.cache.pop(os.path.abspath(path), None)
+
+    def _prefix(self, i: int) -> str:
+        return f"{i + 1}|"
+
+    def _text(self, data, i: int) -> str:
+        return str(data[self.starts[i]:self.starts[i + 1]], "utf-8")
+
+    def read_lines(self, numbers: list[int], max_chars: int = 200) -> dict[int, str]:
+        """
+        Get the given lines (1-indexed, without the newline, at most max_chars)
+        """
+        with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return {number: self._head(data, number - 1, max_chars + 1).rstrip("\n")[:max_chars]
+                    for number in numbers if 0 < number <= self.count}
+
+    def _head(self, data, i: int, n_chars: int) -> str:
+        # A char is at most 4 bytes, the incremental decoder drops the incomplete char at the end
+        end = min(int(self.starts[i + 1]), int(self.starts[i]) + 4 * n_chars)
+        return codecs.getincrementaldecoder("utf-8")().decode(data[self.starts[i]:end])[:n_chars]
+
+    def _tail(self, data, i: int, n_chars: int) -> str:
+        chunk = data[max(int(self.starts[i]), int(self.starts[i + 1]) - 4 * n_chars):self.starts[i + 1]]
+        chunk = chunk.lstrip(bytes(range(0x80, 0xC0)))  # cut in the middle of a char
+        return str(chunk, "utf-8")[-n_chars:]
+
+    def numbered(self, data, line_slice: slice, max_length: int, end_length: int = 1300) -> tuple[str, int]:
+        """
+        The same as trim_extra("```\\n" + "".join(numbered lines[line_slice]) + "\\n```", max_length, end_length)
+        (with lines numbered like "12|line"), but only the lines that get into the result are decoded.
+        Returns (the text, the length before trimming).
+        """
+        lines = range(self.count)[line_slice]
+        if not lines:
+            return "```\n\n```", 8
+        first, last = lines[0], lines[-1] + 1
+        length = 8 + int(self.chars[last] - self.chars[first]) + count_digits(last) - count_digits(first) \
+            + last - first
+        if length <= max_length:
+            parts = str(data[self.starts[first]:self.starts[last]], "utf-8").split("\n")
+            out = "".join(self._prefix(first + j) + part + "\n" for j, part in enumerate(parts[:-1]))
+            if parts[-1]:
+                out += self._prefix(last - 1) + parts[-1]
+            return "```\n" + out + "\n```", length
+
+        head_length = max_length - end_length
+        head = "```\n"
+        for i in range(first, last):
+            head += self._prefix(i)
+            if len(head) >= head_length:
+                break
+            if self.chars[i + 1] - self.chars[i] >= head_length - len(head):
+                head += self._head(data, i, head_length - len(head))
+                break
+            head += self._text(data, i)
+        else:
+            head += "\n```"
+        tail = "\n```"
+        for i in range(last - 1, first - 1, -1):
+            if len(tail) >= end_length:
+                break
+            if self.chars[i + 1] - self.chars[i] >= end_length - len(tail):
+                tail = self._tail(data, i, end_length - len(tail)) + tail
+                break
+            tail = self._prefix(i) + self._text(data, i) + tail
+        else:
+            tail = "```\n" + tail
+        return head[:head_length] + f"\n...[skipped {length - max_length} chars]\n" + tail[-end_length:], length
+
+
+
+write_hooks.append(LineIndex.invalidate)
+
+def to_slice(line_range: tuple[int, int | None] | None) -> slice:
+    if line_range is None:
+        return slice(None)
+    start, end = line_range
+    return slice(start - 1, end)
+
+
+def read_numbered_legacy(path: str, ranges: list[tuple[tuple[int, int | None] | None, int]]) -> list[tuple[str, int]]:
+    lines = vfs_for(path).read_lines(path)
+    lines = [f"{i + 1}|{line}" for i, line in enumerate(lines)]
+    result = []
+    for line_range, max_length in ranges:
+        out = "```\n" + "".join(lines[to_slice(line_range)]) + "\n```"
+        result.append((trim_extra(out, max_length), len(out)))
+    return result
+
+
+def read_numbered(path: str, ranges: list[tuple[tuple[int, int | None] | None, int]]) -> list[tuple[str, int]]:
+    """
+    Read several ranges of lines of a file in one pass.
+    For each ((start, end) - the slice lines[start - 1:end], or None for the whole file; max length)
+    get the numbered lines in a code block, trimmed to max length (as trim_extra does), and the untrimmed length.
+    """
+    index = LineIndex.get(path)
+    if index is None:
+        return read_numbered_legacy(path, ranges)
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        if len(data) != index.size:  # changed after the index was built
+            return read_numbered_legacy(path, ranges)
+        return [index.numbered(data, to_slice(line_range), max_length) for line_range, max_length in ranges]
@@ -0,0 +1,212 @@
+from __future__ import annotations
+
+import itertools
+import os
+import signal
+import time
+from dataclasses import dataclass, field
+from functools import lru_cache
+
+counter = itertools.count()
+
+
+@lru_cache(maxsize=1)
+def cgroup_root() -> str | None:
+    """
+    The cgroup v2 directory of this process, if cgroup v2 is mounted and we can create cgroups in it
+    """
+    try:
+        with open("/proc/self/mountinfo") as f:
+            mounts = [line.split() for line in f]
+        mount = next(parts[4] for parts in mounts if parts[parts.index("-") + 1] == "cgroup2")
+        with open("/proc/self/cgroup") as f:
+            own = next(line.strip()[3:] for line in f if line.startswith("0::"))
+    except (OSError, StopIteration, ValueError):
+        return None
+    path = os.path.join(mount, own.lstrip("/"))
+    return path if os.access(path, os.W_OK) else None
+
+
+def create_cgroup(name: str) -> str | None:
+    """
+    Create a cgroup for a process tree (None if cgroups v2 aren't available)
+    """
+    root = cgroup_root()
+    if not root:
+        return None
+    path = os.path.join(root, f"clippinator-{os.getpid()}-{name}-{next(counter)}")
+    try:
+        os.mkdir(path)
+    except OSError:
+        return None
+    return path
+
+
+def join_cgroup(path: str | None):
+    """
+    Move the current process into the cgroup (used in preexec_fn, so the whole tree starts inside it)
+    """
+    if path:
+        try:
+            fd = os.open(os.path.join(path, "cgroup.procs"), os.O_WRONLY)
+            try:
+                os.write(fd, b"0")
+            finally:
+                os.close(fd)
+        except OSError:
+            pass
+
+
+def read_file(path: str) -> str:
+    try:
+        with open(path) as f:
+            return f.read()
+    except OSError:
+        return ""
+
+
+def proc_stat(pid: int | str) -> list[str] | None:
+    """
+    The fields of /proc/<pid>/stat after the command name: state, ppid, pgrp, ...
+    """
+    stat = read_file(f"/proc/{pid}/stat")
+    return stat[stat.rfind(")") + 2:].split() if stat else None
+
+
+def process_cpu_seconds(pid: int) -> float:
+    """
+    The CPU time of the process and its waited-for children
+    """
+    fields = proc_stat(pid)
+    # utime, stime, cutime, cstime
+    return sum(int(value) for value in fields[11:15]) / os.sysconf("SC_CLK_TCK") if fields else 0.0
+
+
+def tree_pids(pid: int, cgroup: str | None = None, reaped: bool = False) -> list[int]:
+    """
+    The live processes of the tree: the cgroup members, the process group (pgid = pid) and the descendants.
+    Once the leader is reaped (`reaped`), its pid can belong to an unrelated process, so the pid itself and
+    its children aren't included, only the cgroup and the process group members with their descendants.
+    """
+    pids = {int(line) for line in read_file(os.path.join(cgroup, "cgroup.procs")).split()} if cgroup else set()
+    alive, children = set(), {}
+    for entry in os.listdir("/proc"):
+        fields = proc_stat(entry) if entry.isdigit() else None
+        if not fields or fields[0] == "Z":
+            continue
+        alive.add(int(entry))
+        if int(fields[2]) == pid:
+            pids.add(int(entry))
+        children.setdefault(int(fields[1]), []).append(int(entry))
+    if not reaped and pid in alive:
+        pids.add(pid)
+    # The descendants which have left the process group (setsid) are still its children
+    stack = [*pids] if reaped else [pid, *pids]
+    while stack:
+        for child in children.get(stack.pop(), []):
+            if child not in pids:
+                pids.add(child)
+                stack.append(child)
+    return sorted(pids & alive)
+
+
+def kill_tree(pid: int, cgroup: str | None = None, sig: int = signal.SIGKILL, reaped: bool = False):
+    """
+    Kill the whole tree: the cgroup (cgroup.kill), the process group and the descendants which left it.
+    `reaped` is whether the leader has been waited for (Popen.returncode is set): then only the processes
+    known to be in the tree are signalled, never the pid or the process group by its number, which could be reused.
+    """
+    if cgroup and sig == signal.SIGKILL and os.path.exists(os.path.join(cgroup, "cgroup.kill")):
+        try:
+            with open(os.path.join(cgroup, "cgroup.kill"), "w") as f:
+                f.write("1")
+        except OSError:
+            pass
+    for target in tree_pids(pid, cgroup, reaped):
+        try:
+            os.kill(target, sig)
+        except OSError:
+            pass
+    if reaped:
+        return
+    try:
+        os.killpg(pid, sig)
+    except OSError:
+        pass
+
+
+def remove_cgroup(cgroup: str | None):
+    """
+    Remove the cgroup (possible only after all its processes are gone, the killed ones can take a moment)
+    """
+    for _ in range(20 if cgroup else 0):
+        try:
+            os.rmdir(cgroup)
+            return
+        except FileNotFoundError:
+            return
+        except OSError:
+            time.sleep(0.05)
+
+
+def listening_ports(pids: list[int]) -> list[int]:
+    """
+    The TCP ports the processes listen on (from their socket inodes and /proc/net/tcp*)
+    """
+    inodes = set()
+    for pid in pids:
+        try:
+            fds = os.listdir(f"/proc/{pid}/fd")
+        except OSError:
+            continue
+        for fd in fds:
+            try:
+                target = os.readlink(f"/proc/{pid}/fd/{fd}")
+            except OSError:
+                continue
+            if target.startswith("socket:["):
+                inodes.add(target[8:-1])
+    ports = set()
+    for table in ("/proc/net/tcp", "/proc/net/tcp6"):
+        for line in read_file(table).splitlines()[1:]:
+            parts = line.split()
+            # 0A is LISTEN
+            if len(parts) > 9 and parts[3] == "0A" and parts[9] in inodes:
+                ports.add(int(parts[1].rsplit(":", 1)[1], 16))
+    return sorted(ports)
+
+
+@dataclass
+class TreeUsage:
+    cpu_seconds: float = 0.0
+    peak_rss: int = 0  # bytes
+    pids: list[int] = field(default_factory=list)
+    ports: list[int] = field(default_factory=list)
+
+    def __str__(self) -> str:
+        result = f"cpu {self.cpu_seconds:.1f}s, peak RSS {self.peak_rss / 1e6:.0f}MB, {len(self.pids)} processes"
+        if self.ports:
+            result += f", ports {', '.join(map(str, self.ports))}"
+        return result
+
+
+def tree_usage(pid: int, cgroup: str | None = None, reaped: bool = False) -> TreeUsage:
+    """
+    CPU time, peak RSS and listening ports of the tree. The cgroup counters include the exited processes,
+    without a cgroup the CPU time is the live processes' plus their waited-for children's (from /proc).
+    """
+    usage = TreeUsage(pids=tree_pids(pid, cgroup, reaped))
+    for member in usage.pids:
+        usage.cpu_seconds += process_cpu_seconds(member)
+        for line in read_file(f"/proc/{member}/status").splitlines():
+            if line.startswith("VmHWM:"):
+                usage.peak_rss += int(line.split()[1]) * 1024
+    if cgroup:
+        for line in read_file(os.path.join(cgroup, "cpu.stat")).splitlines():
+            if line.startswith("usage_usec"):
+                usage.cpu_seconds = max(usage.cpu_seconds, int(line.split()[1]) / 1e6)
+        peak = read_file(os.path.join(cgroup, "memory.peak")).strip()
+        if peak.isdigit():
+            usage.peak_rss = int(peak)
+    usage.ports = listening_ports(usage.pids)
+    return usage
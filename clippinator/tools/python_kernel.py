@@ -0,0 +1,242 @@
+from __future__ import annotations
+
+import atexit
+import dataclasses
+import json
+import os
+import secrets
+import select
+import signal
+import subprocess
+import threading
+import time
+from dataclasses import dataclass
+
+from .file_tools import strip_quotes
+from .process_tree import create_cgroup, kill_tree, process_cpu_seconds, remove_cgroup
+from .sandbox import CommandUsage, ResourceLimits, limit_note, record_usage
+from .terminal import CommandOutput, ShellPool
+
+PYTHON_TIMEOUT = int(os.environ.get("CLIPPINATOR_PYTHON_TIMEOUT", 40))
+MAX_KERNELS = int(os.environ.get("CLIPPINATOR_PYTHON_KERNELS", 2))
+# The modules the workers import in advance, like "numpy,pandas"
+PRELOAD = [name.strip() for name in os.environ.get("CLIPPINATOR_PYTHON_PRELOAD", "").split(",") if name.strip()]
+INTERRUPT_GRACE = 3.0  # seconds the code gets to handle KeyboardInterrupt before the worker is killed
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "python_worker.py")
+
+
+@dataclass
+class KernelResult:
+    output: str
+    exit_code: int | None  # 1 if the code raised an exception, None if it timed out
+    cpu_seconds: float = 0.0
+    max_rss: int = 0
+    restarted: bool = False  # the worker was killed or has exited, its state is lost
+
+
+class PythonKernel:
+    """
+    A persistent Python process (python_worker.py): the variables, imports and functions stay between the runs.
+    The requests are written to its stdin, the end of a run is detected by a unique sentinel in the output.
+    On timeout the code is interrupted like with Ctrl+C, the worker is killed only if it doesn't stop.
+    """
+
+    def __init__(self, workdir: str, limits: ResourceLimits | None = None):
+        self.limits = limits or ResourceLimits()
+        self.cgroup = create_cgroup("python")
+        self.process = subprocess.Popen(
+            ["python", "-u", WORKER_SCRIPT, *PRELOAD],
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            cwd=workdir,
+            start_new_session=True,
+            # RLIMIT_CPU counts the lifetime of the process, the worker sets it for every run itself
+            preexec_fn=dataclasses.replace(self.limits, cpu_seconds=None).preexec(self.cgroup),
+        )
+        self.fd = self.process.stdout.fileno()
+
+    @property
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def run(self, code: str, timeout: float = PYTHON_TIMEOUT) -> KernelResult:
+        sentinel = f"__CLIPPINATOR_DONE_{secrets.token_hex(8)}__:"
+        request = {"code": code, "sentinel": sentinel, "cpu_seconds": self.limits.cpu_seconds}
+        output = CommandOutput(sentinel.encode())
+        cpu_before = process_cpu_seconds(self.process.pid)
+        try:
+            self.process.stdin.write(json.dumps(request).encode() + b"\n")
+            self.process.stdin.flush()
+        except OSError:
+            self.close()
+            return KernelResult("", self.process.returncode, restarted=True)
+        deadline = time.monotonic() + timeout
+        interrupted = False
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                if interrupted:
+                    return self._restarted(output, cpu_before, timed_out=True)
+                # KeyboardInterrupt in the code, the processes it started get SIGINT as well
+                interrupted = True
+                try:
+                    os.killpg(self.process.pid, signal.SIGINT)
+                except OSError:
+                    pass
+                deadline = time.monotonic() + INTERRUPT_GRACE
+                continue
+            ready, _, _ = select.select([self.fd], [], [], remaining)
+            data = os.read(self.fd, 65536) if ready else b""
+            if ready and not data:
+                return self._restarted(output, cpu_before, timed_out=False)
+            rest = output.feed(data)
+            if rest is not None:
+                result = json.loads(rest)
+                exit_code = None if interrupted else 0 if result["ok"] else 1
+                return KernelResult(output.text(), exit_code, result["cpu_seconds"], result["max_rss"])
+
+    def _restarted(self, output: CommandOutput, cpu_before: float, timed_out: bool) -> KernelResult:
+        # The process isn't reaped yet, so its CPU time is still in /proc
+        cpu_seconds = max(process_cpu_seconds(self.process.pid) - cpu_before, 0.0)
+        self.close()
+        exit_code = None if timed_out else self.process.returncode
+        return KernelResult(output.text(), exit_code, cpu_seconds, restarted=True)
+
+    def close(self):
+        # The processes the code started can outlive a reaped worker
+        kill_tree(self.process.pid, self.cgroup, reaped=self.process.returncode is not None)
+        self.process.wait()
+        remove_cgroup(self.cgroup)
+        for stream in (self.process.stdin, self.process.stdout):
+            try:
+                stream.close()
+            except OSError:
+                pass
+
+
+class KernelPool(ShellPool):
+    """
+    The Python workers of a project. Like with the shells, a thread gets the worker it used last,
+    so an agent keeps its variables. One more worker is kept warm: a new or restarted kernel is ready at once,
+    without waiting for the interpreter to start and import the preloaded modules.
+    """
+
+    def __init__(self, workdir: str, max_kernels: int = MAX_KERNELS, limits: ResourceLimits | None = None):
+        super().__init__(workdir, max_kernels, limits)
+        self.spare: PythonKernel | None = None
+        self.warming = False
+        self.closed = False
+
+    def warm(self):
+        """
+        Start the spare worker in the background (if there is none yet)
+        """
+        with self.condition:
+            if self.warming or self.closed or (self.spare is not None and self.spare.alive):
+                return
+            self.warming = True
+
+        def start():
+            try:
+                kernel = PythonKernel(self.workdir, self.limits)
+            except OSError:
+                kernel = None
+            with self.condition:
+                self.warming = False
+                if kernel is None or self.closed:
+                    old = kernel
+                else:
+                    old, self.spare = self.spare, kernel
+            if old is not None:
+                old.close()
+
+        threading.Thread(target=start, daemon=True).start()
+
+    def _new_session(self) -> PythonKernel:
+        with self.condition:
+            kernel, self.spare = self.spare, None
+        if kernel is None or not kernel.alive or kernel.limits != (self.limits or ResourceLimits()):
+            if kernel is not None:
+                kernel.close()
+            kernel = PythonKernel(self.workdir, self.limits)
+        # The replacement for the next new or restarted kernel
+        self.warm()
+        return kernel
+
+    def run(self, code: str, timeout: float = PYTHON_TIMEOUT) -> KernelResult:
+        kernel = self._acquire()
+        try:
+            return kernel.run(code, timeout)
+        finally:
+            self._release(kernel)
+
+    def close(self):
+        super().close()
+        with self.condition:
+            self.closed = True
+            spare, self.spare = self.spare, None
+        if spare is not None:
+            spare.close()
+
+
+kernel_pools: dict[str, KernelPool] = {}
+
+
+def get_kernel_pool(workdir: str, limits: ResourceLimits | None = None) -> KernelPool:
+    """
+    The Python workers of the project. The limits apply to the workers started after they are set
+    """
+    workdir = os.path.abspath(workdir)
+    if workdir not in kernel_pools:
+        kernel_pools[workdir] = KernelPool(workdir)
+    if limits is not None:
+        kernel_pools[workdir].limits = limits
+    return kernel_pools[workdir]
+
+
+@atexit.register
+def close_kernels():
+    for pool in kernel_pools.values():
+        pool.close()
+
+
+class RunPython:
+    """Runs python code in a persistent worker of the project and returns the output."""
+
+    def __init__(
+            self,
+            strip_newlines: bool = False,
+            return_err_output: bool = False,
+            workdir: str = ".",
+            limits: ResourceLimits | None = None,
+    ):
+        """Initialize with stripping newlines."""
+        self.strip_newlines = strip_newlines
+        self.return_err_output = return_err_output
+        self.workdir = workdir
+        self.limits = limits or ResourceLimits()
+
+    def run(self, commands: str) -> str:
+        """Run the code and return its output."""
+        if not commands.strip():
+            return ''
+        start = time.monotonic()
+        result = get_kernel_pool(self.workdir, self.limits).run(strip_quotes(commands), PYTHON_TIMEOUT)
+        note = limit_note(self.limits, result.exit_code, result.output)
+        record_usage(CommandUsage("Python", commands[:200], time.monotonic() - start, result.cpu_seconds,
+                                  result.max_rss, result.exit_code, note))
+
+        output = result.output.strip() if self.strip_newlines else result.output
+        combined_output = output
+        if result.exit_code is None and result.restarted:
+            combined_output += f"\n(The code didn't finish in {PYTHON_TIMEOUT} seconds and didn't stop when interrupted, " \
+                               f"so it was killed. The Python state was reset)"
+        elif result.exit_code is None:
+            combined_output += f"\n(The code didn't finish in {PYTHON_TIMEOUT} seconds and was interrupted, " \
+                               f"the variables are kept)"
+        elif result.restarted:
+            combined_output += f"\n(The Python process exited with code {result.exit_code}, the state was reset)"
+        if note:
+            combined_output += f"\n{note}"
+        return combined_output if combined_output.strip() else "(empty)"
@@ -0,0 +1,123 @@
+"""
+The worker process of the Python tool (see python_kernel.py). It's run as a standalone script by the python
+of the project, so it uses only the standard library.
+The requests are JSON lines on stdin: {"code": ..., "sentinel": ..., "cpu_seconds": ...}.
+The code runs in a namespace kept between the requests, its output goes to stdout/stderr.
+After the code the worker prints the sentinel of the request followed by the result as JSON.
+The modules passed as the arguments are imported at the start, so the first `import` of them is instant.
+"""
+import ast
+import importlib
+import json
+import os
+import resource
+import signal
+import sys
+import traceback
+
+
+def usage():
+    """
+    (CPU seconds of the worker, CPU seconds of the waited-for children, max RSS in bytes)
+    """
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime, children.ru_utime + children.ru_stime, \
+        max(own.ru_maxrss, children.ru_maxrss) * 1024
+
+
+def set_cpu_limit(seconds, used):
+    """
+    RLIMIT_CPU counts the whole lifetime of the process, so the limit of a request is added to the time used so far
+    """
+    if not seconds:
+        return
+    _, hard = resource.getrlimit(resource.RLIMIT_CPU)
+    value = int(used) + 1 + seconds
+    if hard != resource.RLIM_INFINITY:
+        value = min(value, hard)
+    try:
+        resource.setrlimit(resource.RLIMIT_CPU, (value, hard))
+    except (ValueError, OSError):
+        pass
+
+
+def run(code, namespace):
+    """
+    Run the code like the interactive interpreter does: the value of the last expression is printed
+    """
+    tree = ast.parse(code, "<input>")
+    last = None
+    if tree.body and isinstance(tree.body[-1], ast.Expr):
+        last = ast.Expression(tree.body.pop().value)
+    exec(compile(tree, "<input>", "exec"), namespace)
+    if last is not None:
+        value = eval(compile(last, "<input>", "eval"), namespace)
+        if value is not None:
+            print(repr(value))
+
+
+def print_error(error):
+    if isinstance(error, SyntaxError):
+        traceback.print_exception(type(error), error, None)
+        return
+    # The frames of the worker itself are not interesting
+    tb = error.__traceback__
+    while tb is not None and tb.tb_frame.f_code.co_filename == __file__:
+        tb = tb.tb_next
+    traceback.print_exception(type(error), error, tb)
+
+
+def main():
+    preload = sys.argv[1:]
+    # The timeouts are handled by interrupting the code, even if the parent ignores SIGINT
+    signal.signal(signal.SIGINT, signal.default_int_handler)
+    # Like `python -c`: the imports are relative to the working directory, not to this script
+    sys.path[0] = ""
+    sys.argv = [""]
+    for module in preload:
+        try:
+            importlib.import_module(module)
+        except Exception:
+            pass
+    # The code (and the processes it starts) must not read the requests
+    requests = os.fdopen(os.dup(0), "r")
+    devnull = os.open(os.devnull, os.O_RDONLY)
+    os.dup2(devnull, 0)
+    os.close(devnull)
+    sys.stdin = open(os.devnull)
+    namespace = {"__name__": "__main__", "__builtins__": __builtins__}
+
+    while True:
+        try:
+            line = requests.readline()
+        except KeyboardInterrupt:
+            # An interrupt for the code which has already finished
+            continue
+        if not line:
+            break
+        request = json.loads(line)
+        own_before, children_before, _ = usage()
+        set_cpu_limit(request.get("cpu_seconds"), own_before)
+        ok = True
+        try:
+            run(request["code"], namespace)
+        except SystemExit as e:
+            if e.code not in (None, 0):
+                ok = False
+                print(f"SystemExit: {e.code}", file=sys.stderr)
+        except BaseException as e:
+            ok = False
+            print_error(e)
+        for stream in (sys.stdout, sys.stderr):
+            try:
+                stream.flush()
+            except Exception:
+                pass
+        own, children, max_rss = usage()
+        result = {"ok": ok, "cpu_seconds": own - own_before + children - children_before, "max_rss": max_rss}
+        os.write(1, f"\n{request['sentinel']}{json.dumps(result)}\n".encode())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+from __future__ import annotations
+
+import os
+import re
+import resource
+import signal
+import subprocess
+import threading
+import time
+from dataclasses import dataclass, field, fields, asdict
+from typing import Callable
+
+from .process_tree import join_cgroup, kill_tree
+from .utils import StreamCapture
+
+
+def parse_limit(name: str, value) -> int | None:
+    """
+    A limit from the environment or the project settings: a whole number, 0 or empty is no limit
+    """
+    if value is None or not str(value).strip():
+        return None
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"Invalid resource limit {name}={value!r}, expected a whole number (0 for no limit)") from None
+    return number if number > 0 else None
+
+
+def env_limit(name: str, default: int | None) -> Callable[[], int | None]:
+    """
+    The default_factory of a limit: the environment is read when the limits are created, not on import
+    """
+    def factory() -> int | None:
+        value = os.environ.get(name)
+        return default if value is None else parse_limit(name, value)
+
+    return factory
+
+
+@dataclass
+class ResourceLimits:
+    """
+    The rlimits of the commands run by the agent (None is no limit). The defaults come from the environment,
+    the project can override them (Project.resource_limits).
+    """
+    cpu_seconds: int | None = field(default_factory=env_limit("CLIPPINATOR_LIMIT_CPU", 600))  # per process
+    # RLIMIT_DATA (heap), per process
+    memory_mb: int | None = field(default_factory=env_limit("CLIPPINATOR_LIMIT_MEMORY", 8192))
+    # The largest file a process can write
+    file_size_mb: int | None = field(default_factory=env_limit("CLIPPINATOR_LIMIT_FILE_SIZE", 2048))
+    # RLIMIT_NPROC counts all the processes of the user, not only the commands, so there is no default:
+    # a limit below the number of processes the user already runs makes every fork fail
+    processes: int | None = field(default_factory=env_limit("CLIPPINATOR_LIMIT_PROCESSES", None))
+
+    @classmethod
+    def from_dict(cls, data: dict | None) -> ResourceLimits:
+        known = {item.name for item in fields(cls)}
+        return cls(**{k: parse_limit(k, v) for k, v in (data or {}).items() if k in known})
+
+    @classmethod
+    def for_project(cls, project) -> ResourceLimits:
+        return cls.from_dict(getattr(project, "resource_limits", None))
+
+    def rlimits(self) -> list[tuple[int, int]]:
+        limits = []
+        if self.cpu_seconds:
+            limits.append((resource.RLIMIT_CPU, self.cpu_seconds))
+        if self.memory_mb:
+            limits.append((resource.RLIMIT_DATA, self.memory_mb * 2 ** 20))
+        if self.file_size_mb:
+            limits.append((resource.RLIMIT_FSIZE, self.file_size_mb * 2 ** 20))
+        if self.processes:
+            limits.append((resource.RLIMIT_NPROC, self.processes))
+        return limits
+
+    def apply(self):
+        """
+        Set the limits for the current process (never above the current hard limits)
+        """
+        for kind, value in self.rlimits():
+            soft, hard = resource.getrlimit(kind)
+            if hard != resource.RLIM_INFINITY:
+                value = min(value, hard)
+            # The CPU limit sends SIGXCPU first, a process ignoring it is killed a bit later
+            new_hard = value + 5 if kind == resource.RLIMIT_CPU else value
+            if hard != resource.RLIM_INFINITY:
+                new_hard = min(new_hard, hard)
+            try:
+                resource.setrlimit(kind, (value, new_hard))
+            except (ValueError, OSError):
+                pass
+
+    def preexec(self, cgroup: str | None = None) -> Callable[[], None]:
+        """
+        The preexec_fn for Popen: join the cgroup and apply the limits in the child before exec
+        """
+        def preexec():
+            join_cgroup(cgroup)
+            self.apply()
+
+        return preexec
+
+    def __str__(self) -> str:
+        return ", ".join(f"{k}={v}" for k, v in asdict(self).items() if v)
+
+
+LIMIT_SIGNALS = {signal.SIGXCPU: "CPU time", signal.SIGXFSZ: "file size"}
+MEMORY_ERRORS = re.compile(r"MemoryError|Cannot allocate memory|std::bad_alloc|heap out of memory|out of memory")
+PROCESS_ERRORS = re.compile(r"fork: (retry: )?Resource temporarily unavailable|can't start new thread|"
+                            r"Cannot fork|EAGAIN.*spawn")
+
+
+def limit_note(limits: ResourceLimits, exit_code: int | None, output: str = "") -> str:
+    """
+    A compact note if the command probably hit a limit (from the exit code: -signal or 128 + signal in a shell,
+    and from the typical error messages). Empty if it didn't.
+    """
+    hits = []
+    for sig, name in LIMIT_SIGNALS.items():
+        # The message is printed by bash when a command which isn't the last one is killed
+        if exit_code in (-sig, 128 + sig) or f"{name.capitalize()} limit exceeded" in output:
+            value = f"{limits.cpu_seconds}s" if sig == signal.SIGXCPU else f"{limits.file_size_mb}MB"
+            hits.append(f"{name} ({value})")
+    if limits.memory_mb and MEMORY_ERRORS.search(output[-5000:]):
+        hits.append(f"memory ({limits.memory_mb}MB)")
+    if limits.processes and PROCESS_ERRORS.search(output[-5000:]):
+        hits.append(f"processes ({limits.processes})")
+    return f"(resource limit hit: {', '.join(hits)})" if hits else ""
+
+
+@dataclass
+class CommandUsage:
+    tool: str
+    command: str
+    wall_seconds: float
+    cpu_seconds: float
+    max_rss: int = 0  # bytes, 0 if unknown
+    exit_code: int | None = None
+    limit: str = ""
+
+
+usage_log: list[CommandUsage] = []
+usage_lock = threading.Lock()
+
+
+def record_usage(usage: CommandUsage):
+    with usage_lock:
+        usage_log.append(usage)
+        del usage_log[:-1000]
+
+
+def format_usage_stats() -> str:
+    """
+    Per-tool totals of the commands run by the agent
+    """
+    by_tool: dict[str, list[CommandUsage]] = {}
+    with usage_lock:
+        for usage in usage_log:
+            by_tool.setdefault(usage.tool, []).append(usage)
+    lines = []
+    for tool, usages in by_tool.items():
+        line = f"{tool}: {len(usages)} commands, {sum(u.wall_seconds for u in usages):.1f}s wall, " \
+               f"{sum(u.cpu_seconds for u in usages):.1f}s CPU"
+        max_rss = max(u.max_rss for u in usages)
+        if max_rss:
+            line += f", max RSS {max_rss / 1e6:.0f}MB"
+        limited = [u for u in usages if u.limit]
+        if limited:
+            line += f", {len(limited)} hit limits"
+        timed_out = sum(u.exit_code is None for u in usages)
+        if timed_out:
+            line += f", {timed_out} timed out"
+        lines.append(line)
+    return "\n".join(lines)
+
+
+@dataclass
+class CommandResult:
+    stdout: str  # trimmed like trim_extra does
+    stderr: str
+    exit_code: int | None  # None if the command timed out
+    wall_seconds: float
+    cpu_seconds: float
+    max_rss: int
+
+
+def run_limited(args: list[str] | str, cwd: str, limits: ResourceLimits, timeout: float, shell: bool = False,
+                merge_stderr: bool = False, env: dict | None = None) -> CommandResult:
+    """
+    Run the command in its own process group with the limits, kill the whole tree on timeout.
+    The process is reaped with wait4, so its CPU time and max RSS are known.
+    Only the beginning and the end of the output are kept (StreamCapture), however much the command prints.
+    """
+    start = time.monotonic()
+    process = subprocess.Popen(
+        args,
+        shell=shell,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT if merge_stderr else subprocess.PIPE,
+        cwd=cwd,
+        env=env,
+        start_new_session=True,
+        preexec_fn=limits.preexec(),
+    )
+    outputs = {"stdout": StreamCapture(), "stderr": StreamCapture()}
+
+    def read(name: str, stream):
+        for chunk in iter(lambda: stream.read1(65536), b""):
+            outputs[name].feed(chunk)
+
+    readers = [threading.Thread(target=read, args=(name, stream), daemon=True)
+               for name, stream in (("stdout", process.stdout), ("stderr", process.stderr)) if stream]
+    for reader in readers:
+        reader.start()
+    waited = {}
+    waiter = threading.Thread(target=lambda: waited.update(result=os.wait4(process.pid, 0)), daemon=True)
+    waiter.start()
+    waiter.join(timeout)
+    timed_out = waiter.is_alive()
+    if timed_out:
+        kill_tree(process.pid)
+        waiter.join()
+    _, status, rusage = waited["result"]
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # The processes it left in the background could keep the pipes open
+    for reader in readers:
+        reader.join(1 if not timed_out else 0.1)
+    if any(reader.is_alive() for reader in readers):
+        kill_tree(process.pid, reaped=True)
+        for reader in readers:
+            reader.join()
+    return CommandResult(
+        stdout=outputs["stdout"].text(),
+        stderr=outputs["stderr"].text(),
+        exit_code=None if timed_out else process.returncode,
+        wall_seconds=time.monotonic() - start,
+        cpu_seconds=rusage.ru_utime + rusage.ru_stime,
+        max_rss=rusage.ru_maxrss * 1024,
+    )
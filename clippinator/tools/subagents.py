@@ -1,42 +1,71 @@
 from __future__ import annotations
 
+import os
+import re
 import typing
+from concurrent.futures import ThreadPoolExecutor
 
 from clippinator.project import Project
 from .terminal import get_pids, end_sessions
 from .tool import SimpleTool
-from .utils import trim_extra, get_input_from_editor, yes_no_prompt
+from .utils import trim_extra, get_input_from_editor, yes_no_prompt, write_tracker
 from ..minions import extract_agent_name
 
 if typing.TYPE_CHECKING:
-    from clippinator.minions.executioner import SpecializedExecutioner, Executioner
+    from clippinator.minions.executioner import LazyExecutioner
 
 
 class Subagent(SimpleTool):
     name = "Subagent"
     description = (
         "call subagents to perform tasks. Use 'Action: Subagent' for the general agent "
-        "or 'Action: Subagent @AgentName', for example 'Action: Subagent @Writer'"
+        "or 'Action: Subagent @AgentName', for example 'Action: Subagent @Writer'. "
+        "To run several independent tasks at the same time, use 'Action: Subagent' and write each task "
+        "on a new line starting with the agent name, like '@Writer: implement models.py ...' "
+        "(the tasks shouldn't edit the same files)"
     )
 
     def __init__(
             self,
             project: Project,
-            agents: dict[str, SpecializedExecutioner],
-            default: Executioner,
+            agents: dict[str, LazyExecutioner],
+            default: LazyExecutioner,
+            max_workers: int | None = None,
     ):
         self.agents = agents
         self.default = default
         self.project = project
+        self.max_workers = max_workers or int(os.environ.get("CLIPPINATOR_SUBAGENT_WORKERS", 4))
         super().__init__()
 
+    def parse_batch(self, args: str) -> list[tuple[str, str]] | None:
+        """
+        Split the input into (task, agent) pairs if it has several lines like `@Writer: task`
+        """
+        tasks = []
+        for line in args.strip().splitlines():
+            match = re.match(r"^\s*@(\w+)\s*:(.*)", line)
+            if match and (match.group(1) in self.agents or match.group(1) == "default"):
+                tasks.append([match.group(2).strip(), match.group(1)])
+            elif tasks:
+                tasks[-1][0] += "\n" + line
+            elif line.strip():
+                return None
+        if len(tasks) < 2:
+            return None
+        return [(task.strip(), agent) for task, agent in tasks]
+
     def func(self, args: str) -> str:
+        batch = self.parse_batch(args)
+        if batch:
+            return self.run_batch(batch)
         pids = get_pids()
         task, agent = extract_agent_name(args)
-        if agent.strip() and agent not in self.agents:
+        if agent and agent.strip() and agent not in self.agents:
             return f"Unknown agent '{agent}', please choose from: {', '.join(self.agents.keys())}"
         runner = self.agents.get(agent, self.default)
         prev_memories = self.project.memories.copy()
+        prev_state = self.project.snapshot_state()
         print(
             f'Running task "{task}" with agent "{getattr(runner, "name", "default")}"'
         )
@@ -50,8 +79,52 @@ class Subagent(SimpleTool):
             if yes_no_prompt('Do you want to edit the project architecture?'):
                 self.project.architecture = get_input_from_editor(self.project.architecture)
             result = 'Architecture declared: ' + self.project.architecture + '\n'
-        result = f'Completed, result: {result}\n\n' \
-                 f'Current project state:\n{self.project.get_project_summary()}\n'
+        result = f'Completed, result: {result}\n\n' + self.project.get_state_delta(prev_state)
+        if new_memories:
+            result += 'New memories:\n  - ' + '\n  - '.join(new_memories)
+        end_sessions(pids)
+        return result
+
+    def run_batch(self, tasks: list[tuple[str, str]]) -> str:
+        """
+        Run independent tasks concurrently, each with its own executioner instance.
+        Files written by several tasks are reported. Background processes are cleaned up after all tasks finish.
+        """
+        if any(agent == "Architect" for _, agent in tasks):
+            return "The Architect can't run together with other tasks, call it separately."
+        pids = get_pids()
+        prev_memories = self.project.memories.copy()
+        prev_state = self.project.snapshot_state()
+        names = [f"#{i + 1} @{agent}" for i, (_, agent) in enumerate(tasks)]
+
+        def run_task(i: int) -> str:
+            task, agent = tasks[i]
+            runner = self.agents.get(agent, self.default)
+            print(f'Running task {names[i]} "{task}"')
+            with write_tracker.task(names[i]):
+                try:
+                    return runner.build().execute(task, self.project)
+                except Exception as e:
+                    return f"Error running agent, retry with another task or agent: {e}"
+
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(tasks))) as pool:
+            results = list(pool.map(run_task, range(len(tasks))))
+        written, conflicts = write_tracker.pop(names)
+
+        result = ""
+        for name, task_result in zip(names, results):
+            files = sorted(os.path.relpath(path, self.project.path) for path in written[name])
+            result += f'Task {name} completed, result: {trim_extra(task_result, 800)}\n'
+            if files:
+                result += f'Files written: {", ".join(files)}\n'
+            result += '\n'
+        if conflicts:
+            result += 'WARNING: several tasks wrote the same files (the writes were serialized, ' \
+                      'the last one wins), check them:\n' + '\n'.join(
+                f'  - {os.path.relpath(path, self.project.path)}: {", ".join(task_names)}'
+                for path, task_names in conflicts.items()) + '\n\n'
+        result += self.project.get_state_delta(prev_state)
+        new_memories = [mem for mem in self.project.memories if mem not in prev_memories]
         if new_memories:
             result += 'New memories:\n  - ' + '\n  - '.join(new_memories)
         end_sessions(pids)
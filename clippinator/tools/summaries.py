@@ -0,0 +1,132 @@
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+MIN_CHUNK_LENGTH = 1500
+MAX_CHUNK_LENGTH = 4000
+
+
+def split_chunks(lines: list[str]) -> list[tuple[int, list[str]]]:
+    """
+    Split the lines into chunks of MIN_CHUNK_LENGTH..MAX_CHUNK_LENGTH chars, returns (first line index, lines).
+    A chunk ends before a top-level (not indented) line once it is long enough, so the boundaries depend
+    on the content: after an edit, the chunks after the edited one stay the same.
+    """
+    chunks = []
+    start, length = 0, 0
+    for i, line in enumerate(lines):
+        top_level = line.strip() and not line[0].isspace()
+        if i > start and (length >= MIN_CHUNK_LENGTH and top_level or length + len(line) > MAX_CHUNK_LENGTH):
+            chunks.append((start, lines[start:i]))
+            start, length = i, 0
+        length += len(line)
+    if start < len(lines):
+        chunks.append((start, lines[start:]))
+    return chunks
+
+
+def number_lines(lines: list[str], first: int = 1) -> str:
+    return "".join(f"{first + i}| {line}" for i, line in enumerate(lines))
+
+
+def shift_line_numbers(summary: str, offset: int) -> str:
+    """
+    The chunk summaries are made with the line numbers relative to the chunk, shift them to the file line numbers
+    """
+    if not offset:
+        return summary
+    return re.sub(r"^(\s*)(\d+)(\s*\|)", lambda m: f"{m.group(1)}{int(m.group(2)) + offset}{m.group(3)}",
+                  summary, flags=re.MULTILINE)
+
+
+def content_hash(*parts: str) -> str:
+    return hashlib.sha1("\0".join(parts).encode()).hexdigest()
+
+
+class SummaryCache:
+    """
+    Summaries of whole files and of chunks by content hash, stored in .clippinator/summaries.json
+    """
+
+    def __init__(self, path: str, max_entries: int = 5000):
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.files: dict[str, str] = {}
+        self.chunks: dict[str, str] = {}
+        try:
+            with open(path) as f:
+                data = json.load(f)
+            self.files, self.chunks = data.get("files", {}), data.get("chunks", {})
+        except (OSError, ValueError):
+            pass
+
+    def save(self):
+        with self.lock:
+            for entries in (self.files, self.chunks):
+                for key in list(entries)[:max(len(entries) - self.max_entries, 0)]:
+                    del entries[key]
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump({"files": self.files, "chunks": self.chunks}, f)
+            os.replace(tmp_path, self.path)
+
+
+summary_caches: dict[str, SummaryCache] = {}
+
+
+def get_summary_cache(workdir: str) -> SummaryCache:
+    if workdir not in summary_caches:
+        summary_caches[workdir] = SummaryCache(os.path.join(workdir, ".clippinator", "summaries.json"))
+    return summary_caches[workdir]
+
+
+def summarize_content(content: str, summarize: Callable[[str], str], cache: SummaryCache, model: str = "",
+                      max_workers: int = 4, max_length: int = 4000) -> str:
+    """
+    Map-reduce summary of the file content:
+    - the whole summary is cached by the content hash
+    - map: the chunks are summarized concurrently (at most max_workers at a time), only the chunks
+      which aren't in the cache (by chunk hash) are sent to the model
+    - reduce: the chunk summaries are combined (in groups, if they are too long together)
+    """
+    file_key = content_hash(model, content)
+    if file_key in cache.files:
+        return cache.files[file_key]
+    chunks = split_chunks(content.splitlines(keepends=True))
+    keys = [content_hash(model, "".join(lines)) for _, lines in chunks]
+    missing = {key: lines for key, (_, lines) in zip(keys, chunks) if key not in cache.chunks}
+    if missing:
+        with ThreadPoolExecutor(max_workers=max(min(max_workers, len(missing)), 1)) as pool:
+            summaries = pool.map(lambda lines: summarize(number_lines(lines)), missing.values())
+            for key, summary in zip(missing, summaries):
+                cache.chunks[key] = summary
+    summaries = [shift_line_numbers(cache.chunks[key], start) for key, (start, _) in zip(keys, chunks)]
+
+    result = "\n".join(summaries)
+    while len(summaries) > 1 and len(result) > max_length:
+        groups, group = [], ""
+        for summary in summaries:
+            if group and len(group) + len(summary) > MAX_CHUNK_LENGTH:
+                groups.append(group)
+                group = ""
+            group += summary + "\n"
+        groups.append(group)
+        if len(groups) == len(summaries) and len(groups) > 1:
+            # Every summary is too long to be grouped, combine them in pairs
+            groups = ["\n".join(summaries[i:i + 2]) for i in range(0, len(summaries), 2)]
+        with ThreadPoolExecutor(max_workers=max(min(max_workers, len(groups)), 1)) as pool:
+            summaries = list(pool.map(summarize, groups))
+        result = "\n".join(summaries)
+    if len(summaries) == 1 and len(result) > max_length:
+        result = summarize(result)
+    cache.files[file_key] = result
+    cache.save()
+    return result
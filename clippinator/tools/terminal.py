@@ -1,109 +1,388 @@
-import fcntl
+import atexit
 import os
 import pty
 import re
+import secrets
 import select
-import signal
+import socket
 import subprocess
+import threading
 import time
-from abc import ABC
+import tty
 from dataclasses import dataclass
 from typing import List, Union
 
-from langchain.agents import Tool
-
 from .file_tools import strip_quotes
+from .process_tree import create_cgroup, kill_tree, process_cpu_seconds, remove_cgroup, tree_usage
+from .sandbox import CommandUsage, ResourceLimits, limit_note, record_usage
 from .tool import SimpleTool
-from .utils import trim_extra
+from .utils import StreamCapture, trim_extra
 
 env = dict(os.environ.copy())
 env.pop('VIRTUAL_ENV', None)
 env['PATH'] = env.get('PATH', '').split(':', 1)[-1]
 
 
+SHELL_TIMEOUT = int(os.environ.get("CLIPPINATOR_SHELL_TIMEOUT", 70))
+MAX_SHELLS = int(os.environ.get("CLIPPINATOR_SHELLS", 4))
+ANSI_ESCAPE = re.compile(r"\x1b\[[0-9;?]*[a-zA-Z]")
+SCRIPT_PREFIX = re.compile(r"^/dev/stdin: line \d+: ", re.MULTILINE)
+
+shell_env = {**env, "PS1": "", "PS2": "", "TERM": "dumb", "PAGER": "cat", "GIT_PAGER": "cat"}
+
+
+def clean_output(output: str) -> str:
+    return ANSI_ESCAPE.sub("", output.replace("\r\n", "\n"))
+
+
+class CommandOutput:
+    """
+    The output of a command in a persistent process, up to the sentinel line printed after the command.
+    The output goes to a StreamCapture as it's read, only the bytes which can be the start of the sentinel wait.
+    """
+
+    def __init__(self, sentinel: bytes):
+        self.sentinel = sentinel
+        self.capture = StreamCapture()
+        self.pending = bytearray()
+
+    def feed(self, data: bytes) -> bytes | None:
+        """
+        Returns the rest of the sentinel line (like the exit code) once it's read
+        """
+        self.pending += data
+        position = self.pending.find(self.sentinel)
+        if position >= 0:
+            end = self.pending.find(b"\n", position)
+            if end < 0:
+                return None
+            self.capture.feed(bytes(self.pending[:position]).removesuffix(b"\n"))
+            rest = bytes(self.pending[position + len(self.sentinel):end])
+            self.pending.clear()
+            return rest
+        # The newline printed before the sentinel isn't a part of the output
+        keep = len(self.sentinel) + 1
+        if len(self.pending) > keep:
+            self.capture.feed(bytes(self.pending[:-keep]))
+            del self.pending[:-keep]
+        return None
+
+    def text(self) -> str:
+        self.capture.feed(bytes(self.pending))
+        self.pending.clear()
+        return clean_output(self.capture.text())
+
+
+class ShellSession:
+    """
+    A persistent bash process on a PTY: `cd`, `export`, `source venv/bin/activate` stay in effect between commands,
+    and the programs see a terminal (line-buffered output).
+    The end of a command is detected by a unique sentinel printed with its exit code, not by a timeout.
+    """
+
+    def __init__(self, workdir: str, limits: ResourceLimits | None = None):
+        self.master_fd, slave_fd = pty.openpty()
+        tty.setraw(slave_fd)
+        # The commands run in the process group (and the cgroup, if available) of the shell
+        self.cgroup = create_cgroup("shell")
+        # Bash reads the commands as a script (not interactively): no prompts, echo or job control messages
+        self.process = subprocess.Popen(
+            ["bash", "--noprofile", "--norc", "/dev/stdin"],
+            stdin=slave_fd,
+            stdout=slave_fd,
+            stderr=slave_fd,
+            cwd=workdir,
+            env=shell_env,
+            start_new_session=True,
+            # The limits are inherited by the commands, every process gets its own CPU time budget
+            preexec_fn=(limits or ResourceLimits()).preexec(self.cgroup),
+        )
+        os.close(slave_fd)
+
+    @property
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def run(self, command: str, timeout: float = SHELL_TIMEOUT) -> tuple[str, int | None]:
+        """
+        Run the command, returns (output, exit code). The exit code is None if the command timed out.
+        The session is closed if the command timed out or exited the shell.
+        The command runs in the current shell with stdin from /dev/null, so it can't swallow the sentinel.
+        """
+        token = secrets.token_hex(8)
+        output = CommandOutput(f"__CLIPPINATOR_DONE_{token}__:".encode())
+        # The sentinel is printed in two parts, so it isn't in the text of the command itself
+        self._write(f"{{ {command}\n}} < /dev/null\nprintf '\\n%s%s:%d\\n' __CLIPPINATOR_ DONE_{token}__ $?\n")
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                self.close()
+                return self._decode(output.text()), None
+            ready, _, _ = select.select([self.master_fd], [], [], remaining)
+            try:
+                data = os.read(self.master_fd, 65536) if ready else b""
+            except OSError:
+                data = b""
+            if ready and not data:
+                self.close()
+                return self._decode(output.text()) + \
+                    "\n(The shell exited, the next command will run in a new shell)", self.process.returncode
+            exit_code = output.feed(data)
+            if exit_code is not None:
+                return self._decode(output.text()), int(exit_code)
+
+    @staticmethod
+    def _decode(output: str) -> str:
+        # Bash reads the commands from /dev/stdin, its messages start with "/dev/stdin: line N: "
+        return SCRIPT_PREFIX.sub("", output)
+
+    def _write(self, data: str):
+        data = data.encode()
+        while data:
+            written = os.write(self.master_fd, data)
+            data = data[written:]
+
+    def close(self):
+        kill_tree(self.process.pid, self.cgroup, reaped=self.process.returncode is not None)
+        self.process.wait()
+        remove_cgroup(self.cgroup)
+        if self.master_fd >= 0:
+            os.close(self.master_fd)
+            self.master_fd = -1
+
+
+class ShellPool:
+    """
+    The shell sessions of a project. A thread gets the session it used last if it's free,
+    so the consecutive commands of an agent share the environment. At most max_shells sessions run at once.
+    """
+
+    def __init__(self, workdir: str, max_shells: int = MAX_SHELLS, limits: ResourceLimits | None = None):
+        self.workdir = workdir
+        self.max_shells = max(max_shells, 1)
+        self.limits = limits
+        self.sessions: list[ShellSession] = []
+        self.idle: list[ShellSession] = []
+        self.last_used: dict[int, ShellSession] = {}
+        self.starting = 0  # the sessions being started
+        self.condition = threading.Condition()
+
+    def _acquire(self) -> ShellSession:
+        with self.condition:
+            while True:
+                own = self.last_used.get(threading.get_ident())
+                if own in self.idle:
+                    self.idle.remove(own)
+                    return own
+                if len(self.sessions) + self.starting < self.max_shells:
+                    # The session is started outside of the lock, the other threads don't wait for it
+                    self.starting += 1
+                    break
+                if self.idle:
+                    session = self.idle.pop(0)
+                    self.last_used[threading.get_ident()] = session
+                    return session
+                self.condition.wait()
+        session = None
+        try:
+            session = self._new_session()
+        finally:
+            with self.condition:
+                self.starting -= 1
+                if session is not None:
+                    self.sessions.append(session)
+                    self.last_used[threading.get_ident()] = session
+                self.condition.notify()
+        return session
+
+    def _new_session(self) -> ShellSession:
+        return ShellSession(self.workdir, self.limits)
+
+    def _release(self, session: ShellSession):
+        with self.condition:
+            if session.alive:
+                self.idle.append(session)
+            else:
+                session.close()
+                self.sessions.remove(session)
+                self.last_used = {thread: s for thread, s in self.last_used.items() if s is not session}
+            self.condition.notify()
+
+    def run(self, command: str, timeout: float = SHELL_TIMEOUT) -> tuple[str, int | None, float]:
+        """
+        Returns (output, exit code, CPU seconds of the command)
+        """
+        session = self._acquire()
+        try:
+            cpu_before = process_cpu_seconds(session.process.pid)
+            output, exit_code = session.run(command, timeout)
+            return output, exit_code, max(process_cpu_seconds(session.process.pid) - cpu_before, 0.0)
+        finally:
+            self._release(session)
+
+    def close(self):
+        with self.condition:
+            for session in self.sessions:
+                session.close()
+            self.sessions, self.idle, self.last_used = [], [], {}
+
+
+shell_pools: dict[str, ShellPool] = {}
+
+
+def get_shell_pool(workdir: str, limits: ResourceLimits | None = None) -> ShellPool:
+    """
+    The shells of the project. The limits apply to the shells started after they are set
+    """
+    workdir = os.path.abspath(workdir)
+    if workdir not in shell_pools:
+        shell_pools[workdir] = ShellPool(workdir)
+    if limits is not None:
+        shell_pools[workdir].limits = limits
+    return shell_pools[workdir]
+
+
+@atexit.register
+def close_shells():
+    for pool in shell_pools.values():
+        pool.close()
+
+
 class RunBash:
-    """Executes bash commands and returns the output."""
+    """Executes bash commands in a persistent shell of the project and returns the output."""
 
     def __init__(
             self,
             strip_newlines: bool = False,
             return_err_output: bool = False,
             workdir: str = ".",
+            limits: ResourceLimits | None = None,
     ):
         """Initialize with stripping newlines."""
         self.strip_newlines = strip_newlines
         self.return_err_output = return_err_output
         self.workdir = workdir
+        self.limits = limits or ResourceLimits()
 
     def run(self, commands: Union[str, List[str]]) -> str:
         """Run commands and return final output."""
         if isinstance(commands, str):
             commands = [strip_quotes(commands)]
         commands = ";".join(commands)
-
-        try:
-            completed_process = subprocess.run(
-                ['bash', '-c', commands],
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                cwd=self.workdir,
-                timeout=70,
-                env=env
-            )
-        except subprocess.TimeoutExpired as error:
-            return "Command timed out, possibly due to asking for input."
-
-        stdout_output = completed_process.stdout.decode()
-        # stderr_output = completed_process.stderr.decode()
+        if not commands.strip():
+            return "(empty)"
+        # A syntax error (like an unclosed quote) would make the shell wait for the rest of the command
+        check = subprocess.run(["bash", "-n"], input=f"{{ {commands}\n}}\n", capture_output=True, text=True)
+        if check.returncode:
+            return trim_extra(check.stderr.replace("bash: line ", "line ").strip())
+
+        start = time.monotonic()
+        stdout_output, exit_code, cpu_seconds = get_shell_pool(self.workdir, self.limits).run(commands)
+        note = limit_note(self.limits, exit_code, stdout_output)
+        record_usage(CommandUsage("Bash", commands[:200], time.monotonic() - start, cpu_seconds,
+                                  exit_code=exit_code, limit=note))
 
         if self.strip_newlines:
             stdout_output = stdout_output.strip()
-            # stderr_output = stderr_output.strip()
 
-        combined_output = trim_extra(stdout_output)  # + "\n" + stderr_output
+        combined_output = stdout_output
+        if exit_code is None:
+            combined_output += f"\n(The command didn't finish in {SHELL_TIMEOUT} seconds and was killed, " \
+                               f"possibly it was waiting for something. The next command will run in a new shell)"
+        elif exit_code:
+            combined_output += f"\n(exit code {exit_code})"
+        if note:
+            combined_output += f"\n{note}"
         return combined_output if combined_output.strip() else "(empty)"
 
 
-class RunPython:
-    """Executes bash commands and returns the output."""
+READY_QUIET = 2.0
+READY_MAX_WAIT = 15.0
+READY_SEARCH_OVERLAP = 4096  # bytes of the searched output searched again with the next output
+# The messages servers usually print when they start accepting connections
+DEFAULT_READY = re.compile(r"(?i)\b(listening|running) (on|at)\b|\bserving\b|\bready in\b|"
+                           r"\bstarted (server|on)\b|application startup complete|press ctrl\+c")
 
-    def __init__(
-            self,
-            strip_newlines: bool = False,
-            return_err_output: bool = False,
-            workdir: str = ".",
-    ):
-        """Initialize with stripping newlines."""
-        self.strip_newlines = strip_newlines
-        self.return_err_output = return_err_output
-        self.workdir = workdir
 
-    def run(self, commands: str) -> str:
-        """Run commands and return final output."""
+LOG_BUFFER_SIZE = int(os.environ.get("CLIPPINATOR_LOG_BUFFER", 1_000_000))  # bytes kept per background process
 
-        if not commands.strip():
-            return ''
-        try:
-            completed_process = subprocess.run(
-                ['python', '-c', strip_quotes(commands)],
-                shell=True,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                cwd=self.workdir,
-                timeout=40,
-            )
-        except subprocess.TimeoutExpired as error:
-            return "Command timed out, possibly due to asking for input."
 
-        stdout_output = completed_process.stdout.decode()
-        stderr_output = completed_process.stderr.decode()
+class LogBuffer:
+    """
+    A ring buffer with the last `size` bytes of the output of a process.
+    The bytes are addressed by their absolute offset in the output, so a reader can ask for what's new since its
+    last read and learn how much was dropped in between.
+    """
 
-        if self.strip_newlines:
-            stdout_output = stdout_output.strip()
-            stderr_output = stderr_output.strip()
+    def __init__(self, size: int = LOG_BUFFER_SIZE):
+        self.size = size
+        self.data = bytearray(size)
+        self.end = 0  # the offset after the last byte written
+        self.closed = False  # the process has closed its output
+        self.condition = threading.Condition()
 
-        combined_output = trim_extra(stdout_output + "\n" + stderr_output)
-        return combined_output if combined_output.strip() else "(empty)"
+    @property
+    def start(self) -> int:
+        return max(self.end - self.size, 0)
+
+    def append(self, chunk: bytes):
+        with self.condition:
+            # Only the last `size` bytes of a huge chunk can be kept
+            length, chunk = len(chunk), chunk[-self.size:]
+            position = (self.end + length - len(chunk)) % self.size
+            first = min(len(chunk), self.size - position)
+            self.data[position:position + first] = chunk[:first]
+            self.data[:len(chunk) - first] = chunk[first:]
+            self.end += length
+            self.condition.notify_all()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def read(self, since: int = 0) -> tuple[bytes, int, int]:
+        """
+        Returns (the bytes from `since` to the end, the offset they start at, the offset of the end).
+        If `since` has already been dropped from the buffer, the bytes start at the oldest offset kept.
+        """
+        with self.condition:
+            since = min(max(since, self.start), self.end)
+            position, length = since % self.size, self.end - since
+            first = min(length, self.size - position)
+            return bytes(self.data[position:position + first] + self.data[:length - first]), since, self.end
+
+    def wait(self, offset: int, timeout: float) -> bool:
+        """
+        Wait until there are bytes after the offset (or the output is closed), returns whether there are
+        """
+        with self.condition:
+            self.condition.wait_for(lambda: self.end > offset or self.closed, timeout)
+            return self.end > offset
+
+    def wait_closed(self, timeout: float) -> bool:
+        with self.condition:
+            return self.condition.wait_for(lambda: self.closed, timeout)
+
+
+def start_log_reader(process: subprocess.Popen, log: LogBuffer) -> threading.Thread:
+    """
+    Drain the output of the process into the log in a thread, so the process never blocks on a full pipe
+    """
+    def pump():
+        fd = process.stdout.fileno()
+        try:
+            while data := os.read(fd, 65536):
+                log.append(data)
+        except OSError:
+            pass
+        finally:
+            log.close()
+
+    thread = threading.Thread(target=pump, daemon=True, name=f"log-{process.pid}")
+    thread.start()
+    return thread
 
 
 # Yes, the current processes are stored in a global variable
@@ -115,15 +394,23 @@ class BashBackgroundSessions(SimpleTool):
     name = "BashBackground"
     description = "A tool that can be used to run bash commands in the background."
 
-    def __init__(self, wd: str):
+    def __init__(self, wd: str, limits: ResourceLimits | None = None):
         self.workdir = wd
+        self.limits = limits or ResourceLimits()
         self.description = (
             "A tool that can be used to start bash processes in the background. "
             "By default, it starts a process using input as a command. There are special commands:\n"
             "    - `/killall` kills all background processes\n"
             "    - `/kill <pid>` kills the process with the given pid\n"
-            "    - `/logs <pid>` gets the output of a process\n"
+            "    - `/logs <pid> [offset]` gets the new output of a process (since the previous `/logs` or "
+            "from the byte offset)\n"
             "    - `/list` lists all current processes\n"
+            "When a process is started, the tool returns as soon as it's ready: when its output stops for "
+            f"{READY_QUIET} seconds, when the output matches a common 'listening/ready' message, or after "
+            f"{READY_MAX_WAIT} seconds. You can put options before the command: `--ready 'regex'` to wait for "
+            "a specific output line, `--port 8000` to wait until the port accepts connections, "
+            "`--wait 60` to change the max wait, `--quiet 5` to change the quiet time "
+            "(e.g. `--port 3000 --wait 30 npm run dev`)\n"
         )
         self.description += 'Current processes:\n'
         for process in bash_processes:
@@ -131,142 +418,210 @@ class BashBackgroundSessions(SimpleTool):
 
     def func(self, args: str) -> str:
         global bash_processes
-        args = args.strip().strip('`').strip("'").strip('"').strip()
+        args = args.strip().strip('`').strip()
+        # Only a pair of quotes around the whole input, not the quote closing an argument of the command
+        if len(args) > 1 and args[0] == args[-1] and args[0] in "'\"":
+            args = args[1:-1].strip()
         if args == "/killall":
             for process in bash_processes:
-                process["pr"].kill()
+                stop_process(process)
             bash_processes = []
             return "Killed all processes.\n"
         elif args.startswith("/kill"):
             pid = int(args.split()[1])
             for process in bash_processes:
                 if process["pr"].pid == pid:
-                    process["pr"].terminate()
-                    os.system(f"kill -9 {pid}")
-                    os.system(f"kill -9 {pid + 1}")
-                    os.system(f"kill -9 {pid + 2}")
+                    stop_process(process)
                     bash_processes.remove(process)
-                    return f"Killed process with pid {pid}.\n"
+                    return f"Killed process with pid {pid} and its children.\n"
             return f"Could not find process with pid {pid}.\n"
         elif args.startswith("/logs"):
             if ' ' not in args:
                 return "Please specify a pid.\n"
-            pid = int(args.split()[1])
+            parts = args.split()
+            try:
+                pid = int(parts[1])
+                since = int(parts[2]) if len(parts) > 2 else None
+            except ValueError:
+                return "The format is `/logs <pid> [offset]`.\n"
             for process in bash_processes:
                 if process["pr"].pid == pid:
-                    fd = process["pr"].stdout.fileno()
-                    fl = fcntl.fcntl(fd, fcntl.F_GETFL)
-                    fcntl.fcntl(fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
-                    ready_to_read, _, _ = select.select([process["pr"].stdout], [], [], 0)
-                    output = '\n'.join([part.read() for part in ready_to_read])
-                    return '```\n' + trim_extra(output) + '\n```\n'
+                    return format_logs(process, since)
             return f"Could not find process with pid {pid}.\n"
         elif args.startswith("/list"):
-            return 'Current processes:\n' + '\n'.join(
-                [f'    - pid: {process["pr"].pid}| `{process["args"][:50]}`' for process in bash_processes])
+            return 'Current processes:\n' + '\n'.join(describe_process(process) for process in bash_processes)
         else:
+            try:
+                options, command = parse_ready_options(args)
+            except ValueError as e:
+                return f"Error: {e}\n"
+            # Its own process group (and cgroup, if available), so the whole tree can be killed
+            cgroup = create_cgroup("bg")
             process = subprocess.Popen(
                 ["/bin/bash"],
                 stdin=subprocess.PIPE,
                 stdout=subprocess.PIPE,
                 stderr=subprocess.STDOUT,
-                text=True,
                 env=env,
                 cwd=self.workdir,
+                start_new_session=True,
+                preexec_fn=self.limits.preexec(cgroup),
             )
-            fd = process.stdout.fileno()
-            fl = fcntl.fcntl(fd, fcntl.F_GETFL)
-            fcntl.fcntl(fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
-            process.stdin.write(args + '\n')
+            process.stdin.write((command + '\n').encode())
             process.stdin.close()
-            bash_processes.append({"pr": process, "args": args})
-            time.sleep(8)
-            # Read current output
-            ready_to_read, _, _ = select.select([process.stdout], [], [], 0)
-            output = trim_extra('\n'.join([part.read() for part in ready_to_read]))
-            return f"Started process with pid {process.pid}.\n```\n{output}\n```\n"
+            log = LogBuffer()
+            start_log_reader(process, log)
+            output, offset, reason, elapsed = wait_ready(process, log, **options)
+            if process.poll() is not None:
+                note = limit_note(self.limits, process.returncode, output[-5000:].decode(errors="replace"))
+                reason += f" {note}" if note else ""
+            # `offset` is where the next `/logs <pid>` starts
+            bash_processes.append({"pr": process, "args": command, "log": log, "offset": offset, "cgroup": cgroup,
+                                   "limits": self.limits, "started": time.monotonic()})
+            output = trim_extra(output.decode(errors="replace"))
+            return f"Started process with pid {process.pid}, {reason} after {elapsed:.1f}s.\n```\n{output}\n```\n"
+
+
+def parse_ready_options(args: str) -> tuple[dict, str]:
+    """
+    Parse the readiness options at the beginning of the command:
+    `--ready 'regex' --port 8000 --wait 30 --quiet 2 command` -> ({ready, port, max_wait, quiet}, command)
+    """
+    options = {}
+    while match := re.match(r"--(ready|port|wait|quiet)(?:=|\s+)('[^']*'|\"[^\"]*\"|\S+)\s+", args):
+        name, value = match.group(1), match.group(2)
+        if value[0] in "'\"":
+            value = value[1:-1]
+        try:
+            if name == "ready":
+                options["ready"] = re.compile(value)
+            elif name == "port":
+                options["port"] = int(value)
+            elif name == "wait":
+                options["max_wait"] = float(value)
+            else:
+                options["quiet"] = float(value)
+        except (re.error, ValueError) as e:
+            raise ValueError(f"invalid --{name} value {value!r}: {e}")
+        args = args[match.end():]
+    if not args.strip():
+        raise ValueError("no command to start")
+    return options, args
+
+
+def port_open(port: int, host: str = "127.0.0.1") -> bool:
+    try:
+        with socket.create_connection((host, port), timeout=0.2):
+            return True
+    except OSError:
+        return False
+
+
+def wait_ready(process: subprocess.Popen, log: LogBuffer, ready: re.Pattern | None = None, port: int | None = None,
+               quiet: float = READY_QUIET, max_wait: float = READY_MAX_WAIT) -> tuple[bytes, int, str, float]:
+    """
+    Watch the output of the process until it is ready: the output matches `ready` (the common
+    'listening on'-like messages by default), the port accepts connections, the output has stopped
+    for `quiet` seconds (only if neither a pattern nor a port is given), the process exits, or max_wait passes.
+    Returns (the output, the offset of its end in the log, the reason, the seconds it took)
+    """
+    pattern = ready or DEFAULT_READY
+    start = last_output = time.monotonic()
+    # `seen` and `searched` are absolute offsets in the log, `overlap` is the end of the searched output,
+    # so a match across two reads is still found
+    seen, searched, overlap = 0, 0, b""
+
+    def result(reason: str) -> tuple[bytes, int, str, float]:
+        output, _, end = log.read()
+        return output, end, reason, time.monotonic() - start
+
+    while True:
+        elapsed = time.monotonic() - start
+        if elapsed >= max_wait:
+            return result(f"still starting (waited the max {max_wait:g}s)")
+        if log.wait(seen, min(0.1, max_wait - elapsed)):
+            # Only the bytes after the searched ones are read
+            output, output_start, seen = log.read(searched)
+            last_output = time.monotonic()
+            if output_start > searched:
+                # The output was dropped from the log before it was searched
+                overlap = b""
+            # Search the new complete lines (a very long line without a newline is searched as it is)
+            end = output.rfind(b"\n") + 1 or (len(output) if len(output) > READY_SEARCH_OVERLAP else 0)
+            if end:
+                text = overlap + output[:end]
+                match = pattern.search(text.decode(errors="replace"))
+                searched, overlap = output_start + end, text[-READY_SEARCH_OVERLAP:]
+                if match:
+                    return result(f"ready (matched {match.group(0).strip()!r})")
+        elif log.closed or process.poll() is not None:
+            # The process has exited, let the reader take the rest of its output
+            code = process.wait()
+            log.wait_closed(0.5)
+            return result(f"exited with code {code}")
+        if port is not None and port_open(port):
+            return result(f"ready (port {port} is open)")
+        if port is None and ready is None and time.monotonic() - last_output >= quiet:
+            return result(f"ready (no new output for {quiet:g}s)")
+
+
+def format_logs(process: dict, since: int | None = None) -> str:
+    """
+    The output of a background process since the offset (since the previous `/logs` by default)
+    """
+    log: LogBuffer = process["log"]
+    requested = process["offset"] if since is None else since
+    data, start, end = log.read(requested)
+    process["offset"] = end
+    result = f"Output of pid {process['pr'].pid}, bytes {start}-{end}"
+    if start > requested:
+        result += f" ({start - requested} bytes before were dropped, only the last {log.size} bytes are kept)"
+    code = process["pr"].poll()
+    if code is not None:
+        result += f", the process has exited with code {code}"
+    if not data:
+        return result + ", no new output.\n"
+    return result + f":\n```\n{trim_extra(data.decode(errors='replace'))}\n```\n" \
+                    f"Use `/logs {process['pr'].pid}` for the output after that.\n"
 
 
 def get_pids() -> list[int]:
     return [process["pr"].pid for process in bash_processes]
 
 
+def stop_process(process: dict):
+    """
+    Kill the background process with all its children (its usage is recorded)
+    """
+    code = process["pr"].poll()
+    usage = tree_usage(process["pr"].pid, process.get("cgroup"), reaped=code is not None)
+    note = limit_note(process["limits"], code, process["log"].read()[0][-5000:].decode(errors="replace"))
+    record_usage(CommandUsage("BashBackground", process["args"][:200], time.monotonic() - process["started"],
+                              usage.cpu_seconds, usage.peak_rss, code, note))
+    # The pid of a reaped leader can be reused, only the cgroup and the process group members are killed then
+    kill_tree(process["pr"].pid, process.get("cgroup"), reaped=process["pr"].returncode is not None)
+    try:
+        process["pr"].wait(timeout=5)
+    except subprocess.TimeoutExpired:
+        pass
+    remove_cgroup(process.get("cgroup"))
+
+
+def describe_process(process: dict) -> str:
+    code = process["pr"].poll()
+    state = f"exited with code {code}" if code is not None else "running"
+    if code is not None:
+        note = limit_note(process["limits"], code, process["log"].read()[0][-5000:].decode(errors="replace"))
+        state += f" {note}" if note else ""
+    usage = tree_usage(process["pr"].pid, process.get("cgroup"), reaped=code is not None)
+    return f'    - pid: {process["pr"].pid}| `{process["args"][:50]}` | {state}, {usage}'
+
+
 def end_sessions(allow_pids: list[int] | None = None):
-    """End all bash sessions."""
+    """End all bash sessions (with their children)."""
     allow_pids = allow_pids or []
     global bash_processes
     for process in bash_processes:
         if process["pr"].pid not in allow_pids:
-            os.kill(process["pr"].pid, signal.SIGKILL)
+            stop_process(process)
     bash_processes = [pr for pr in bash_processes if pr["pr"].pid in allow_pids]
-
-
-class BashSession(Tool):
-    name: str = "Bash Session"
-
-    def __init__(self, timeout: float | None = None):
-        self.timeout = timeout
-        self.master_fd, self.slave_fd = pty.openpty()
-        self.bash_process = subprocess.Popen(
-            ["bash"],
-            stdin=self.slave_fd,
-            stdout=self.slave_fd,
-            stderr=subprocess.STDOUT,
-            text=True,
-        )
-
-        # Set master_fd to be non-blocking
-        fl = fcntl.fcntl(self.master_fd, fcntl.F_GETFL)
-        fcntl.fcntl(self.master_fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
-
-    def input(self, command, timeout: float | None = None):
-        os.write(self.master_fd, (command + "\n").encode())
-        output = self._read_output(timeout or self.timeout or 0.5)
-
-        # Remove the echoed command and filter out control characters
-        output = re.sub(re.escape(command) + r"\r\n", "", output)
-        output = re.sub(r"\x1b\[[0-9;]*[a-zA-Z]", "", output)
-
-        return output
-
-    def run(self, args: str) -> str:
-        return self.input(strip_quotes(args))
-
-    def _read_output(self, timeout=0.1):
-        output = []
-        while True:
-            rlist, _, _ = select.select([self.master_fd], [], [], timeout)
-            if not rlist:
-                break
-            try:
-                data = os.read(self.master_fd, 1024)
-                if not data:
-                    break
-                output.append(data.decode())
-            except OSError:
-                break
-
-        return "".join(output)
-
-    def __del__(self):
-        os.close(self.master_fd)
-        os.close(self.slave_fd)
-        self.bash_process.terminate()
-
-    @property
-    def description(self) -> str:
-        return (
-            f"a bash session that can be used to run commands in a single session, even in the background. "
-            f"You can input something into bash's stdin, and then it will run for {self.timeout or 0.5} seconds "
-            f"and return the output. If you want to simply run a standalone command in the project directory "
-            f"and get the output, use the `Bash` tool instead."
-        )
-
-
-@dataclass
-class Terminal(Tool, ABC):
-    """
-    A tool that creates terminal sessions that can be used to run commands, even in the background.
-    """
-
-    # TODO
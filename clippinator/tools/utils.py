@@ -1,9 +1,12 @@
 from __future__ import annotations
 
+import codecs
 import json
 import os
 import subprocess
 import tempfile
+import threading
+from contextlib import contextmanager
 from typing import Any, Union
 
 import inquirer
@@ -56,6 +59,92 @@ def trim_extra(content: str, max_length: int = 4000, end_length: int = 1300) ->
     return content
 
 
+class StreamCapture:
+    """
+    Gives the same text as trim_extra(output, max_length, end_length), but the output is fed in chunks of bytes:
+    they are decoded as they come, and only the first and the last characters are kept
+    """
+
+    def __init__(self, max_length: int = 4000, end_length: int = 1300):
+        self.max_length = max_length
+        self.end_length = end_length
+        self.decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+        self.head = ""
+        self.tail = ""
+        self.length = 0  # characters fed so far
+
+    def feed(self, data: bytes):
+        self._add(self.decoder.decode(data))
+
+    def _add(self, text: str):
+        self.length += len(text)
+        room = self.max_length - self.end_length - len(self.head)
+        if room > 0:
+            self.head += text[:room]
+            text = text[room:]
+        self.tail += text
+        # Cut only when the tail is longer than end_length: the output which fits into max_length is kept whole
+        if len(self.tail) > 2 * self.end_length:
+            self.tail = self.tail[-self.end_length:]
+
+    def text(self) -> str:
+        self._add(self.decoder.decode(b"", final=True))
+        if self.length <= self.max_length:
+            return self.head + self.tail
+        return self.head + f"\n...[skipped {self.length - self.max_length} chars]\n" + self.tail[-self.end_length:]
+
+
+class WriteTracker:
+    """
+    Records which files are written by the tasks running at the same time (the task is set per thread).
+    Writes to the same file are serialized, files written by several tasks are reported as conflicts.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+        self.lock = threading.Lock()
+        self.file_locks: dict[str, threading.Lock] = {}
+        self.written: dict[str, set[str]] = {}  # task -> paths
+
+    @contextmanager
+    def task(self, name: str):
+        self.local.task = name
+        with self.lock:
+            self.written[name] = set()
+        try:
+            yield
+        finally:
+            self.local.task = None
+
+    @contextmanager
+    def writing(self, path: str):
+        task = getattr(self.local, 'task', None)
+        if task is None:
+            yield
+            return
+        path = os.path.realpath(path)
+        with self.lock:
+            file_lock = self.file_locks.setdefault(path, threading.Lock())
+            self.written[task].add(path)
+        with file_lock:
+            yield
+
+    def pop(self, tasks: list[str]) -> tuple[dict[str, set[str]], dict[str, list[str]]]:
+        """
+        Get the files written by each task and the conflicts (path -> tasks), forget the tasks
+        """
+        with self.lock:
+            written = {task: self.written.pop(task, set()) for task in tasks}
+        writers: dict[str, list[str]] = {}
+        for task, paths in written.items():
+            for path in paths:
+                writers.setdefault(path, []).append(task)
+        return written, {path: names for path, names in writers.items() if len(names) > 1}
+
+
+write_tracker = WriteTracker()
+
+
 def unjson(data: str | Any) -> Any:
     if isinstance(data, str):
         return json.loads(data)
@@ -83,7 +172,22 @@ def parse_openai_function_message_custom(
 oai_func_ag._parse_ai_message = parse_openai_function_message_custom
 
 
+# Whether a human can answer the prompts. The SelfCall worker processes have no terminal, they turn it off
+interactive = True
+
+
+def set_interactive(value: bool):
+    global interactive
+    interactive = value
+
+
+def is_interactive() -> bool:
+    return interactive
+
+
 def yes_no_prompt(prompt: str, default: bool = False) -> bool:
+    if not interactive:
+        return default
     answer = inquirer.prompt([inquirer.Confirm('yes_no', message=prompt, default=default)])
     if not answer or not answer.get('yes_no'):
         return default
@@ -91,6 +195,8 @@ def yes_no_prompt(prompt: str, default: bool = False) -> bool:
 
 
 def text_prompt(prompt: str) -> str:
+    if not interactive:
+        return ''
     answer = inquirer.prompt([inquirer.Text('text', message=prompt)])
     if not answer or not answer.get('text'):
         return ''